@@ -0,0 +1,205 @@
+from json_to_stat import *
+from trampoline import trampoline
+
+"""
+.
+The fold_proc function folds the constants of a type checked procedure, before it is
+lowered to TAC (see proc_to_tac in bx2tac.py), so the CFG optimiser gets less TAC.
+
+Integers: the operations on two literals are computed with the 64-bit two's complement
+          arithmetic of the generated code and of tacrun (twoc/untwoc). Divisions by 0,
+          the overflowing division and shifts out of 0..63 are left to run time
+Booleans: comparisons of literals, ! of a literal, && and || with a literal side
+          (an impure operand is never dropped, as it would not be evaluated)
+Literals: x + 0, 0 + x, x - 0, x * 1 and 1 * x are x
+Statements: if with a literal condition is replaced by the branch taken, while (false)
+            is dropped
+
+Like the type checker and the lowering, the fold_* generators are run on an explicit
+stack by trampoline(), the expressions return (expression, pure) where pure means
+that it has no call and no division or remainder that may trap (one whose divisor is
+not a literal other than 0 and -1): dropping it does not change what the program does.
+"""
+
+WORD_BITS = 64
+SIGN = 1 << (WORD_BITS - 1)
+MASK = (1 << WORD_BITS) - 1
+
+
+# The signed 64-bit value of x, wrapped around as by the machine
+def wrap(x):
+    x &= MASK
+    return x - MASK - 1 if x & SIGN else x
+
+
+# Division truncated towards 0 as idivq, None if it traps
+def divide(a, b):
+    if b == 0 or (a == -SIGN and b == -1):
+        return None
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def remainder(a, b):
+    q = divide(a, b)
+    return None if q is None else a - b * q
+
+
+def shift_left(a, b):
+    return a << b if 0 <= b < WORD_BITS else None
+
+
+def shift_right(a, b):
+    return a >> b if 0 <= b < WORD_BITS else None
+
+
+INT_OPS = {
+    'add': lambda a, b: a + b,
+    'sub': lambda a, b: a - b,
+    'mul': lambda a, b: a * b,
+    'div': divide,
+    'mod': remainder,
+    'and': lambda a, b: a & b,
+    'or': lambda a, b: a | b,
+    'xor': lambda a, b: a ^ b,
+    'shl': shift_left,
+    'shr': shift_right,
+}
+
+# The comparisons are lowered to a conditional jump on the two operands (jl a, b, L)
+COMPARISONS = {
+    'jz': lambda a, b: a == b,
+    'jnz': lambda a, b: a != b,
+    'jl': lambda a, b: a < b,
+    'jle': lambda a, b: a <= b,
+    'jnl': lambda a, b: a >= b,
+    'jnle': lambda a, b: a > b,
+}
+
+
+def fold_proc(decl):
+    decl.body = trampoline(fold_statement(decl.body))
+
+
+# Returns the statement to lower instead of instruction, None if there is nothing to lower
+def fold_statement(instruction):
+
+    if isinstance(instruction, StatementBlock):
+        body = []
+        for stmt in instruction.body:
+            if not isinstance(stmt, Statment):
+                for s in stmt:
+                    yield fold_statement(s)
+                body.append(stmt)
+            else:
+                stmt = yield fold_statement(stmt)
+                if stmt is not None:
+                    body.append(stmt)
+        instruction.body = body
+
+    elif isinstance(instruction, StatementVarDecl):
+        instruction.initial = (yield fold_expr(instruction.initial))[0]
+
+    elif isinstance(instruction, (StatementAssign, StatementEval)):
+        instruction.expr = (yield fold_expr(instruction.expr))[0]
+
+    elif isinstance(instruction, StatementReturn):
+        if instruction.expr is not None:
+            instruction.expr = (yield fold_expr(instruction.expr))[0]
+
+    elif isinstance(instruction, StatementWhile):
+        instruction.condition = (yield fold_expr(instruction.condition))[0]
+        if isinstance(instruction.condition, ExpressionBool) and instruction.condition.value == 'false':
+            return None
+        instruction.instructions = yield fold_statement(instruction.instructions)
+
+    elif isinstance(instruction, StatementIf):
+        instruction.condition = (yield fold_expr(instruction.condition))[0]
+        if isinstance(instruction.condition, ExpressionBool):
+            if instruction.condition.value == 'true':
+                return (yield fold_statement(instruction.instructions))
+            if instruction.else_case is None:
+                return None
+            return (yield fold_statement(instruction.else_case))
+
+        instruction.instructions = yield fold_statement(instruction.instructions)
+        if instruction.else_case is not None:
+            instruction.else_case = yield fold_statement(instruction.else_case)
+
+    return instruction
+
+
+# The leaves are returned by fold_expr() directly, the other expressions by this generator
+def fold_expr(expression):
+    if isinstance(expression, (ExpressionInt, ExpressionBool, ExpressionVar)):
+        return expression, True
+    return fold_expr_node(expression)
+
+
+def fold_expr_node(expression):
+
+    if isinstance(expression, ExpressionUniOp):
+        arg, pure = yield fold_expr(expression.arg)
+        expression.arg = arg
+        if isinstance(arg, ExpressionInt):
+            if expression.op == 'neg':
+                return ExpressionInt(wrap(-arg.value), expression.lineno, expression.col), True
+            if expression.op == 'not':
+                return ExpressionInt(wrap(~arg.value), expression.lineno, expression.col), True
+        elif isinstance(arg, ExpressionBool) and expression.op == 'NOT':
+            value = 'false' if arg.value == 'true' else 'true'
+            return ExpressionBool(value, expression.lineno, expression.col), True
+        return expression, pure
+
+    elif isinstance(expression, ExpressionBinOp):
+        left, left_pure = yield fold_expr(expression.arg_left)
+        right, right_pure = yield fold_expr(expression.arg_right)
+        expression.arg_left = left
+        expression.arg_right = right
+        op = expression.op
+
+        if op in ('AND', 'OR'):
+            # The value that decides the result without the other operand
+            decisive = 'false' if op == 'AND' else 'true'
+            if isinstance(left, ExpressionBool):
+                return (left, True) if left.value == decisive else (right, right_pure)
+            if isinstance(right, ExpressionBool):
+                if right.value != decisive:
+                    return left, left_pure
+                if left_pure:
+                    return right, True
+
+        elif isinstance(left, ExpressionInt) and isinstance(right, ExpressionInt):
+            a, b = wrap(left.value), wrap(right.value)
+            if op in COMPARISONS:
+                value = 'true' if COMPARISONS[op](a, b) else 'false'
+                return ExpressionBool(value, expression.lineno, expression.col), True
+            value = INT_OPS[op](a, b)
+            if value is not None:
+                return ExpressionInt(wrap(value), expression.lineno, expression.col), True
+
+        elif isinstance(left, ExpressionBool) and isinstance(right, ExpressionBool):
+            value = 'true' if (left.value == right.value) == (op == 'jz') else 'false'
+            return ExpressionBool(value, expression.lineno, expression.col), True
+
+        elif isinstance(right, ExpressionInt) and (right.value == 0 and op in ('add', 'sub') or
+                                                   right.value == 1 and op == 'mul'):
+            return left, left_pure
+
+        elif isinstance(left, ExpressionInt) and (left.value == 0 and op == 'add' or
+                                                  left.value == 1 and op == 'mul'):
+            return right, right_pure
+
+        # The division traps on 0, and on -1 if the dividend is the smallest integer
+        if op in ('div', 'mod') and not (isinstance(right, ExpressionInt) and wrap(right.value) not in (0, -1)):
+            return expression, False
+        return expression, left_pure and right_pure
+
+    elif isinstance(expression, ExpressionCall):
+        args = []
+        for arg in expression.args:
+            args.append((yield fold_expr(arg))[0])
+        expression.args = args
+        return expression, False
+
+    return expression, True
@@ -2,87 +2,98 @@ import sys
 import getopt
 
 from json_to_stat import *
-from parser import Parser
+from parser import make_parser
+from context import CompilationContext, CompileError
+from timing import count_nodes
 
 
 """
 .
 The bx2front function takes source code and an optional filename and performs the following steps:
 
-It creates a Parser object and calls its parse() method to transform the source code into an Abstract Syntax Tree (AST).
+It creates a parser (see make_parser() in parser.py) and calls its parse() method to transform the source code into an Abstract Syntax Tree (AST).
 It analyzes the top-level declarations (functions and global variables):
 
 Function Declarations Check:
 Verifies there are no duplicate function declarations
 Checks if a main() function exists and is of type void
-Records function signatures (return type, line number, parameter types) in the global scope
+Declares each function in the global scope of the SymbolTable, with its return type, line number and parameter types
 
 Global Variable Declarations Check:
 Verifies there are no duplicate global variable declarations
 Validates that global int variables are initialised with number literals
 Validates that global bool variables are initialised with boolean literals
-Records variable types and line numbers in the global scope
+Declares each variable in the global scope of the SymbolTable, with its type and line number
 
 Type Checking: Calls type_check() on each function declaration, which recursively type-checks statements and expressions within the function body.
-Scope Management: At the end, it pops the current scope and creates a new empty scope.
+Name Resolution: Every declaration gets a symbol ID and every variable use is annotated with the ID it refers to (see symbols.py).
 
-Has error handling
+All the state lives in the CompilationContext (a fresh one is made if none is given),
+errors are raised as CompileError
 """
 
 
-def bx2front(code, filename=""):
-    main_found = False
-    parser = Parser(code, filename)
+def bx2front(code, filename="", ctx=None):
+    if ctx is None:
+        ctx = CompilationContext(filename, code)
+
+    parser = make_parser(code, filename)
+    ctx.stats.time_lexer('scan', parser.lex)
+
+    with ctx.stats.phase('parse'):
+        instructions = parser.parse()
+    if ctx.stats.enabled:
+        ctx.stats.size('AST nodes', count_nodes(instructions))
+
+    with ctx.stats.phase('typecheck'):
+        check_program(ctx, instructions)
+
+    return instructions
+
+
+# Checks the top-level declarations, then type checks every procedure
+def check_program(ctx, instructions):
+    declare_globals(ctx, instructions)
+
+    for instruction in instructions:
+        if isinstance(instruction, ProcDec):
+            instruction.type_check(ctx)
+
 
-    instructions = parser.parse()
+# Checks the top-level declarations and declares them in the global scope,
+# only the signatures of the procedures are used
+def declare_globals(ctx, instructions):
+    symbols = ctx.symbols
+    main_found = False
     for instruction in instructions:
         if isinstance(instruction, ProcDec):
-            if instruction.name in scopes[0]:
-                print(f'File "{filename}", line {instruction.lineno}')
-                print('Error: Redecalred procedure "{instruction.name}" within the scope'.format(instruction.name))
-                print(f':line {scopes[0][instruction.name][1]}:Info:Declartion of "{instruction.name}"')
-                sys.exit(1)
+            if symbols.glob(instruction.name) is not None:
+                ctx.error(instruction.lineno, f'Redecalred procedure "{instruction.name}" within the scope',
+                          f':line {symbols.linenos[symbols.glob(instruction.name)]}:Info:Declartion of "{instruction.name}"')
 
             if instruction.name == "main":
                 if instruction.type != "void":
-                    print(f'File "{filename}", line {instruction.lineno}')
-                    print(f'Error: main() procedure has to be of type "void"')
-                    sys.exit(1)
+                    ctx.error(instruction.lineno, f'main() procedure has to be of type "void"')
                 main_found = True
 
-            scopes[0][instruction.name] = (instruction.type, instruction.lineno, [arg.type for arg in instruction.args])
+            instruction.symbol = symbols.declare(instruction.name, instruction.type, instruction.lineno,
+                                                 [arg.type for arg in instruction.args])
         else:
             for var in instruction:
-                if var.name in scopes[0]:
-                    print(f'File "{filename}", line {instruction.lineno}')
-                    print(f'Error: Redecalred global variable "{var.name}" within the scope')
-                    print(f':line {scopes[0][var.name][1]}:Info:Declartion of "{var.name}"')
-                    sys.exit(1)
+                if symbols.glob(var.name) is not None:
+                    ctx.error(var.lineno, f'Redecalred global variable "{var.name}" within the scope',
+                              f':line {symbols.linenos[symbols.glob(var.name)]}:Info:Declartion of "{var.name}"')
 
-                if var.type == 'int' and not isinstance(var.initial, Number):
-                    print(f'File "{filename}", line {var.initial.lineno}')
-                    print(f'Error: Global variable "{var.name}" of type int decalred with a non-number value "{var.initial}"')
-                    sys.exit(1)
+                if var.type == 'int' and not isinstance(var.initial, ExpressionInt):
+                    ctx.error(var.initial.lineno, f'Global variable "{var.name}" of type int decalred with a non-number value')
 
-                if var.type == 'bool' and not isinstance(var.initial, Bool):
-                    print(f'File "{filename}", line {var.initial.lineno}')
-                    print(f'Error: Global variable "{var.name}" of type bool decalred with a non-bool value "{var.initial}"')
-                    sys.exit(1)
+                if var.type == 'bool' and not isinstance(var.initial, ExpressionBool):
+                    ctx.error(var.initial.lineno, f'Global variable "{var.name}" of type bool decalred with a non-bool value')
 
-                scopes[0][var.name] = (var.type, var.lineno)
+                var.symbol = symbols.declare(var.name, var.type, var.lineno)
 
     if not main_found:
-        print(f'File "{filename}"')
-        print('Error: Program does not contain a main() procedure')
-        sys.exit(1)
-
-    for instruction in instructions:
-        if isinstance(instruction, ProcDec):
-            instruction.type_check()
-
-    scopes.pop()
-    scopes.append(dict())
-    return instructions
+        ctx.error(None, 'Program does not contain a main() procedure')
 
 
 if __name__ == '__main__':
@@ -96,5 +107,10 @@ if __name__ == '__main__':
     with open(filename, 'r') as file:
         code = file.read()
 
-    print(bx2front(code, filename))
-    print(scopes)
+    ctx = CompilationContext(filename, code)
+    try:
+        print(bx2front(code, filename, ctx))
+    except CompileError as e:
+        print(e)
+        sys.exit(1)
+    print(ctx.symbols)
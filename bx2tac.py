@@ -1,458 +1,483 @@
-import json
 import sys
 import getopt
 
 from json_to_stat import *
 from bx2front import bx2front
-
-filename = ''
-next_temorary = 0
-next_label = 0
-__break_stack = []
-__continue_stack = []
+from ast_fold import fold_proc
+from callgraph import CallGraph
+from context import CompilationContext
+from trampoline import trampoline
+from tac import Instr, Proc, Gvar
 
 """
 .
 The main function bx2tac takes BX source code and a filename, runs it through the frontend (bx2front), 
-and then converts the resulting AST into TAC (Three-Address Code), finally outputting it as JSON.
-
-Has error checking
+and then converts the resulting AST into TAC (Three-Address Code), returned as the Gvar and Proc
+objects of tac.py.
+The procedures main never calls, directly or not, are not lowered (see callgraph.py).
+
+Every function takes the CompilationContext holding the symbol table, the temporary and label
+counters and the loop stacks. Variables are found through the symbol ID the type checker
+stored in them: ctx.symbols.homes[symbol] is the global, argument or temporary holding it. Errors are raised as CompileError through ctx.error()
+
+The operands of the operations, comparisons and params are literals as immediates and
+variables as their home directly (see lower_operand()), only the other expressions get
+a temporary: x + 1 is the single instruction add x, 1. A comparison in a condition is
+one conditional jump on its two operands, jl a, b, Lt, then jmp Lf.
+A boolean value is computed without branches when that is safe (see lower_bool_value()):
+var b = x < y : bool is setl x, y.
+
+The lower_* generators yield the lowering of their sub-expressions and sub-statements
+instead of calling it, and are run on an explicit stack by trampoline(), so the depth
+of the program is not limited by the Python stack. expr_to_tac(), bool_exp(), ... run them.
 """
 
 # Handles expressions with no return value
-def void_exp(expression, tac):
-    global next_temorary
-    global filename
-
+def lower_void(ctx, expression, tac):
     if expression.type != 'void':
-        print(f'File "{filename}", line {expression.lineno}')
-        print(f'Error: Unexpected expression type "{expression.type}"')
-        sys.exit(1)
+        ctx.error(expression.lineno, f'Unexpected expression type "{expression.type}"')
 
     if isinstance(expression, ExpressionCall):
-        for i, arg in enumerate(expression.args):
-            result = '%' + str(next_temorary)
-            next_temorary += 1
+        yield lower_params(ctx, expression, tac)
+        return "call", ["@" + expression.function, len(expression.args)]
 
-            if arg.type == 'int':
-                op, args = expr_to_tac(arg, tac)
-                tac["body"].append({"opcode": op, "args": args, "result": result})
+    else:
+        ctx.error(expression.lineno, f'Unrecognized expression "{expression}"')
 
-            elif arg.type == 'bool':
-                temp = evaluate_bool_expr(arg, tac)
-                tac['body'].append({'opcode': 'copy', 'args': [temp], 'result': result})
-            else:
-                print(f'File "{filename}", line {arg.lineno}')
-                print(f'Error: Argument has unknown type "{arg.type}"')
-                sys.exit(1)
+# Converts boolean expressions to integers (0/1), returns the operand holding the value.
+# It is computed without branches (see lower_flat()) unless a side of && or || that may
+# not be evaluated has a call or a division
+def lower_bool_value(ctx, expression, tac):
+    if branch_free(expression):
+        return lower_flat(ctx, expression, tac)
+    return lower_bool_branches(ctx, expression, tac)
 
-            if i == 6 and len(expression.args) & 1:
-                tac["body"].append({'opcode': 'param', "args": [i + 1, result], 'result': None})
 
-            if i >= 6 and len(expression.args) & 1:
-                tac["body"].append({'opcode': 'param', "args": [i + 2, result], 'result': None})
-            else:
-                tac["body"].append({'opcode': 'param', "args": [i + 1, result], 'result': None})
+def lower_bool_branches(ctx, expression, tac):
+    temp = ctx.new_temporary()
+    Lt = ctx.new_label()
+    Lf = ctx.new_label()
 
-        return "call", ["@" + expression.function, len(expression.args)]
+    tac.body.append(Instr('const', 0, None, temp))
+    yield lower_bool(ctx, expression, Lt, Lf, tac)
+    tac.body.append(Instr('label', Lt))
+    tac.body.append(Instr('const', 1, None, temp))
+    tac.body.append(Instr('label', Lf))
 
-    else:
-        print(f'File "{filename}", line {expression.lineno}')
-        print(f'Error: Unrecognized expression "{expression}"')
-        sys.exit(1)
+    return temp
+
+# True if evaluating every operand of the boolean expression has the same effect as the
+# short-circuit evaluation: no call and no division (it may trap) on the right of && or ||.
+# The arguments of the calls are not walked, they are lowered on their own
+def branch_free(expression):
+    stack = [(expression, False)]
+    while stack:
+        node, guarded = stack.pop()
+        if isinstance(node, ExpressionCall):
+            if guarded:
+                return False
+        elif isinstance(node, ExpressionUniOp):
+            stack.append((node.arg, guarded))
+        elif isinstance(node, ExpressionBinOp):
+            if guarded and node.op in ('div', 'mod'):
+                return False
+            stack.append((node.arg_left, guarded))
+            stack.append((node.arg_right, guarded or node.op in ('AND', 'OR')))
+    return True
+
+# The value of a branch free boolean expression: literals as immediates, variables as their
+# home, comparisons with set<cc> (setl a, b is 1 if a < b), ! with xor and && and || with
+# and and or. The leaves are returned directly, the other expressions by lower_flat_node()
+def lower_flat(ctx, expression, tac):
+    if isinstance(expression, ExpressionBool):
+        return 1 if expression.value == 'true' else 0
+
+    elif isinstance(expression, ExpressionVar):
+        return ctx.symbols.homes[expression.symbol]
 
-# Converts boolean expressions to integers (0/1)
-def evaluate_bool_expr(expression, tac):
-    global next_temorary
-    global next_label
+    return lower_flat_node(ctx, expression, tac)
 
-    temp = '%' + str(next_temorary)
-    next_temorary += 1
+
+def lower_flat_node(ctx, expression, tac):
 
     if isinstance(expression, ExpressionCall):
-        expression.type = "int"
-        op, args = expr_to_tac(expression, tac)
-        tac["body"].append({'opcode': op, 'args': args, 'result': temp})
-        expression = "bool"
-    else:
-        Lt = "%.L" + str(next_label)
-        next_label += 1
-        Lf = "%.L" + str(next_label)
-        next_label += 1
+        op, args = yield lower_expr_node(ctx, expression, tac)
+
+    elif isinstance(expression, ExpressionUniOp):
+        arg = yield lower_flat(ctx, expression.arg, tac)
+        op, args = 'xor', [arg, 1]
 
-        tac['body'].append({'opcode': 'const', 'args': [0], 'result': temp})
-        bool_exp(expression, Lt, Lf, tac)
-        tac['body'].append({'opcode': 'label', 'args': [Lt], 'result': None})
-        tac['body'].append({'opcode': 'const', 'args': [1], 'result': temp})
-        tac['body'].append({'opcode': 'label', 'args': [Lf], 'result': None})
+    elif expression.op in ('AND', 'OR'):
+        arg1 = yield lower_flat(ctx, expression.arg_left, tac)
+        arg2 = yield lower_flat(ctx, expression.arg_right, tac)
+        op, args = expression.op.lower(), [arg1, arg2]
 
+    else:
+        lower = lower_operand if expression.arg_left.type == 'int' else lower_flat
+        arg1, arg2 = yield lower_operands(ctx, expression.arg_left, expression.arg_right, tac, lower)
+        op, args = 'set' + expression.op[1:], [arg1, arg2]
+
+    temp = ctx.new_temporary()
+    tac.body.append(Instr(op, *args, dest=temp))
     return temp
 
 # Handles boolean expressions with control flow
-def bool_exp(expression, Lt, Lf, tac):
-    global next_temorary
-    global next_label
-    global filename
+def lower_bool(ctx, expression, Lt, Lf, tac):
 
     if expression.type != 'bool':
-        print(f'File "{filename}", line {expression.lineno}')
-        print(f'Error: Unexpected expression type "{expression.type}"')
-        sys.exit(1)
+        ctx.error(expression.lineno, f'Unexpected expression type "{expression.type}"')
 
     if isinstance(expression, ExpressionBool):
         if expression.value == 'true':
-            tac['body'].append({"opcode": "jmp", "args": [Lt], "result": None})
+            tac.body.append(Instr('jmp', Lt))
         elif expression.value == 'false':
-            tac['body'].append({"opcode": "jmp", "args": [Lf], "result": None})
+            tac.body.append(Instr('jmp', Lf))
         else:
-            print(f'File "{filename}", line {expression.lineno}')
-            print(f'Error: Unknown bool value "{expression.value}"')
-            sys.exit(1)
+            ctx.error(expression.lineno, f'Unknown bool value "{expression.value}"')
 
     elif isinstance(expression, ExpressionVar):
-        for scope in reversed(scopes):
-            if expression.name in scope:
-                value = scope[expression.name][0]
-                tac['body'].append({'opcode': 'jz', 'args': [value, Lf], 'result': None})
-                tac['body'].append({'opcode': 'jmp', 'args': [Lt], 'result': None})
-                break
+        value = ctx.symbols.homes[expression.symbol]
+        tac.body.append(Instr('jz', value, Lf))
+        tac.body.append(Instr('jmp', Lt))
 
-    elif isinstance(expression, ExpressionUniOp):
+    else:
+        return lower_bool_node(ctx, expression, Lt, Lf, tac)
+
+# The leaves are lowered by lower_bool() directly, the other expressions by this generator
+def lower_bool_node(ctx, expression, Lt, Lf, tac):
+
+    if isinstance(expression, ExpressionUniOp):
         if expression.arg.type == 'bool':
-            bool_exp(expression.arg, Lf, Lt, tac)
+            yield lower_bool(ctx, expression.arg, Lf, Lt, tac)
         elif expression.arg.type == 'int':
-            arg = '%' + str(next_temorary)
-            next_temorary += 1
+            arg = ctx.new_temporary()
 
-            op, args = expr_to_tac(expression.arg, tac)
-            tac["body"].append({"opcode": op, "args": args, "result": arg})
+            op, args = yield lower_expr(ctx, expression.arg, tac)
+            tac.body.append(Instr(op, *args, dest=arg))
 
-            tac["body"].append({"opcode": 'jz', 'args': [arg, Lt], 'result': None})
-            tac['body'].append({"opcode": "jmp", 'args': [Lf], 'result': None})
+            tac.body.append(Instr('jz', arg, Lt))
+            tac.body.append(Instr('jmp', Lf))
 
     elif isinstance(expression, ExpressionBinOp):
         if expression.op in ['jz', 'jnz', 'jl', 'jle', 'jnle', 'jnl']:
-            arg1 = '%' + str(next_temorary)
-            next_temorary += 1
-
-            if expression.arg_left.type == 'int':
-                op, args = expr_to_tac(expression.arg_left, tac)
-                tac["body"].append({"opcode": op, "args": args, "result": arg1})
-
-            elif expression.arg_left.type == 'bool':
-                temp = evaluate_bool_expr(expression.arg_left, tac)
-                tac["body"].append({"opcode": 'copy', 'args': [temp], "result": arg1})
-
-            arg2 = '%' + str(next_temorary)
-            next_temorary += 1
-
-            if expression.arg_right.type == 'int':
-                op, args = expr_to_tac(expression.arg_right, tac)
-                tac["body"].append({"opcode": op, "args": args, "result": arg2})
-
-            elif expression.arg_right.type == 'bool':
-                temp = evaluate_bool_expr(expression.arg_right, tac)
-                tac["body"].append({"opcode": 'copy', 'args': [temp], "result": arg2})
-
-            tac["body"].append({'opcode': "sub", 'args': [arg1, arg2], "result": arg1})
-            tac["body"].append({"opcode": expression.op, 'args': [arg1, Lt], 'result': None})
-            tac['body'].append({"opcode": "jmp", 'args': [Lf], 'result': None})
+            arg1, arg2 = yield lower_operands(ctx, expression.arg_left, expression.arg_right, tac)
+            tac.body.append(Instr(expression.op, arg1, arg2, arg3=Lt))
+            tac.body.append(Instr('jmp', Lf))
 
         elif expression.op == 'AND':
-            Li = "%.L" + str(next_label)
-            next_label += 1
+            Li = ctx.new_label()
 
-            bool_exp(expression.arg_left, Li, Lf, tac)
-            tac['body'].append({"opcode": 'label',  'args': [Li], 'result': None})
-            bool_exp(expression.arg_right, Lt, Lf, tac)
+            yield lower_bool(ctx, expression.arg_left, Li, Lf, tac)
+            tac.body.append(Instr('label', Li))
+            yield lower_bool(ctx, expression.arg_right, Lt, Lf, tac)
 
         elif expression.op == 'OR':
-            Li = "%.L" + str(next_label)
-            next_label += 1
+            Li = ctx.new_label()
 
-            bool_exp(expression.arg_left, Lt, Li, tac)
-            tac['body'].append({"opcode": 'label',  'args': [Li], 'result': None})
-            bool_exp(expression.arg_right, Lt, Lf, tac)
+            yield lower_bool(ctx, expression.arg_left, Lt, Li, tac)
+            tac.body.append(Instr('label', Li))
+            yield lower_bool(ctx, expression.arg_right, Lt, Lf, tac)
 
         else:
-            print(f'File "{filename}", line {expression.lineno}')
-            print(f'Error: Unknown binary opperation "{expression.op}"')
-            sys.exit(1)
+            ctx.error(expression.lineno, f'Unknown binary opperation "{expression.op}"')
 
     elif isinstance(expression, ExpressionCall):
-        temp = '%' + str(next_temorary)
-        next_temorary += 1
-
-        for i, arg in enumerate(expression.args):
-            result = '%' + str(next_temorary)
-            next_temorary += 1
+        temp = ctx.new_temporary()
 
-            if arg.type == 'int':
-                op, args = expr_to_tac(arg, tac)
-                tac["body"].append({"opcode": op, "args": args, "result": result})
-
-            elif arg.type == 'bool':
-                temp = evaluate_bool_expr(arg, tac)
-                tac['body'].append({'opcode': 'copy', 'args': [temp], 'result': result})
-
-            if i == 6 and len(expression.args) & 1:
-                tac["body"].append({'opcode': 'param', "args": [i + 1, result], 'result': None})
-
-            if i >= 6 and len(expression.args) & 1:
-                tac["body"].append({'opcode': 'param', "args": [i + 2, result], 'result': None})
-            else:
-                tac["body"].append({'opcode': 'param', "args": [i + 1, result], 'result': None})
+        yield lower_params(ctx, expression, tac)
 
-        tac["body"].append({"opcode": "call", 'args': ["@" + expression.function, len(expression.args)], 'result': temp})
-        tac['body'].append({'opcode': 'jz', 'args': [temp, Lf], 'result': None})
-        tac['body'].append({'opcode': 'jmp', 'args': [Lt], 'result': None})
+        tac.body.append(Instr('call', "@" + expression.function, len(expression.args), temp))
+        tac.body.append(Instr('jz', temp, Lf))
+        tac.body.append(Instr('jmp', Lt))
 
     else:
-        print(f'File "{filename}", line {expression.lineno}')
-        print(f'Error: Unrecognized expression "{expression}"')
-        sys.exit(1)
+        ctx.error(expression.lineno, f'Unrecognized expression "{expression}"')
 
 # Converts integer expressions to TAC
-def expr_to_tac(expression, tac):
-    global next_temorary
-    global filename
+def lower_expr(ctx, expression, tac):
 
     if expression.type != 'int':
-        print(f'File "{filename}", line {expression.lineno}')
-        print(f'Error: Unexpected expression type "{expression.type}"')
-        sys.exit(1)
+        ctx.error(expression.lineno, f'Unexpected expression type "{expression.type}"')
 
     if isinstance(expression, ExpressionInt):
         return "const", [expression.value]
 
     elif isinstance(expression, ExpressionVar):
-        for scope in reversed(scopes):
-            if expression.name in scope:
-                return "copy", [scope[expression.name][0]]
+        return "copy", [ctx.symbols.homes[expression.symbol]]
 
-    elif isinstance(expression, ExpressionUniOp):
-        arg1 = '%' + str(next_temorary)
-        next_temorary += 1
+    return lower_expr_node(ctx, expression, tac)
 
-        op, args = expr_to_tac(expression.arg, tac)
-        tac["body"].append({"opcode": op, "args": args, "result": arg1})
+# The leaves are lowered by lower_expr() directly, the other expressions by this generator
+def lower_expr_node(ctx, expression, tac):
 
+    if isinstance(expression, ExpressionUniOp):
+        arg1 = yield lower_operand(ctx, expression.arg, tac)
         return expression.op, [arg1]
 
     elif isinstance(expression, ExpressionBinOp):
-        arg1 = '%' + str(next_temorary)
-        next_temorary += 1
+        arg1, arg2 = yield lower_operands(ctx, expression.arg_left, expression.arg_right, tac)
+        return expression.op, [arg1, arg2]
 
-        op, args = expr_to_tac(expression.arg_left, tac)
-        tac["body"].append({"opcode": op, "args": args, "result": arg1})
+    elif isinstance(expression, ExpressionCall):
+        yield lower_params(ctx, expression, tac)
 
-        arg2 = '%' + str(next_temorary)
-        next_temorary += 1
+        return "call", ["@" + expression.function, len(expression.args)]
 
-        op, args = expr_to_tac(expression.arg_right, tac)
-        tac["body"].append({"opcode": op, "args": args, "result": arg2})
+    else:
+        ctx.error(expression.lineno, f'Unrecognized expression "{expression}"')
 
-        return expression.op, [arg1, arg2]
+# An expression as an instruction operand: the value of an int literal, the home of a
+# variable, the value of a boolean (lower_bool_value()), else a new temporary holding it
+def lower_operand(ctx, expression, tac):
+    if isinstance(expression, ExpressionInt):
+        return expression.value
 
-    elif isinstance(expression, ExpressionCall):
-        for i, arg in enumerate(expression.args):
-            result = '%' + str(next_temorary)
-            next_temorary += 1
+    elif isinstance(expression, ExpressionVar):
+        return ctx.symbols.homes[expression.symbol]
 
-            if arg.type == 'int':
-                op, args = expr_to_tac(arg, tac)
-                tac["body"].append({"opcode": op, "args": args, "result": result})
+    elif expression.type == 'bool':
+        return lower_bool_value(ctx, expression, tac)
 
-            elif arg.type == 'bool':
-                temp = evaluate_bool_expr(arg, tac)
-                tac['body'].append({'opcode': 'copy', 'args': [temp], 'result': result})
+    return lower_temporary(ctx, expression, tac)
 
-            if i == 6 and len(expression.args) & 1:
-                tac["body"].append({'opcode': 'param', "args": [i + 1, result], 'result': None})
 
-            if i >= 6 and len(expression.args) & 1:
-                tac["body"].append({'opcode': 'param', "args": [i + 2, result], 'result': None})
-            else:
-                tac["body"].append({'opcode': 'param', "args": [i + 1, result], 'result': None})
+# The instruction setting dest to an operand
+def copy_operand(operand, dest):
+    return Instr('const' if isinstance(operand, int) else 'copy', operand, None, dest)
 
-        return "call", ["@" + expression.function, len(expression.args)]
 
+def lower_temporary(ctx, expression, tac):
+    temp = ctx.new_temporary()
+    op, args = yield lower_expr(ctx, expression, tac)
+    tac.body.append(Instr(op, *args, dest=temp))
+    return temp
+
+# The operands of a binary operation, each one lowered by lower. A global variable on the
+# left is copied first when the right side may call a procedure, as the call could assign it
+def lower_operands(ctx, left, right, tac, lower=lower_operand):
+    if isinstance(left, ExpressionVar) and ctx.symbols.homes[left.symbol][0] == '@' and \
+            not isinstance(right, (ExpressionInt, ExpressionBool, ExpressionVar)):
+        arg1 = ctx.new_temporary()
+        tac.body.append(Instr('copy', ctx.symbols.homes[left.symbol], None, arg1))
     else:
-        print(f'File "{filename}", line {expression.lineno}')
-        print(f'Error: Unrecognized expression "{expression}"')
-        sys.exit(1)
+        arg1 = yield lower(ctx, left, tac)
+    arg2 = yield lower(ctx, right, tac)
+    return arg1, arg2
+
+# The arguments of a call, each one followed by its param instruction
+def lower_params(ctx, expression, tac):
+    for i, arg in enumerate(expression.args):
+        if arg.type not in ('int', 'bool'):
+            ctx.error(arg.lineno, f'Argument has unknown type "{arg.type}"')
+        result = yield lower_operand(ctx, arg, tac)
+
+        if i == 6 and len(expression.args) & 1:
+            tac.body.append(Instr('param', i + 1, result))
+
+        if i >= 6 and len(expression.args) & 1:
+            tac.body.append(Instr('param', i + 2, result))
+        else:
+            tac.body.append(Instr('param', i + 1, result))
 
 # Converts statements to TAC instructions
-def statements_to_tac(instruction, tac):
-    global next_temorary
-    global next_label
-    global filename
+def lower_statement(ctx, instruction, tac):
 
     if isinstance(instruction, StatementBlock):
-        scopes.append(dict())
         for stmt in instruction.body:
             if not isinstance(stmt, Statment):
                 for s in stmt:
-                    statements_to_tac(s, tac)
+                    yield lower_statement(ctx, s, tac)
             else:
-                statements_to_tac(stmt, tac)
-        scopes.pop()
+                yield lower_statement(ctx, stmt, tac)
 
     elif isinstance(instruction, StatementVarDecl):
-        result = '%' + str(next_temorary)
-        next_temorary += 1
+        result = ctx.new_temporary()
 
         if instruction.type == 'int':
-            op, args = expr_to_tac(instruction.initial, tac)
-            tac["body"].append({"opcode": op, "args": args, "result": result})
+            op, args = yield lower_expr(ctx, instruction.initial, tac)
+            tac.body.append(Instr(op, *args, dest=result))
 
         elif instruction.type == 'bool':
-            temp = evaluate_bool_expr(instruction.initial, tac)
-            tac['body'].append({'opcode': 'copy', 'args': [temp], 'result': result})
+            temp = yield lower_bool_value(ctx, instruction.initial, tac)
+            tac.body.append(copy_operand(temp, result))
 
-        scopes[-1][instruction.name] = (result, instruction.lineno)
+        ctx.symbols.homes[instruction.symbol] = result
 
     elif isinstance(instruction, StatementAssign):
-        for scope in reversed(scopes):
-            if instruction.target.name in scope:
-
-                result = scope[instruction.target.name][0]
+        result = ctx.symbols.homes[instruction.target.symbol]
 
-                if instruction.type == 'int':
-                    op, args = expr_to_tac(instruction.expr, tac)
-                    tac["body"].append({"opcode": op, "args": args, "result": result})
+        if instruction.type == 'int':
+            op, args = yield lower_expr(ctx, instruction.expr, tac)
+            tac.body.append(Instr(op, *args, dest=result))
 
-                elif instruction.type == 'bool':
-                    temp = evaluate_bool_expr(instruction.expr, tac)
-                    tac['body'].append({'opcode': 'copy', 'args': [temp], 'result': result})
-                break
+        elif instruction.type == 'bool':
+            temp = yield lower_bool_value(ctx, instruction.expr, tac)
+            tac.body.append(copy_operand(temp, result))
 
     elif isinstance(instruction, StatementIf):
-        Lt = "%.L" + str(next_label)
-        next_label += 1
-        Lf = "%.L" + str(next_label)
-        next_label += 1
+        Lt = ctx.new_label()
+        Lf = ctx.new_label()
 
-        bool_exp(instruction.condition, Lt, Lf, tac)
-        tac["body"].append({'opcode': 'label', 'args': [Lt], 'result': None})
-        statements_to_tac(instruction.instructions, tac)
+        yield lower_bool(ctx, instruction.condition, Lt, Lf, tac)
+        tac.body.append(Instr('label', Lt))
+        yield lower_statement(ctx, instruction.instructions, tac)
 
         if instruction.else_case is None:
-            tac["body"].append({'opcode': 'label', 'args': [Lf], 'result': None})
+            tac.body.append(Instr('label', Lf))
         else:
-            Lo = "%.L" + str(next_label)
-            next_label += 1
-            tac["body"].append({'opcode': 'jmp', 'args': [Lo], 'result': None})
-            tac["body"].append({'opcode': 'label', 'args': [Lf], 'result': None})
-            statements_to_tac(instruction.else_case, tac)
-            tac["body"].append({'opcode': 'label', 'args': [Lo], 'result': None})
+            Lo = ctx.new_label()
+            tac.body.append(Instr('jmp', Lo))
+            tac.body.append(Instr('label', Lf))
+            yield lower_statement(ctx, instruction.else_case, tac)
+            tac.body.append(Instr('label', Lo))
 
     elif isinstance(instruction, StatementWhile):
-        Lhead = "%.L" + str(next_label)
-        next_label += 1
-        tac["body"].append({'opcode': 'label', 'args': [Lhead], 'result': None})
-
-        Lbod = "%.L" + str(next_label)
-        next_label += 1
-        Lend = "%.L" + str(next_label)
-        next_label += 1
-
-        __break_stack.append(Lend)
-        __continue_stack.append(Lhead)
-        bool_exp(instruction.condition, Lbod, Lend, tac)
-        tac["body"].append({'opcode': 'label', 'args': [Lbod], 'result': None})
-        statements_to_tac(instruction.instructions, tac)
-        tac["body"].append({'opcode': 'jmp', 'args': [Lhead], 'result': None})
-        tac["body"].append({'opcode': 'label', 'args': [Lend], 'result': None})
-        __continue_stack.pop()
-        __break_stack.pop()
+        Lhead = ctx.new_label()
+        tac.body.append(Instr('label', Lhead))
+
+        Lbod = ctx.new_label()
+        Lend = ctx.new_label()
+
+        ctx.break_stack.append(Lend)
+        ctx.continue_stack.append(Lhead)
+        yield lower_bool(ctx, instruction.condition, Lbod, Lend, tac)
+        tac.body.append(Instr('label', Lbod))
+        yield lower_statement(ctx, instruction.instructions, tac)
+        tac.body.append(Instr('jmp', Lhead))
+        tac.body.append(Instr('label', Lend))
+        ctx.continue_stack.pop()
+        ctx.break_stack.pop()
 
     elif isinstance(instruction, StructuredJump):
         if instruction.jump_type == 'break':
-            if len(__break_stack) == 0:
-                print(f'File "{filename}", line {instruction.lineno}')
-                print(f'Error: Break instruction out of loop')
-                sys.exit(1)
+            if len(ctx.break_stack) == 0:
+                ctx.error(instruction.lineno, f'Break instruction out of loop')
 
-            tac['body'].append({'opcode': 'jmp', 'args': [__break_stack[-1]], 'result': None})
+            tac.body.append(Instr('jmp', ctx.break_stack[-1]))
 
         elif instruction.jump_type == 'continue':
-            if len(__continue_stack) == 0:
-                print(f'File "{filename}", line {instruction.lineno}')
-                print(f'Error: Continue instruction out of loop')
-                sys.exit(1)
+            if len(ctx.continue_stack) == 0:
+                ctx.error(instruction.lineno, f'Continue instruction out of loop')
 
-            tac['body'].append({'opcode': 'jmp', 'args': [__continue_stack[-1]], 'result': None})
+            tac.body.append(Instr('jmp', ctx.continue_stack[-1]))
 
     elif isinstance(instruction, StatementEval):
         if instruction.type == 'int':
-            op, args = expr_to_tac(instruction.expr, tac)
-            tac["body"].append({"opcode": op, "args": args, "result": None})
+            op, args = yield lower_expr(ctx, instruction.expr, tac)
+            tac.body.append(Instr(op, *args))
         elif instruction.type == 'bool':
-            temp = evaluate_bool_expr(instruction.expr, tac)
-            tac['body'].append({'opcode': 'copy', 'args': [temp], 'result': None})
+            temp = yield lower_bool_value(ctx, instruction.expr, tac)
+            tac.body.append(Instr('copy', temp))
         elif instruction.type == "void":
-            op, args = void_exp(instruction.expr, tac)
-            tac["body"].append({"opcode": op, "args": args, "result": None})
+            op, args = yield lower_void(ctx, instruction.expr, tac)
+            tac.body.append(Instr(op, *args))
 
     elif isinstance(instruction, StatementReturn):
         if instruction.type != "void":
-            result = '%' + str(next_temorary)
-            next_temorary += 1
+            result = ctx.new_temporary()
             if instruction.type == 'int':
-                op, args = expr_to_tac(instruction.expr, tac)
-                tac["body"].append({"opcode": op, "args": args, "result": result})
+                op, args = yield lower_expr(ctx, instruction.expr, tac)
+                tac.body.append(Instr(op, *args, dest=result))
 
             elif instruction.type == 'bool':
-                temp = evaluate_bool_expr(instruction.expr, tac)
-                tac['body'].append({'opcode': 'copy', 'args': [temp], 'result': result})
+                temp = yield lower_bool_value(ctx, instruction.expr, tac)
+                tac.body.append(copy_operand(temp, result))
 
-            tac["body"].append({"opcode": "ret", "args": [result], "result": None})
+            tac.body.append(Instr('ret', result))
         else:
-            tac["body"].append({"opcode": "ret", "args": [], "result": None})
+            tac.body.append(Instr('ret'))
 
     else:
-        print(f'File "{filename}", line {instruction.lineno}')
-        print(f'Error: Unrecognized statement "{instruction}"')
-        sys.exit(1)
+        ctx.error(instruction.lineno, f'Unrecognized statement "{instruction}"')
+
+# The lowering functions are generators run by trampoline(): the recursion on the
+# sub-expressions and sub-statements goes through an explicit stack, so deeply
+# nested programs do not hit the recursion limit
+
+def void_exp(ctx, expression, tac):
+    return trampoline(lower_void(ctx, expression, tac))
+
+
+def evaluate_bool_expr(ctx, expression, tac):
+    return trampoline(lower_bool_value(ctx, expression, tac))
+
+
+def bool_exp(ctx, expression, Lt, Lf, tac):
+    return trampoline(lower_bool(ctx, expression, Lt, Lf, tac))
+
+
+def expr_to_tac(ctx, expression, tac):
+    return trampoline(lower_expr(ctx, expression, tac))
+
+
+def statements_to_tac(ctx, instruction, tac):
+    return trampoline(lower_statement(ctx, instruction, tac))
 
 # Processes global declarations (variables and procedures)
-def globs(instructions):
+def globs(ctx, instructions):
     tac = []
     index = []
     for instruction in instructions:
         if isinstance(instruction, ProcDec):
             index.append((len(tac), instruction))
-            tac.append({"proc": "@" + instruction.name, "args": ["%" + arg.name for arg in instruction.args], "body": []})
-            scopes[0][instruction.name] = ("@" + instruction.name, instruction.lineno)
+            tac.append(proc_header(ctx, instruction))
         else:
-            for var in instruction:
-                if var.type == 'int':
-                    tac.append({"var": "@" + var.name, "init": var.initial.value})
-                else:
-                    tac.append({"var": "@" + var.name, "init": 0 if var.initial.value == 'false' else 1})
-
-                scopes[0][var.name] = ("@" + var.name, var.lineno)
+            tac.extend(global_vars(ctx, instruction))
 
     return tac, index
 
-#  The entry point that processes source code into TAC
-def bx2tac(code, file=""):
-    global filename
-    filename = file
-    for line in code.split('\n'):
-        lines.append(line)
-
-    instructions = bx2front(code, filename)
-    tac, index = globs(instructions)
-
-    
-    for i, instruction in index:
-        if isinstance(instruction, ProcDec):
-            scopes.append({arg.name: ("%" + arg.name, arg.lineno) for arg in instruction.args})
-            statements_to_tac(instruction.body, tac[i])
-            scopes.pop()
-
-    tac_json = json.dumps(tac)
+# The TAC of a procedure, without its body yet
+def proc_header(ctx, instruction):
+    ctx.symbols.homes[instruction.symbol] = "@" + instruction.name
+    return Proc("@" + instruction.name, ["%" + arg.name for arg in instruction.args])
 
-    return tac_json
+# The TAC of a global variable declaration
+def global_vars(ctx, instruction):
+    tac = []
+    for var in instruction:
+        if var.type == 'int':
+            tac.append(Gvar("@" + var.name, var.initial.value))
+        else:
+            tac.append(Gvar("@" + var.name, 0 if var.initial.value == 'false' else 1))
+
+        ctx.symbols.homes[var.symbol] = "@" + var.name
+    return tac
+
+# Lowers the body of a type checked procedure into tac, made by proc_header(), once its
+# constants are folded (see ast_fold.py). The temporaries and labels are numbered from 0
+# in each procedure
+def proc_to_tac(ctx, instruction, tac):
+    with ctx.stats.phase('fold'):
+        fold_proc(instruction)
+
+    ctx.next_temporary = ctx.next_label = 0
+    for arg in instruction.args:
+        ctx.symbols.homes[arg.symbol] = "%" + arg.name
+    statements_to_tac(ctx, instruction.body, tac)
+
+# Keeps call_graph in ctx and returns the declarations without the procedures main never calls
+def live_decls(ctx, instructions, call_graph):
+    ctx.call_graph = call_graph
+    live = call_graph.reachable('main')
+    decls = [decl for decl in instructions if not isinstance(decl, ProcDec) or decl.name in live]
+    ctx.stats.size('procedures dropped', len(instructions) - len(decls))
+    return decls
+
+#  The entry point that processes source code into TAC, returned as a list of Gvar and Proc
+def bx2tac(code, file="", ctx=None):
+    if ctx is None:
+        ctx = CompilationContext(file, code)
+
+    instructions = bx2front(code, file, ctx)
+    with ctx.stats.phase('callgraph'):
+        instructions = live_decls(ctx, instructions, CallGraph(ctx.calls))
+
+    with ctx.stats.phase('lower'):
+        tac, index = globs(ctx, instructions)
+
+        for i, instruction in index:
+            if isinstance(instruction, ProcDec):
+                proc_to_tac(ctx, instruction, tac[i])
+
+    ctx.stats.size('TAC instructions', sum(len(decl.body) for decl in tac if isinstance(decl, Proc)))
+    return tac
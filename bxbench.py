@@ -0,0 +1,722 @@
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+"""
+.
+Benchmarks for the compiler pipeline, one subcommand per benchmark:
+
+startup: latency of a full `bxcc.py` run with a cold parse table cache
+         (tables rebuilt and written) and with a warm one (tables loaded)
+scan: throughput in MB/s of the PLY and the fast scanner backends on a generated
+      program mixing the examples, comments and long expressions
+deep: type checks and lowers to TAC programs nested N levels deep (100000 by default),
+      checking that each compiles, or fails with the expected error, without
+      hitting the recursion limit
+emit: time and peak memory of the assembly emission, built as a list (emit_x64)
+      or streamed to a file (write_x64), on generated programs with many globals
+parse: parse time and deepest LR stack on generated blocks of N statements,
+       time per statement should stay flat
+parsers: parse throughput of the yacc and the recursive descent parsers on a generated
+         program with N procedures of mixed statements and expressions
+column: parse time of a generated single-line source (1 MB by default) with the
+        columns found by searching back for the last newline vs by bisection
+"""
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def report(name, times):
+    print(f'{name:<10} min {min(times) * 1000:8.1f} ms   median {statistics.median(times) * 1000:8.1f} ms   ({len(times)} runs)')
+
+
+def run_bxcc(args, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(HERE, 'bxcc.py')] + args, env=env, check=True)
+    return time.perf_counter() - start
+
+
+def bench_startup(opts):
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, os.path.basename(opts.file))
+        shutil.copy(opts.file, src)
+        env = dict(os.environ)
+
+        cold = []
+        for i in range(opts.runs):
+            env['BX_TABCACHE'] = os.path.join(tmp, f'cold{i}')
+            cold.append(run_bxcc([src], env))
+
+        env['BX_TABCACHE'] = os.path.join(tmp, 'warm')
+        run_bxcc([src], env)
+        warm = [run_bxcc([src], env) for _ in range(opts.runs)]
+
+    report('cold', cold)
+    report('warm', warm)
+
+
+# A program with n global variables and n / 10 procedures using them
+def globals_program(n):
+    out = [f'var g{i} = {i} : int;' for i in range(n)]
+    for p in range(max(1, n // 10)):
+        body = ' '.join(f'g{i} = g{i} + {p};' for i in range(p * 10, min(n, p * 10 + 10)))
+        out.append(f'def p{p}() {{ {body} }}')
+    calls = ' '.join(f'p{p}();' for p in range(max(1, n // 10)))
+    out.append(f'def main() {{ {calls} print(g0); }}')
+    return '\n'.join(out) + '\n'
+
+
+# A main procedure made of n statements
+def statements_program(n):
+    body = '\n'.join(f'  x = x + {i};' if i % 2 else f'  print(x);' for i in range(n))
+    return f'def main() {{\n  var x = 0 : int;\n{body}\n}}\n'
+
+
+def bench_parse(opts):
+    sys.path.insert(0, HERE)
+    from parser import Parser
+
+    print(f'{"statements":>12}{"time (s)":>10}{"us/stmt":>10}{"max stack":>11}')
+    for n in opts.sizes:
+        parser = Parser(statements_program(n))
+        depth = [0]
+        token = parser.lex.token
+
+        def traced_token():
+            depth[0] = max(depth[0], len(parser.parser.symstack))
+            return token()
+        parser.lex.token = traced_token
+
+        start = time.perf_counter()
+        parser.parse()
+        elapsed = time.perf_counter() - start
+        print(f'{n:>12}{elapsed:>10.2f}{elapsed / n * 1e6:>10.2f}{depth[0]:>11}')
+
+
+# n procedures with loops, conditions, calls and expressions of every precedence level
+def mixed_program(n):
+    out = []
+    for p in range(n):
+        out.append(f'''def f{p}(a, b : int, c : bool) : int {{
+  var x = a * (b + {p}) - ~a % 7, y = (a << 2) >> 1 : int;
+  var t = !c || a < b && b != x : bool;
+  while (x > 0 && (t || y >= {p})) {{
+    x = x - 1;
+    if (x % 3 == 0) {{ y = y ^ x | a & b; continue; }} else if (x == 5) {{ break; }} else {{ y = -y; }}
+    print(y);
+  }}
+  return f{max(0, p - 1)}(x, y, !t) + x / 2;
+}}''')
+    out.append(f'def main() {{ print(f{n - 1}(1, 2, true)); }}')
+    return '\n'.join(out) + '\n'
+
+
+def bench_parsers(opts):
+    sys.path.insert(0, HERE)
+    from parser import PARSERS, make_parser
+
+    code = mixed_program(opts.procs)
+    for backend in PARSERS:
+        times = []
+        for _ in range(opts.runs):
+            parser = make_parser(code, '', backend)
+            start = time.perf_counter()
+            parser.parse()
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        print(f'{backend:<6}{best:8.3f} s   {len(code) / best / 1e6:6.3f} MB/s   '
+              f'{code.count(chr(10)) / best:10.0f} lines/s   ({len(code)} bytes)')
+
+
+def bench_column(opts):
+    sys.path.insert(0, HERE)
+    from parser import Parser
+    from scanner import Lexer
+
+    stmt = 'x = (x + 1) * 3 % 1000; '
+    code = 'def main() { var x = 0 : int; ' + stmt * (opts.bytes // len(stmt)) + 'print(x); }\n'
+
+    def rfind_column(self, token, n=None):
+        lexpos = token.lexpos if n is None else token.lexpos(n)
+        return lexpos - self.lexer.lexdata.rfind('\n', 0, lexpos)
+
+    def parse():
+        start = time.perf_counter()
+        Parser(code).parse()
+        return time.perf_counter() - start
+
+    bisect_column = Lexer.find_tok_column
+    Lexer.find_tok_column = rfind_column
+    try:
+        t_rfind = parse()
+    finally:
+        Lexer.find_tok_column = bisect_column
+    t_bisect = parse()
+
+    print(f'{len(code)} bytes on one line')
+    print(f'rfind    {t_rfind:8.2f} s')
+    print(f'bisect   {t_bisect:8.2f} s')
+
+
+def bench_scan(opts):
+    sys.path.insert(0, HERE)
+    from scanner import SCANNERS, make_lexer
+
+    parts = []
+    for name in sorted(os.listdir(os.path.join(HERE, 'examples'))):
+        if name.endswith('.bx'):
+            with open(os.path.join(HERE, 'examples', name), 'r') as f:
+                parts.append(f.read())
+    parts.append(statements_program(1000))
+    chunk = '\n'.join(parts)
+    code = chunk * max(1, opts.bytes // len(chunk))
+
+    for backend in SCANNERS:
+        times = []
+        for _ in range(opts.runs):
+            lexer = make_lexer('', backend)
+            start = time.perf_counter()
+            lexer.input(code)
+            count = 0
+            while lexer.token():
+                count += 1
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        print(f'{backend:<6}{len(code) / best / 1e6:8.2f} MB/s   {count / best / 1e6:6.2f} Mtokens/s   ({count} tokens, {len(code)} bytes)')
+
+
+# Programs nested n levels deep, with the error they must raise (None if they are valid)
+def deep_programs(n):
+    return [
+        ('sum', 'def main() { print(' + ' + '.join(['1'] * n) + '); }', None),
+        ('unary', 'def main() { print(' + '- ~' * (n // 2) + ' 1); }', None),
+        ('not', 'def main() { var b = ' + '!' * n + 'true : bool; print(b); }', None),
+        ('and', 'def main() { var b = true : bool; if (' + ' && '.join(['b'] * n) + ') { print(1); } }', None),
+        ('parens', 'def main() { print(' + '(' * n + '1' + ')' * n + '); }', None),
+        ('blocks', 'def main() { ' + '{' * n + 'print(1);' + '}' * n + ' }', None),
+        ('while', 'def main() { ' + 'while (true) { ' * n + 'break;' + ' }' * n + ' }', None),
+        ('ifelse', 'def main() { var x = 3 : int; ' +
+         ' else '.join(f'if (x == {i}) {{ print({i}); }}' for i in range(n)) + ' }', None),
+        ('sum_type_error', 'def main() { print(' + ' + '.join(['1'] * n) + ' + true); }',
+         'Operation and argument types not compatible'),
+        ('blocks_undeclared', 'def main() { ' + '{' * n + 'print(y);' + '}' * n + ' }',
+         'Undeclared variable "y"'),
+        ('ifelse_break', 'def main() { var x = 3 : int; ' +
+         ' else '.join(f'if (x == {i}) {{ print({i}); }}' for i in range(n)) + ' else { break; } }',
+         'Break instruction out of loop'),
+    ]
+
+
+def bench_deep(opts):
+    sys.path.insert(0, HERE)
+    from bx2tac import bx2tac
+    from context import CompileError
+    from tac import Proc
+
+    failed = 0
+    for name, code, expected in deep_programs(opts.depth):
+        start = time.perf_counter()
+        try:
+            tac = bx2tac(code, name + '.bx')
+            result = f'ok, {sum(len(decl.body) for decl in tac if isinstance(decl, Proc))} TAC instructions'
+            error = None
+        except CompileError as e:
+            result = error = e.message
+        except RecursionError:
+            result = error = 'RecursionError'
+        elapsed = time.perf_counter() - start
+
+        status = 'ok' if error == expected else 'FAILED'
+        failed += status != 'ok'
+        print(f'{status:<8}{name:<20}{elapsed:8.2f} s   {result}')
+    return 1 if failed else 0
+
+
+# depth nested blocks each declaring a variable, the innermost one uses the outermost
+# and the innermost variables n times
+def scoped_program(depth, n):
+    opens = ''.join(f'{{ var v{i} = {i} : int; ' for i in range(1, depth))
+    body = f'v0 = v0 + v{depth - 1}; ' * n
+    return f'def main() {{ var v0 = 0 : int; {opens}{body}{"}" * (depth - 1)} print(v0); }}\n'
+
+
+def bench_names(opts):
+    sys.path.insert(0, HERE)
+    from bx2tac import bx2tac
+    from context import CompilationContext
+    from timing import PassStats
+
+    print(f'{"depth":>8}{"uses":>10}{"typecheck (ms)":>16}{"lower (ms)":>12}')
+    for depth in opts.depths:
+        code = scoped_program(depth, opts.uses)
+        best = None
+        for _ in range(opts.runs):
+            stats = PassStats()
+            bx2tac(code, 'names.bx', CompilationContext('names.bx', code, stats))
+            times = (stats.times['typecheck'], stats.times['lower'])
+            best = times if best is None or sum(times) < sum(best) else best
+        print(f'{depth:>8}{opts.uses:>10}{best[0] * 1000:>16.1f}{best[1] * 1000:>12.1f}')
+
+
+def bench_ast(opts):
+    sys.path.insert(0, HERE)
+    import gc
+    import tracemalloc
+    from parser import make_parser
+    from bx2front import check_program
+    from context import CompilationContext
+    from timing import count_nodes
+
+    code = mixed_program(opts.lines // 10)
+    print(f'{code.count(chr(10))} lines, {len(code) / 1e6:.1f} MB of source')
+
+    # Memory held by the AST, after parsing and after type checking
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    ast = make_parser(code, 'ast.bx').parse()
+    gc.collect()
+    parsed = tracemalloc.get_traced_memory()[0] - base
+    check_program(CompilationContext('ast.bx', code), ast)
+    gc.collect()
+    checked = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    nodes = count_nodes(ast)
+    del ast
+    gc.collect()
+
+    # Speed, without tracing
+    start = time.perf_counter()
+    ast = make_parser(code, 'ast.bx').parse()
+    parse_time = time.perf_counter() - start
+    start = time.perf_counter()
+    check_program(CompilationContext('ast.bx', code), ast)
+    check_time = time.perf_counter() - start
+
+    print(f'{nodes} AST nodes')
+    print(f'{"after parse":<20}{parsed / 2**20:>10.1f} MiB{parsed / nodes:>8.1f} B/node{parse_time:>8.2f} s')
+    print(f'{"after typecheck":<20}{checked / 2**20:>10.1f} MiB{checked / nodes:>8.1f} B/node{check_time:>8.2f} s')
+
+
+def bench_stream(opts):
+    sys.path.insert(0, HERE)
+    import tempfile
+    import tracemalloc
+    from bxcc import compile_file
+
+    def peak(file, stream):
+        tracemalloc.start()
+        start = time.perf_counter()
+        error = compile_file(file, stream=stream)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert error is None, error
+        return elapsed, peak
+
+    print(f'{"procs":>8}{"lines":>10}{"whole (s)":>11}{"peak (MiB)":>12}{"stream (s)":>12}{"peak (MiB)":>12}')
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in opts.sizes:
+            file = os.path.join(tmp, f'stream{n}.bx')
+            with open(file, 'w') as f:
+                f.write(mixed_program(n))
+            lines = n * 10 + 1
+            t_whole, m_whole = peak(file, False)
+            t_stream, m_stream = peak(file, True)
+            print(f'{n:>8}{lines:>10}{t_whole:>11.2f}{m_whole / 2**20:>12.1f}{t_stream:>12.2f}{m_stream / 2**20:>12.1f}')
+
+
+def bench_incr(opts):
+    sys.path.insert(0, HERE)
+    from bxincr import IncrementalFront
+    from bx2front import bx2front
+    from context import CompileError
+
+    def whole(code):
+        try:
+            bx2front(code, 'incr.bx')
+        except CompileError as e:
+            return str(e)
+        return None
+
+    code = mixed_program(opts.lines // 10)
+    start = time.perf_counter()
+    whole(code)
+    t_whole = time.perf_counter() - start
+    start = time.perf_counter()
+    front = IncrementalFront('incr.bx', code)
+    t_first = time.perf_counter() - start
+    print(f'{code.count(chr(10))} lines: bx2front {t_whole * 1000:.0f} ms, first analysis {t_first * 1000:.0f} ms')
+
+    # Single-line edits in the middle procedure: (name, text to find, replacement), each undone after
+    p = opts.lines // 20
+    edits = [('body', f'(b + {p})', f'(b + {p + 1})'),
+             ('type error', '    print(y);', '    print(y + true);'),
+             ('syntax error', '    x = x - 1;', '    x = x - 1'),
+             ('new line', '    x = x - 1;', '    x = x\n - 1;'),
+             ('signature', f'def f{p}(a, b : int, c : bool) : int', f'def f{p}(a, b : int, c : bool) : bool')]
+
+    failed = 0
+    print(f'{"edit":<20}{"latency (ms)":>14}{"reparsed":>10}{"rechecked":>11}   result')
+    for name, find, replace in edits:
+        pos = code.index(find, code.index(f'def f{p}('))
+        for label, old, new in ((name, find, replace), (name + ' undone', replace, find)):
+            start = time.perf_counter()
+            error = front.edit(pos, pos + len(old), new)
+            elapsed = time.perf_counter() - start
+            code = code[:pos] + new + code[pos + len(old):]
+
+            error = None if error is None else str(error)
+            ok = error == whole(code)
+            failed += not ok
+            result = 'ok' if error is None else error.splitlines()[-1]
+            print(f'{label:<20}{elapsed * 1000:>14.1f}{front.reparsed:>10}{front.rechecked:>11}   '
+                  f'{"" if ok else "FAILED "}{result}')
+    return 1 if failed else 0
+
+
+def bench_parallel(opts):
+    sys.path.insert(0, HERE)
+    import resource
+    from bx2tac import bx2tac
+    from bxparallel import parallel_tac
+
+    def cpu(who):
+        usage = resource.getrusage(who)
+        return usage.ru_utime + usage.ru_stime
+
+    # Best wall time of fn(*args), with the CPU time of this process and of the workers during it
+    def best(fn, *args):
+        runs = []
+        for _ in range(opts.repeat):
+            parent, children = cpu(resource.RUSAGE_SELF), cpu(resource.RUSAGE_CHILDREN)
+            start = time.perf_counter()
+            result = fn(*args)
+            runs.append((time.perf_counter() - start, cpu(resource.RUSAGE_SELF) - parent,
+                         cpu(resource.RUSAGE_CHILDREN) - children))
+        return min(runs), result
+
+    # The parent CPU time does not shrink with more workers, the workers CPU time is split among them
+    print(f'{os.cpu_count()} CPUs, best of {opts.repeat}')
+    print(f'{"procs":>8}{"jobs":>6}{"bx2tac (s)":>12}{"parallel (s)":>14}{"speedup":>9}'
+          f'{"parent CPU (s)":>16}{"workers CPU (s)":>17}')
+    for n in opts.sizes:
+        code = mixed_program(n)
+        (t_seq, _, _), expected = best(bx2tac, code, 'parallel.bx')
+        for jobs in opts.jobs:
+            (t, parent, workers), tac = best(parallel_tac, code, 'parallel.bx', jobs)
+            assert tac == expected, f'-j {jobs}: TAC differs from bx2tac'
+            print(f'{n:>8}{jobs:>6}{t_seq:>12.2f}{t:>14.2f}{t_seq / t:>8.2f}x{parent:>16.2f}{workers:>17.2f}')
+
+
+# Procedures written with named constants and debug switches, as folded by ast_fold.py
+def constants_program(n):
+    out = []
+    for p in range(n):
+        out.append(f'''def c{p}(x : int) : int {{
+  var size = 64 * 1024, mask = (1 << 12) - 1 : int;
+  var debug = false : bool;
+  if (debug && x > 0) {{ print(x); }}
+  while (1 > 2) {{ print(0); }}
+  if (!debug || 3 * 4 == 12) {{ x = x * 1 + 0; }} else {{ x = -x; }}
+  return (x + size / 8 - {p} % 3) & mask;
+}}''')
+    calls = ' '.join(f'print(c{p}({p}));' for p in range(n))
+    out.append(f'def main() {{ {calls} }}')
+    return '\n'.join(out) + '\n'
+
+
+def bench_fold(opts):
+    sys.path.insert(0, HERE)
+    import glob
+    import bx2tac
+    from context import CompileError
+    from tac import Proc
+    from tac_cfopt import optimize_tac
+
+    def sizes(code, file):
+        tac = bx2tac.bx2tac(code, file)
+        lowered = sum(len(decl.body) for decl in tac if isinstance(decl, Proc))
+        optimised = sum(len(p.body) for p in optimize_tac(tac)[1])
+        return lowered, optimised
+
+    programs = []
+    for file in sorted(glob.glob(os.path.join(HERE, 'examples', '*.bx'))):
+        with open(file) as f:
+            programs.append((os.path.relpath(file, HERE), f.read()))
+    programs.append((f'constants_program({opts.procs})', constants_program(opts.procs)))
+    programs.append((f'mixed_program({opts.procs})', mixed_program(opts.procs)))
+
+    print(f'{"program":<40}{"TAC":>8}{"folded":>8}{"opt TAC":>9}{"folded":>8}')
+    totals = [0, 0, 0, 0]
+    fold_proc = bx2tac.fold_proc
+    for name, code in programs:
+        try:
+            bx2tac.fold_proc = lambda decl: None
+            before = sizes(code, name)
+            bx2tac.fold_proc = fold_proc
+            after = sizes(code, name)
+        except CompileError:
+            continue
+        finally:
+            bx2tac.fold_proc = fold_proc
+        row = before[0], after[0], before[1], after[1]
+        totals = [t + v for t, v in zip(totals, row)]
+        print(f'{name:<40}{row[0]:>8}{row[1]:>8}{row[2]:>9}{row[3]:>8}')
+    print(f'{"total":<40}{totals[0]:>8}{totals[1]:>8}{totals[2]:>9}{totals[3]:>8}')
+
+
+# A library of n helper procedures, main calls the first used ones and each helper calls
+# the one at half its index, so the call graph is a tree with a little recursion
+def library_program(n, used):
+    out = []
+    for h in range(n):
+        out.append(f'''def h{h}(x : int) : int {{
+  var y = x * {h % 7 + 1} : int;
+  while (y > 100) {{ y = y / 2 - 1; }}
+  if (x > 0) {{ return h{h // 2}(x - 1) + y; }}
+  return y;
+}}''')
+    calls = ' '.join(f'print(h{h}({h % 5}));' for h in range(used))
+    out.append(f'def main() {{ {calls} }}')
+    return '\n'.join(out) + '\n'
+
+
+def bench_callgraph(opts):
+    sys.path.insert(0, HERE)
+    import bx2tac
+    from bxcc import compile_tac
+    from tac2x64 import emit_x64
+
+    def compile(code):
+        start = time.perf_counter()
+        gvars, procs, _ = compile_tac(code)
+        lines = len(emit_x64(gvars, procs))
+        return time.perf_counter() - start, len(procs), lines
+
+    def keep_all(ctx, instructions, call_graph):
+        ctx.call_graph = call_graph
+        return instructions
+
+    print(f'{"helpers":>8}{"used":>6}{"procs":>7}{"time (s)":>10}{"asm lines":>11}'
+          f'{"live":>7}{"time (s)":>10}{"asm lines":>11}')
+    for n in opts.sizes:
+        used = max(1, n * opts.percent // 100)
+        code = library_program(n, used)
+        live_decls = bx2tac.live_decls
+        bx2tac.live_decls = keep_all
+        try:
+            t_all, procs_all, lines_all = compile(code)
+        finally:
+            bx2tac.live_decls = live_decls
+        t_live, procs_live, lines_live = compile(code)
+        print(f'{n:>8}{used:>6}{procs_all:>7}{t_all:>10.2f}{lines_all:>11}'
+              f'{procs_live:>7}{t_live:>10.2f}{lines_live:>11}')
+
+
+def bench_emit(opts):
+    sys.path.insert(0, HERE)
+    import tracemalloc
+    from bxcc import compile_tac
+    from tac2x64 import emit_x64, write_x64
+
+    def measure(fn):
+        gvars, procs, _ = compile_tac(code)
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn(gvars, procs)
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return elapsed, peak
+
+    def to_list(gvars, procs):
+        with open(os.devnull, 'w') as f:
+            f.write(''.join(line + '\n' for line in emit_x64(gvars, procs)))
+
+    def to_file(gvars, procs):
+        with open(os.devnull, 'w') as f:
+            write_x64(gvars, procs, f)
+
+    print(f'{"globals":>10}{"list (ms)":>12}{"peak (KiB)":>12}{"stream (ms)":>14}{"peak (KiB)":>12}')
+    for n in opts.sizes:
+        code = globals_program(n)
+        t_list, m_list = measure(to_list)
+        t_stream, m_stream = measure(to_file)
+        print(f'{n:>10}{t_list * 1000:>12.1f}{m_list / 1024:>12.1f}{t_stream * 1000:>14.1f}{m_stream / 1024:>12.1f}')
+
+
+def bench_ir(opts):
+    sys.path.insert(0, HERE)
+    import gc
+    import json
+    import tracemalloc
+    from bx2tac import bx2tac
+    from context import CompilationContext
+    from tac import Proc, dump_tac, load_tac
+    from tac_cfopt import optimize_tac
+    from tac2x64 import write_x64
+    from timing import PassStats
+
+    # A main procedure of about opts.instructions instructions, 3 per statement
+    code = statements_program(opts.instructions // 3)
+
+    # Memory held by the lowered TAC, the AST is dropped by bx2tac()
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    tac = bx2tac(code, 'ir.bx')
+    gc.collect()
+    slotted = tracemalloc.get_traced_memory()[0] - base
+    base = tracemalloc.get_traced_memory()[0]
+    js_obj = dump_tac(tac)
+    gc.collect()
+    dicts = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    count = sum(len(decl.body) for decl in tac if isinstance(decl, Proc))
+    del tac, js_obj
+    gc.collect()
+
+    # Speed, without tracing
+    stats = PassStats()
+    tac = bx2tac(code, 'ir.bx', CompilationContext('ir.bx', code, stats))
+
+    def timed(fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        return time.perf_counter() - start, result
+
+    t_dump, text = timed(lambda: json.dumps(dump_tac(tac)))
+    t_load, _ = timed(lambda: load_tac(json.loads(text)))
+    del text
+    t_opt, (gvars, procs) = timed(optimize_tac, tac)
+    with open(os.devnull, 'w') as f:
+        t_emit, _ = timed(write_x64, gvars, procs, f)
+
+    print(f'{count} TAC instructions')
+    print(f'{"Instr objects":<20}{slotted / 2**20:>10.1f} MiB{slotted / count:>8.1f} B/instr')
+    print(f'{"JSON dicts":<20}{dicts / 2**20:>10.1f} MiB{dicts / count:>8.1f} B/instr')
+    for name, seconds in [('lower', stats.times['lower']), ('optimise', t_opt), ('emit', t_emit),
+                          ('JSON dump', t_dump), ('JSON load', t_load)]:
+        print(f'{name:<20}{seconds:>10.2f} s{count / seconds / 1e6:>8.2f} M instr/s')
+
+
+
+# A main procedure of n statements branching on x, about 10 TAC instructions and
+# 4 basic blocks each: if/else, a loop with a break and a condition with &&
+def branches_program(n):
+    out = []
+    for i in range(n):
+        if i % 3 == 0:
+            out.append(f'  if (x % {i % 7 + 2} == 0) {{ x = x + {i}; }} else {{ y = y - x; }}')
+        elif i % 3 == 1:
+            out.append(f'  while (y < x) {{ y = y + 1; if (y == {i}) {{ break; }} }}')
+        else:
+            out.append(f'  if (x > {i} && y != x) {{ print(y); }}')
+    body = '\n'.join(out)
+    return f'def main() {{\n  var x = 1, y = 0 : int;\n{body}\n}}\n'
+
+
+def bench_cfg(opts):
+    sys.path.insert(0, HERE)
+    from bx2tac import bx2tac
+    from tac import Proc
+    from tac_cfopt import optimize_tac
+    from timing import PassStats
+
+    phases = ['build', 'jump_thread', 'clean_dead_code', 'coaleasce', 'linearize']
+    print('time of each pass in ms')
+    print(f'{"TAC":>8}{"blocks":>8}' + ''.join(f'{name:>16}' for name in phases) + f'{"total":>10}{"us/instr":>10}')
+    for n in opts.sizes:
+        tac = bx2tac(branches_program(n // 10), 'cfg.bx')
+        count = sum(len(decl.body) for decl in tac if isinstance(decl, Proc))
+        stats = PassStats()
+        optimize_tac(tac, stats)
+        times = [stats.times['cfg.' + name] for name in phases]
+        total = sum(times)
+        print(f'{count:>8}{stats.sizes["basic blocks"]:>8}' + ''.join(f'{t * 1000:>16.1f}' for t in times) +
+              f'{total * 1000:>10.1f}{total / count * 1e6:>10.2f}')
+
+if __name__ == '__main__':
+    ap = argparse.ArgumentParser(description='bx compiler benchmarks')
+    sub = ap.add_subparsers(dest='bench', required=True)
+
+    sp = sub.add_parser('startup', help='cold vs warm bxcc.py latency')
+    sp.add_argument('file', nargs='?', default=os.path.join(HERE, 'examples', 'fizzbuzz.bx'))
+    sp.add_argument('-n', dest='runs', type=int, default=10)
+    sp.set_defaults(func=bench_startup)
+
+    sp = sub.add_parser('parse', help='parse time and LR stack depth vs number of statements')
+    sp.add_argument('sizes', nargs='*', type=int, default=[10000, 100000, 1000000])
+    sp.set_defaults(func=bench_parse)
+
+    sp = sub.add_parser('parsers', help='yacc vs recursive descent parse throughput')
+    sp.add_argument('procs', nargs='?', type=int, default=2000)
+    sp.add_argument('-n', dest='runs', type=int, default=3)
+    sp.set_defaults(func=bench_parsers)
+
+    sp = sub.add_parser('column', help='parse time of a long single-line source')
+    sp.add_argument('-b', dest='bytes', type=int, default=1 << 20)
+    sp.set_defaults(func=bench_column)
+
+    sp = sub.add_parser('scan', help='MB/s of the scanner backends')
+    sp.add_argument('-b', dest='bytes', type=int, default=4 << 20)
+    sp.add_argument('-n', dest='runs', type=int, default=3)
+    sp.set_defaults(func=bench_scan)
+
+    sp = sub.add_parser('deep', help='type check and lowering of deeply nested programs')
+    sp.add_argument('-d', dest='depth', type=int, default=100000)
+    sp.set_defaults(func=bench_deep)
+
+    sp = sub.add_parser('names', help='name resolution in nested scopes')
+    sp.add_argument('depths', nargs='*', type=int, default=[1, 10, 100, 1000])
+    sp.add_argument('-u', dest='uses', type=int, default=20000)
+    sp.add_argument('-n', dest='runs', type=int, default=3)
+    sp.set_defaults(func=bench_names)
+
+    sp = sub.add_parser('ast', help='memory and parse/typecheck time of the AST of a large program')
+    sp.add_argument('-l', dest='lines', type=int, default=1000000)
+    sp.set_defaults(func=bench_ast)
+
+    sp = sub.add_parser('stream', help='peak memory of the whole-file and the streaming compilation')
+    sp.add_argument('sizes', nargs='*', type=int, default=[1000, 4000, 16000])
+    sp.set_defaults(func=bench_stream)
+
+    sp = sub.add_parser('incr', help='latency of single-line edits with the incremental frontend')
+    sp.add_argument('-l', dest='lines', type=int, default=50000)
+    sp.set_defaults(func=bench_incr)
+
+    sp = sub.add_parser('parallel', help='bx2tac vs checking and lowering the procedures on a process pool')
+    sp.add_argument('sizes', nargs='*', type=int, default=[100, 400, 1600])
+    sp.add_argument('-j', dest='jobs', type=int, nargs='+', default=[1, 2, 4])
+    sp.add_argument('-r', dest='repeat', type=int, default=3)
+    sp.set_defaults(func=bench_parallel)
+
+    sp = sub.add_parser('fold', help='TAC size with and without the constant folding of the AST')
+    sp.add_argument('-p', dest='procs', type=int, default=100)
+    sp.set_defaults(func=bench_fold)
+
+    sp = sub.add_parser('callgraph', help='compile time and assembly size with and without dropping unused procedures')
+    sp.add_argument('sizes', nargs='*', type=int, default=[100, 1000, 4000])
+    sp.add_argument('-p', dest='percent', type=int, default=10, help='percentage of the helpers main calls')
+    sp.set_defaults(func=bench_callgraph)
+
+    sp = sub.add_parser('emit', help='list vs streamed assembly emission')
+    sp.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 50000])
+    sp.set_defaults(func=bench_emit)
+
+    sp = sub.add_parser('ir', help='memory and throughput of the TAC of a 1M instruction procedure')
+    sp.add_argument('-i', dest='instructions', type=int, default=1000000)
+    sp.set_defaults(func=bench_ir)
+
+    sp = sub.add_parser('cfg', help='time of each CFG pass vs the size of the procedure')
+    sp.add_argument('sizes', nargs='*', type=int, default=[1000, 10000, 100000])
+    sp.set_defaults(func=bench_cfg)
+
+    opts = ap.parse_args()
+    sys.exit(opts.func(opts))
@@ -0,0 +1,157 @@
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import tempfile
+
+"""
+.
+The CompileCache class is a content addressed cache of compilation results.
+
+Keys: sha256 of the source text, the compiler version (a hash of the compiler's own
+      sources) and the options, so the file name does not matter
+Entries: one JSON file per key holding the assembly and the requested TAC dumps,
+         written to a temporary file and renamed so parallel builds can share the cache
+Eviction: the modification time of an entry is refreshed on every hit and the least
+          recently used entries are removed once the cache grows over max_bytes. The
+          size of the cache is a running total kept with the statistics (the sizes of
+          the entries written are added to it), the entries are only listed when it
+          goes over max_bytes, and then it is set to the size actually found
+Statistics: hits, misses and evictions are added up in stats.json, under a file lock
+"""
+
+DEFAULT_SIZE = 256 << 20
+
+_compiler_version = None
+
+
+# Hash of the sources of the compiler, any change to them invalidates the cache
+def compiler_version():
+    global _compiler_version
+    if _compiler_version is None:
+        h = hashlib.sha256()
+        here = os.path.dirname(os.path.abspath(__file__))
+        for path in sorted(glob.glob(os.path.join(here, '*.py'))):
+            with open(path, 'rb') as f:
+                h.update(os.path.basename(path).encode('utf-8'))
+                h.update(f.read())
+        _compiler_version = h.hexdigest()
+    return _compiler_version
+
+
+# Parses sizes such as 4096, 512K, 100M or 2G
+def parse_size(text):
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if text[-1:].upper() in units:
+        return int(text[:-1]) * units[text[-1:].upper()]
+    return int(text)
+
+
+class CompileCache:
+    def __init__(self, directory, max_bytes=DEFAULT_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, code, options):
+        h = hashlib.sha256()
+        h.update(compiler_version().encode('utf-8'))
+        h.update(json.dumps(options, sort_keys=True).encode('utf-8'))
+        h.update(code.encode('utf-8'))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    # Returns the cached entry for key, or None
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            self.count(misses=1)
+            return None
+
+        self.count(hits=1)
+        return entry
+
+    def put(self, key, entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmpname, path)
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+        total = self.count(bytes=os.path.getsize(path)).get('bytes')
+        # No total yet (a cache written before it was kept), or over the limit
+        if total is None or total > self.max_bytes:
+            self.evict()
+
+    # Removes the least recently used entries until the cache fits in max_bytes, listing
+    # them all, and sets the running total of the sizes to what is left
+    def evict(self):
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(self.directory, '??', '*.json')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        if total <= self.max_bytes:
+            self.count(total=total)
+            return
+
+        evicted = 0
+        for mtime, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            evicted += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self.count(total=total, evictions=evicted)
+
+    # Adds to the statistics kept in stats.json (the running total of the sizes of the
+    # entries, 'bytes', is only added to once set, or set with total), returns them
+    def count(self, total=None, **counts):
+        with open(os.path.join(self.directory, 'stats.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stats = self.stats()
+            for name, n in counts.items():
+                if name in stats:
+                    stats[name] += n
+            if total is not None:
+                stats['bytes'] = total
+            with open(os.path.join(self.directory, 'stats.json'), 'w') as f:
+                json.dump(stats, f)
+        return stats
+
+    def stats(self):
+        stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        try:
+            with open(os.path.join(self.directory, 'stats.json'), 'r') as f:
+                stats.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+        return stats
+
+    # Statistics plus the current number of entries and their total size
+    def report(self):
+        sizes = [os.path.getsize(path) for path in glob.glob(os.path.join(self.directory, '??', '*.json'))]
+        stats = self.stats()
+        lookups = stats['hits'] + stats['misses']
+        rate = 100 * stats['hits'] / lookups if lookups else 0
+        return (f'{self.directory}: {len(sizes)} entries, {sum(sizes)} / {self.max_bytes} bytes\n'
+                f'hits {stats["hits"]}, misses {stats["misses"]} ({rate:.1f}% hit rate), evictions {stats["evictions"]}')
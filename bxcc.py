@@ -1,51 +1,271 @@
 from bx2tac import bx2tac
-from tac2x64 import tac2x64
-from tac_cfopt import tac_cfopt
+from bxstream import stream_x64
+from bxparallel import parallel_tac
+from tac2x64 import emit_x64, write_x64
+from tac_cfopt import optimize_tac
+from tac import dump_tac
+from context import CompilationContext, CompileError
+from parser import PARSERS, Parser
+from scanner import SCANNERS
+from bxclient import DUMP_SUFFIX
+from bxcache import CompileCache, DEFAULT_SIZE, parse_size
+from timing import NO_STATS, PassStats
 
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import subprocess
 import getopt
+import io
+import json
+import os
 import sys
+import time
 
 """
 .
 Manages all the scripts
+
+The stages hand their IR to each other in memory, the intermediate TAC is
+only written to disk when asked for:
+
+--dump-tac   writes the TAC produced by bx2tac to <name>.tac.json
+--dump-opt   writes the optimised TAC to <name>.tac_opt.json
+
+Several files can be given at once, -j N compiles them on N worker processes.
+Each file gets its own result line, a failing file does not stop the others,
+and the exit code is 1 if any of them failed.
+
+--cache-dir DIR   (or $BXCC_CACHE_DIR) reuses the results of earlier compilations
+                  of the same source with the same options, see bxcache.py
+--cache-size N    caps the cache size, e.g. 64M (default 256M)
+--cache-stats     prints the hit/miss statistics of the cache
+
+--time-passes       prints the time spent in each phase (scan, parse, typecheck, lower,
+                    the CFG passes, emit) and the IR size between them, on stderr
+--mem-report        adds the peak memory allocated by each phase (slower, uses tracemalloc)
+--stats-json FILE   also writes that report as JSON
+In batch mode the reports of all the files are added up.
+
+--scanner NAME      picks the scanner backend, fast (default) or ply, see scanner.py
+--parser NAME       picks the parser, rd (recursive descent, default) or yacc, see rdparser.py
+
+--stream            compiles one procedure at a time, the memory used is bounded by the
+                    largest procedure instead of the whole file (see bxstream.py).
+                    Always uses the rd parser, and ignores the cache
+--parallel N        type checks and lowers the procedures of a single file on N worker
+                    processes, once the globals are declared (see bxparallel.py).
+                    Uses the rd parser, the output is the same as without it
 """
-if __name__ == '__main__':
-    opts, args = getopt.getopt(sys.argv[1:], '', [])
-    file = args[0]
 
+
+# Compiles bx source code down to the optimised TAC, returns the global variables, the
+# procedures and the TAC of the stages named in dumps ('tac' and/or 'opt'), as JSON text
+# keyed by stage. With parallel > 1, the procedures are checked and lowered on that many
+# processes. Raises CompileError if the program is not valid
+def compile_tac(code, file="", dumps=(), stats=NO_STATS, parallel=1):
+    dumped = {}
+    if parallel > 1:
+        tac = parallel_tac(code, file, parallel, stats)
+    else:
+        tac = bx2tac(code, file, CompilationContext(file, code, stats))
+    if 'tac' in dumps:
+        dumped['tac'] = json.dumps(dump_tac(tac))
+
+    gvars, procs = optimize_tac(tac, stats)
+    if 'opt' in dumps:
+        dumped['opt'] = json.dumps(dump_tac(gvars + procs))
+
+    return gvars, procs, dumped
+
+
+# Compiles bx source code to a list of assembly lines, also returns the dumped TAC.
+# Raises CompileError if the program is not valid
+def bxcc(code, file="", dumps=(), stats=NO_STATS):
+    gvars, procs, dumped = compile_tac(code, file, dumps, stats)
+    return emit_x64(gvars, procs, stats), dumped
+
+
+def write_dumps(filename, dumped):
+    for stage, text in dumped.items():
+        with open(filename + DUMP_SUFFIX[stage], 'w') as f:
+            f.write(text)
+
+
+# Streams the assembly and the dumps of code to temporary files, renamed to the output
+# files once the whole program is compiled. Raises like stream_x64()
+def stream_file(filename, code, file, dumps=(), stats=NO_STATS):
+    targets = [filename + '.s'] + [filename + DUMP_SUFFIX[stage] for stage in dumps]
+    files = [open(target + '.tmp', 'w') for target in targets]
+    try:
+        stream_x64(code, file, files[0], dict(zip(dumps, files[1:])), stats)
+    except BaseException:
+        for f, target in zip(files, targets):
+            f.close()
+            os.remove(target + '.tmp')
+        raise
+
+    for f, target in zip(files, targets):
+        f.close()
+        os.replace(target + '.tmp', target)
+
+
+# Compiles a .bx file into the .s file next to it, returns the error message or None.
+# The assembly is streamed to the .s file one procedure at a time. With a CompileCache,
+# unchanged sources are not compiled again. With stream, the whole program is never held
+# in memory (see bxstream.py), unless it has an error. parallel is passed to compile_tac()
+def compile_file(file, dumps=(), cache=None, stats=NO_STATS, stream=False, parallel=1):
     if file.endswith('.bx'):
         filename = file[:-3]
     else:
-        print(f'{file} does not end in .bx')
-        sys.exit(1)
+        return f'{file} does not end in .bx'
 
     with open(file, 'r') as f:
         code = f.read()
 
-    tac_file = bx2tac(code, file)
-    tac_fn = filename + '.tac.json'
+    if stream:
+        try:
+            stream_file(filename, code, file, dumps, stats)
+            return None
+        except (CompileError, RecursionError):
+            # Compiled again below, to report the same error as without streaming
+            cache = None
 
-    with open(tac_fn, 'w') as f:
-        f.write(tac_file)
+    if cache is None:
+        try:
+            gvars, procs, dumped = compile_tac(code, file, dumps, stats, parallel)
+        except CompileError as e:
+            return str(e)
+        write_dumps(filename, dumped)
+        with open(filename + '.s', 'w') as f_out:
+            write_x64(gvars, procs, f_out, stats)
+        return None
 
-    tac_optimize_file = tac_cfopt(tac_fn)
+    key = cache.key(code, {'dumps': sorted(dumps)})
+    entry = cache.get(key)
+    if entry is None:
+        try:
+            gvars, procs, dumped = compile_tac(code, file, dumps, stats, parallel)
+        except CompileError as e:
+            return str(e)
+        asm = io.StringIO()
+        write_x64(gvars, procs, asm, stats)
+        entry = {'asm': asm.getvalue(), 'dumps': dumped}
+        cache.put(key, entry)
 
-    x64_file = tac2x64(filename + ".tac_opt.json")
-    x64_name = filename + '.s'
+    with stats.phase('write'):
+        write_dumps(filename, entry['dumps'])
+        with open(filename + '.s', 'w') as f_out:
+            f_out.write(entry['asm'])
 
-    f_out = open(x64_name, 'w')
-    for i in x64_file:
-        f_out.write(i + '\n')
-    f_out.close()
+    return None
 
 
+# Loads the parse tables once in each worker process, before its first file
+def warm_up():
+    Parser('', '')
 
 
+# compile_file() for the batch mode, where an internal error must not stop the other files.
+# Returns the error (or None) and, if report is 'time' or 'mem', the PassStats of the file as JSON
+def batch_job(file, dumps, cache, report=None, stream=False):
+    stats = NO_STATS if report is None else PassStats(mem=report == 'mem')
+    try:
+        error = compile_file(file, dumps, cache, stats, stream)
+    except Exception as e:
+        error = f'Internal error: {e!r}'
+    return error, stats.to_json() if report is not None else None
 
 
+# Compiles all the files, on a pool of jobs worker processes if jobs > 1, and reports each of them.
+# The per-file reports of the phases are added to stats
+def compile_batch(files, jobs, dumps=(), cache=None, stats=NO_STATS, stream=False):
+    report = None
+    if stats.enabled:
+        report = 'mem' if stats.mem else 'time'
+    start = time.perf_counter()
+    failed = 0
+
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=jobs, initializer=warm_up)
+        chunksize = max(1, len(files) // (4 * jobs))
+        results = pool.map(batch_job, files, repeat(dumps), repeat(cache), repeat(report), repeat(stream),
+                           chunksize=chunksize)
+    else:
+        pool = None
+        results = map(batch_job, files, repeat(dumps), repeat(cache), repeat(report), repeat(stream))
 
+    for file, (error, file_stats) in zip(files, results):
+        if file_stats is not None:
+            stats.merge(file_stats)
+        if error is None:
+            print(f'ok      {file}')
+        else:
+            failed += 1
+            print(f'FAILED  {file}')
+            print(error)
 
+    if pool is not None:
+        pool.shutdown()
 
+    elapsed = time.perf_counter() - start
+    print(f'{len(files)} files, {len(files) - failed} ok, {failed} failed in {elapsed:.2f}s '
+          f'({len(files) / elapsed:.1f} files/sec)')
+    return 1 if failed else 0
 
 
+# Prints and/or writes the report asked for on the command line
+def report_stats(stats, opts):
+    if not stats.enabled:
+        return
+    if '--time-passes' in opts or '--mem-report' in opts:
+        print(stats.table(), file=sys.stderr)
+    if '--stats-json' in opts:
+        stats.dump(opts['--stats-json'])
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], 'j:', ['dump-tac', 'dump-opt', 'serve', 'socket=',
+                                                    'cache-dir=', 'cache-size=', 'cache-stats',
+                                                    'time-passes', 'mem-report', 'stats-json=', 'scanner=', 'parser=',
+                                                    'stream', 'parallel='])
+    opts = dict(opts)
+    if '--scanner' in opts:
+        if opts['--scanner'] not in SCANNERS:
+            print(f'Unknown scanner {opts["--scanner"]}, expected one of {", ".join(SCANNERS)}')
+            sys.exit(1)
+        # Read when the parsers are made, here and in the worker processes
+        os.environ['BX_SCANNER'] = opts['--scanner']
+    if '--parser' in opts:
+        if opts['--parser'] not in PARSERS:
+            print(f'Unknown parser {opts["--parser"]}, expected one of {", ".join(PARSERS)}')
+            sys.exit(1)
+        os.environ['BX_PARSER'] = opts['--parser']
+    dumps = [stage for stage in DUMP_SUFFIX if f'--dump-{stage}' in opts]
+
+    stats = NO_STATS
+    if {'--time-passes', '--mem-report', '--stats-json'} & opts.keys():
+        stats = PassStats(mem='--mem-report' in opts)
+
+    cache = None
+    cache_dir = opts.get('--cache-dir') or os.environ.get('BXCC_CACHE_DIR')
+    if cache_dir:
+        cache = CompileCache(cache_dir, parse_size(opts.get('--cache-size', str(DEFAULT_SIZE))))
+
+    if '--cache-stats' in opts:
+        if cache is None:
+            print('No cache directory given')
+            sys.exit(1)
+        print(cache.report())
+    elif '--serve' in opts:
+        from bxserve import serve
+        serve(opts.get('--socket'), int(opts.get('-j', 1)))
+    elif len(args) == 1 and '-j' not in opts:
+        error = compile_file(args[0], dumps, cache, stats, '--stream' in opts, int(opts.get('--parallel', 1)))
+        report_stats(stats, opts)
+        if error is not None:
+            print(error)
+            sys.exit(1)
+    else:
+        status = compile_batch(args, int(opts.get('-j', 1)), dumps, cache, stats, '--stream' in opts)
+        report_stats(stats, opts)
+        sys.exit(status)
@@ -0,0 +1,92 @@
+import getopt
+import json
+import os
+import socket
+import sys
+import tempfile
+
+"""
+.
+Thin client for the compile server started with `python bxcc.py --serve`.
+
+It only sends the source text of each file over the Unix socket and writes
+back the .s file (and the TAC dumps, if asked for), so it does not pay for
+importing the compiler or loading the parse tables.
+
+A request is a JSON object sent on its own connection, the client then closes
+its writing side and reads the JSON response until the server closes:
+
+{"op": "compile", "file": name, "code": text, "dumps": ["tac", "opt"]}
+    -> {"ok": true, "asm": text, "dumps": {stage: json text}}
+    -> {"ok": false, "error": message}
+{"op": "shutdown"}
+    -> {"ok": true}
+"""
+
+# File written for each dumped stage, next to the .bx file
+DUMP_SUFFIX = {'tac': '.tac.json', 'opt': '.tac_opt.json'}
+
+
+# Socket used when none is given, one per user
+def default_socket():
+    return os.environ.get('BXCC_SOCKET') or \
+        os.path.join(tempfile.gettempdir(), f'bxcc-{os.getuid()}.sock')
+
+
+# Sends one request to the server and returns its response
+def request(path, obj):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path)
+        sock.sendall(json.dumps(obj).encode('utf-8'))
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(1 << 16)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+# Compiles a .bx file on the server, returns the error message or None
+def compile_remote(path, file, dumps=()):
+    if file.endswith('.bx'):
+        filename = file[:-3]
+    else:
+        return f'{file} does not end in .bx'
+
+    with open(file, 'r') as f:
+        code = f.read()
+
+    response = request(path, {'op': 'compile', 'file': file, 'code': code, 'dumps': list(dumps)})
+    if not response['ok']:
+        return response['error']
+
+    for stage, text in response['dumps'].items():
+        with open(filename + DUMP_SUFFIX[stage], 'w') as f:
+            f.write(text)
+
+    with open(filename + '.s', 'w') as f:
+        f.write(response['asm'])
+
+    return None
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], '', ['dump-tac', 'dump-opt', 'socket=', 'shutdown'])
+    opts = dict(opts)
+    path = opts.get('--socket') or default_socket()
+    dumps = [stage for stage in DUMP_SUFFIX if f'--dump-{stage}' in opts]
+
+    if '--shutdown' in opts:
+        request(path, {'op': 'shutdown'})
+        sys.exit(0)
+
+    failed = False
+    for file in args:
+        error = compile_remote(path, file, dumps)
+        if error is not None:
+            print(error)
+            failed = True
+
+    sys.exit(1 if failed else 0)
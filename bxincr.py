@@ -0,0 +1,280 @@
+from json_to_stat import ProcDec, ExpressionVar, ExpressionCall
+from bx2front import bx2front, declare_globals
+from context import CompilationContext, CompileError
+from rdparser import RDParser
+from parser import make_parser
+
+"""
+.
+The IncrementalFront class keeps the result of the frontend (bx2front) of a source that is
+edited a little at a time, as in an editor, and only redoes the work an edit reaches.
+
+Declarations: the source is cut into its top-level declarations, each one keeps the byte
+              range of its tokens, its AST, the names its body uses and its type error
+Reparse: an edit is scanned and parsed again from the start of the first declaration it
+         reaches to the end of the last one (see RDParser.iter_decls), the declarations
+         after it are only moved. If that range does not parse on its own, the rest of
+         the file is parsed again, so syntax errors are the same as for the whole file
+Recheck: the global declarations are checked again (they are cheap), then only the
+         procedures that were parsed again, or that use a global whose type or
+         signature changed, are type checked again
+
+edit() returns the CompileError bx2front() would raise on the new source, or None.
+"""
+
+
+class RangeError(Exception):
+    pass
+
+
+# One top-level declaration, or with ast None a range that does not parse (error is the
+# syntax error, or the result of bx2front for a program too deep for the incremental parser)
+class Decl:
+    __slots__ = ('start', 'end', 'ast', 'header', 'uses', 'error', 'dirty', 'shift')
+
+    def __init__(self, start, end, ast, error=None):
+        self.start = start
+        self.end = end
+        self.ast = ast
+        self.header = header(ast)
+        self.uses = names_used(ast.body) if isinstance(ast, ProcDec) else set()
+        self.error = error
+        self.dirty = True
+        # Lines the body has moved by since it was parsed, see IncrementalFront.declarations()
+        self.shift = 0
+
+
+class IncrementalFront:
+    def __init__(self, filename="", code=""):
+        self.filename = filename
+        self.code = ""
+        self.decls = []
+        self.ctx = None
+        self.signatures = {}
+        self.error = None
+        self.reparsed = 0
+        self.rechecked = 0
+        self.edit(0, 0, code)
+
+    # Replaces code[start:end] by text, returns the error of the new source or None
+    def edit(self, start, end, text):
+        old = self.code
+        code = self.code = old[:start] + text + old[end:]
+        delta = len(text) - (end - start)
+        lines = text.count('\n') - old.count('\n', start, end)
+        decls = self.decls
+        self.reparsed = self.rechecked = 0
+
+        # decls[i:j] are reached by the edit, [begin, stop) is their range in the old source
+        i = 0
+        while i < len(decls) and decls[i].end < start:
+            i += 1
+        j = i
+        while j < len(decls) and decls[j].start <= end:
+            j += 1
+
+        if i < len(decls) and decls[i].start <= start:
+            begin = decls[i].start
+        else:
+            # Starts between two declarations, where the scan of the previous one ended
+            begin = decls[i - 1].end if i > 0 else 0
+
+        if j == len(decls) and (j == i or decls[j - 1].end < end):
+            stop = len(old)
+        else:
+            if j == i or decls[j - 1].end < end:
+                # Ends between two declarations, the next one may be commented out or joined
+                j += 1
+            stop = decls[j - 1].end
+            # The columns of the declarations starting on the same line also change
+            while j < len(decls) and '\n' not in old[stop:decls[j].start]:
+                j += 1
+                stop = decls[j - 1].end
+        stop += delta
+
+        try:
+            try:
+                new = self.parse(begin, stop)
+            except RangeError:
+                j = len(decls)
+                new = self.parse(begin, len(code))
+        except RecursionError:
+            # Too deep for the recursive descent parser, left to bx2front until the next edit
+            j = len(decls)
+            i = 0
+            new = [Decl(0, len(code), None, check_whole(code, self.filename))]
+
+        for d in decls[j:]:
+            d.start += delta
+            d.end += delta
+            if lines:
+                move(d, lines)
+        if [d.header for d in decls[i:j]] != [d.header for d in new]:
+            self.ctx = None
+        decls[i:j] = new
+
+        self.check()
+        return self.error
+
+    # Parses the declarations of code[begin:stop]. A syntax error ends the list with a Decl
+    # without AST for the rest of the range. Raises RangeError if the range does not
+    # end between two declarations, for the caller to parse up to the end of the file
+    def parse(self, begin, stop):
+        parser = RDParser(self.code, self.filename, 'fast')
+        last = [None, None]
+        token = parser.lex.token
+
+        def next_token():
+            last[0] = last[1]
+            last[1] = token()
+            return last[1]
+        parser.lex.token = next_token
+
+        new = []
+        tail = begin
+        at_end = stop == len(self.code)
+        try:
+            decls = parser.iter_decls(begin, stop)
+            while parser.tok is not None:
+                decl_start = parser.tok.lexpos
+                ast = next(decls)
+                tail = last[0].lexpos + 1
+                new.append(Decl(decl_start, tail, ast))
+        except CompileError as e:
+            if parser.tok is None and not at_end:
+                # Ran into the end of the range, the declaration may go on after it
+                raise RangeError()
+            new.append(Decl(tail, stop, None, e))
+        finally:
+            self.reparsed += len(new)
+
+        # Only blanks may follow the last declaration, else a comment may run past stop
+        if not at_end and new and new[-1].ast is not None and self.code[tail:stop].strip():
+            raise RangeError()
+        return new
+
+    def check(self):
+        broken = next((d for d in self.decls if d.ast is None), None)
+        if broken is not None:
+            self.error = broken.error
+            return
+
+        changed = set()
+        if self.ctx is None:
+            # A header changed: the global declarations are checked again
+            ctx = CompilationContext(self.filename, self.code)
+            try:
+                declare_globals(ctx, [d.ast for d in self.decls])
+            except CompileError as e:
+                self.error = e
+                return
+            self.ctx = ctx
+
+            signatures = {}
+            for d in self.decls:
+                if isinstance(d.ast, ProcDec):
+                    signatures[d.ast.name] = (d.ast.type, tuple(arg.type for arg in d.ast.args))
+                else:
+                    for var in d.ast:
+                        signatures[var.name] = var.type
+            changed = {name for name in signatures.keys() | self.signatures.keys()
+                       if signatures.get(name) != self.signatures.get(name)}
+            self.signatures = signatures
+
+        symbols = self.ctx.symbols
+        size = len(symbols.names)
+        for d in self.decls:
+            if not isinstance(d.ast, ProcDec) or not (d.dirty or d.uses & changed):
+                continue
+            if not d.dirty:
+                # The AST keeps the types found by its last check, a fresh one is needed
+                d.ast = self.parse(d.start, d.end)[0].ast
+                d.shift = 0
+            d.dirty = False
+            self.rechecked += 1
+            try:
+                d.ast.type_check(self.ctx)
+                d.error = None
+            except CompileError as e:
+                d.error = e
+            while len(symbols.scopes) > 1:
+                symbols.pop()
+            symbols.forget(size)
+
+        self.error = next((d.error for d in self.decls if d.error is not None), None)
+
+    # The ASTs of the declarations, as the parser would return them for the whole source
+    def declarations(self):
+        out = []
+        for d in self.decls:
+            if d.ast is None:
+                if d.error is not None:
+                    raise d.error
+                return make_parser(self.code, self.filename).parse()
+            if d.shift:
+                for node in nodes(d.ast.body):
+                    if node.lineno:
+                        node.lineno += d.shift
+                d.shift = 0
+            out.append(d.ast)
+        return out
+
+
+# Moves the declaration d down by lines: its header at once, its body when it is needed
+def move(d, lines):
+    if d.error is not None and d.error.lineno is not None:
+        d.error.lineno += lines
+    if d.ast is None:
+        return
+    if isinstance(d.ast, ProcDec):
+        d.ast.lineno += lines
+        for arg in d.ast.args:
+            arg.lineno += lines
+        d.shift += lines
+    else:
+        for node in nodes(d.ast):
+            node.lineno += lines
+
+
+# The AST nodes under node, walked with an explicit stack
+def nodes(node):
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (list, tuple)):
+            stack.extend(node)
+        elif hasattr(node, 'lineno'):
+            yield node
+            for name in node.__slots__:
+                v = getattr(node, name, None)
+                if isinstance(v, (list, tuple)) or hasattr(v, 'lineno'):
+                    stack.append(v)
+
+
+# What the global declarations check needs of a declaration: for a procedure its name
+# and types, for variables their names, types and the kind of their initial values
+def header(ast):
+    if ast is None:
+        return None
+    if isinstance(ast, ProcDec):
+        return (ast.name, ast.type, tuple(arg.type for arg in ast.args))
+    return tuple((var.name, var.type, type(var.initial)) for var in ast)
+
+
+# Names of the variables and procedures used under node
+def names_used(node):
+    uses = set()
+    for n in nodes(node):
+        if isinstance(n, ExpressionVar):
+            uses.add(n.name)
+        elif isinstance(n, ExpressionCall):
+            uses.add(n.function)
+    return uses
+
+
+def check_whole(code, filename):
+    try:
+        bx2front(code, filename)
+    except CompileError as e:
+        return e
+    return None
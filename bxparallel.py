@@ -0,0 +1,139 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from json_to_stat import ProcDec
+from bx2front import declare_globals
+from bx2tac import bx2tac, globs, live_decls, proc_header, proc_to_tac
+from callgraph import CallGraph
+from tac import Proc
+from context import CompilationContext, CompileError
+from rdparser import RDParser
+from timing import NO_STATS
+
+"""
+.
+The parallel_tac function is bx2tac on a pool of worker processes (bxcc.py --parallel N):
+once the global declarations are checked, every procedure can be type checked and
+lowered on its own.
+
+Split: the source is cut into runs of consecutive declarations of about the same size,
+       before lines starting with "def" (a procedure can only start there)
+Signatures: the workers parse the global variables and the signatures of the procedures
+            of each run, skipping the bodies but noting the calls (RDParser.signatures),
+            then the parent checks and declares them, and builds the call graph
+Bodies: the workers parse and type check the procedures of each run, with the symbol
+        table of the globals inherited from the parent, then lower those main can call
+        and send back their bodies
+
+The bodies are put back in declaration order. Temporaries and labels are numbered from 0
+in each procedure (see proc_to_tac), so the TAC is the same as the one of bx2tac.
+If anything fails (an error, or a procedure nested too deeply for the recursive descent
+parser), the program is compiled again by bx2tac, so the error reported is the same.
+"""
+
+
+# The state of a worker process, set by start_worker() before its first task
+worker = None
+
+
+def start_worker(code, file, symbols=None, live=None):
+    global worker
+    ctx = CompilationContext(file, code)
+    if symbols is not None:
+        ctx.symbols = symbols
+    worker = (code, ctx, live)
+
+
+# First round: the declarations of code[begin:end], procedures without their body, and
+# the names each procedure calls, or None on any error
+def parse_signatures(begin, end):
+    code, ctx, _ = worker
+    calls = {}
+    try:
+        return RDParser(code, ctx.filename).signatures(begin, end, calls), calls
+    except (CompileError, RecursionError):
+        return None
+
+
+# Second round: the procedures of code[begin:end] type checked, and the bodies of those
+# in live lowered, or None on any error
+def check_and_lower(begin, end):
+    code, ctx, live = worker
+    symbols = ctx.symbols
+    size = len(symbols.names)
+    bodies = []
+    try:
+        for decl in RDParser(code, ctx.filename).iter_decls(begin, end):
+            if not isinstance(decl, ProcDec):
+                continue
+            decl.symbol = symbols.glob(decl.name)
+            decl.type_check(ctx)
+            if decl.name not in live:
+                symbols.forget(size)
+                continue
+            tac = proc_header(ctx, decl)
+            proc_to_tac(ctx, decl, tac)
+            symbols.forget(size)
+            bodies.append(tac.body)
+    except (CompileError, RecursionError):
+        return None
+    return bodies
+
+
+# Compiles code down to the same TAC as bx2tac(), with the procedures parsed, checked and
+# lowered on jobs worker processes. Raises CompileError if the program is not valid
+def parallel_tac(code, file="", jobs=2, stats=NO_STATS):
+    ranges = split(code, 4 * jobs)
+    begins, ends = zip(*ranges)
+
+    with stats.phase('parse'):
+        with ProcessPoolExecutor(max_workers=jobs, initializer=start_worker, initargs=(code, file)) as pool:
+            runs = list(pool.map(parse_signatures, begins, ends))
+    if any(run is None for run in runs):
+        return bx2tac(code, file, CompilationContext(file, code, stats))
+    signatures = [decl for decls, _ in runs for decl in decls]
+    calls = {name: callees for _, run_calls in runs for name, callees in run_calls.items()}
+
+    ctx = CompilationContext(file, code, stats)
+    try:
+        with stats.phase('typecheck'):
+            declare_globals(ctx, signatures)
+    except CompileError:
+        return bx2tac(code, file, CompilationContext(file, code, stats))
+    with stats.phase('callgraph'):
+        signatures = live_decls(ctx, signatures, CallGraph(calls))
+    live = {decl.name for decl in signatures if isinstance(decl, ProcDec)}
+    tac, index = globs(ctx, signatures)
+
+    with stats.phase('parallel'):
+        with ProcessPoolExecutor(max_workers=jobs, initializer=start_worker,
+                                 initargs=(code, file, ctx.symbols, live)) as pool:
+            runs = list(pool.map(check_and_lower, begins, ends))
+    if any(run is None for run in runs):
+        return bx2tac(code, file, CompilationContext(file, code, stats))
+
+    bodies = (body for run in runs for body in run)
+    for (i, _), body in zip(index, bodies):
+        tac[i].body = body
+
+    stats.size('TAC instructions', sum(len(decl.body) for decl in tac if isinstance(decl, Proc)))
+    return tac
+
+
+# Cuts code into at most n (begin, end) ranges of about the same size, each one made of
+# whole declarations: the cuts are before the first "def" starting a line after each
+# n-th of the source. "def" is a keyword and comments end with the line, so it starts
+# a procedure there
+def split(code, n):
+    ranges = []
+    begin = 0
+    for k in range(1, n):
+        pos = code.find('\ndef', max(begin, len(code) * k // n))
+        while pos >= 0 and (code[pos + 4:pos + 5].isalnum() or code[pos + 4:pos + 5] == '_'):
+            pos = code.find('\ndef', pos + 4)
+        if pos < 0:
+            break
+        if pos + 1 > begin:
+            ranges.append((begin, pos + 1))
+            begin = pos + 1
+    ranges.append((begin, None))
+    return ranges
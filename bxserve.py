@@ -0,0 +1,127 @@
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from bxcc import compile_tac, warm_up
+from bxclient import default_socket
+from context import CompileError
+from tac2x64 import write_x64
+
+"""
+.
+Compile server, started with `python bxcc.py --serve [-j N] [--socket PATH]`.
+
+The server keeps the parser, lexer and back end loaded so a compile request
+only pays for the compilation itself:
+
+Requests: each connection to the Unix socket carries one JSON request (see bxclient.py),
+          handled on its own thread
+Queue and workers: compile requests wait in the queue of a pool of N worker processes,
+                   each of which loads the parse tables once when it starts
+Shutdown: a "shutdown" request, SIGTERM or SIGINT stop accepting connections,
+          the requests already received are finished and the socket file is removed
+"""
+
+
+# Runs in a worker process, returns the response to a compile request
+def serve_job(file, code, dumps):
+    try:
+        gvars, procs, dumped = compile_tac(code, file, dumps)
+        asm = io.StringIO()
+        write_x64(gvars, procs, asm)
+    except CompileError as e:
+        return {'ok': False, 'error': str(e)}
+    except Exception as e:
+        return {'ok': False, 'error': f'Internal error: {e!r}'}
+
+    return {'ok': True, 'asm': asm.getvalue(), 'dumps': dumped}
+
+
+# Initializer of the worker processes. They are forked after serve() installs its
+# handlers, which would stop their own copy of the server: Ctrl-C reaches the whole
+# process group, the parent stops and shuts the pool down, so the workers ignore it
+def start_worker():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    warm_up()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            req = json.loads(self.rfile.read().decode('utf-8'))
+        except ValueError as e:
+            self.reply({'ok': False, 'error': f'Bad request: {e}'})
+            return
+        if not isinstance(req, dict):
+            self.reply({'ok': False, 'error': 'Bad request: not a JSON object'})
+            return
+
+        if req.get('op') == 'compile':
+            if not isinstance(req.get('code'), str):
+                self.reply({'ok': False, 'error': 'Bad request: no "code" string'})
+                return
+            future = self.server.pool.submit(serve_job, req.get('file', ''), req['code'], req.get('dumps', ()))
+            self.reply(future.result())
+        elif req.get('op') == 'shutdown':
+            self.reply({'ok': True})
+            self.server.stop()
+        else:
+            self.reply({'ok': False, 'error': f'Unknown request {req.get("op")!r}'})
+
+    def reply(self, obj):
+        self.wfile.write(json.dumps(obj).encode('utf-8'))
+
+
+class CompileServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    # Wait for the requests being handled when closing
+    block_on_close = True
+    daemon_threads = False
+
+    def __init__(self, path, jobs):
+        self.path = path
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=start_worker)
+        super().__init__(path, RequestHandler)
+
+    # serve_forever() has to be stopped from another thread
+    def stop(self):
+        threading.Thread(target=self.shutdown).start()
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# Removes the socket file left by a server that is not running anymore
+def remove_stale_socket(path):
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+            return
+    raise RuntimeError(f'A compile server is already listening on {path}')
+
+
+def serve(path=None, jobs=1):
+    path = path or default_socket()
+    remove_stale_socket(path)
+
+    server = CompileServer(path, jobs)
+    signal.signal(signal.SIGTERM, lambda signum, frame: server.stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: server.stop())
+
+    print(f'bxcc server listening on {path} with {jobs} worker(s)', flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
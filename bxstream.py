@@ -0,0 +1,125 @@
+import json
+
+from json_to_stat import ProcDec
+from bx2front import declare_globals
+from bx2tac import global_vars, live_decls, proc_header, proc_to_tac
+from callgraph import CallGraph
+from tac2x64 import write_x64, write_proc_x64
+from tac_cfopt import optimize_tac
+from context import CompilationContext
+from rdparser import RDParser
+from timing import NO_STATS, count_nodes
+
+"""
+.
+The stream_x64 function compiles a program one procedure at a time (bxcc.py --stream),
+so the memory used is bounded by the largest procedure instead of the whole file.
+
+First pass: the global variables and the signatures of the procedures are parsed and
+            declared, the bodies are only skipped token by token (RDParser.signatures),
+            noting the procedures they call for the call graph
+Second pass: each declaration is parsed, type checked, lowered, optimised and written
+             to the assembly (and the dumps) before the next one is parsed, then its AST,
+             its TAC and the symbols of its locals are dropped. The procedures main
+             never calls are only type checked
+
+The output is the same as without streaming: the globals come first in the assembly
+and the optimised TAC, the dumps are written as the same JSON lists. The errors are
+not reported in the same order (a type error is found before a later syntax error),
+so bxcc compiles an invalid program again without streaming to report its error.
+"""
+
+
+# Writes the assembly of code to out, and the TAC of the stages in dumps ('tac', 'opt')
+# to the files dumps[stage]. Raises CompileError if the program is not valid, and
+# RecursionError if it is nested too deeply for the recursive descent parser
+def stream_x64(code, file, out, dumps=None, stats=NO_STATS):
+    ctx = CompilationContext(file, code, stats)
+    symbols = ctx.symbols
+
+    parser = RDParser(code, file)
+    stats.time_lexer('scan', parser.lex)
+    calls = {}
+    with stats.phase('parse'):
+        signatures = parser.signatures(calls=calls)
+    with stats.phase('typecheck'):
+        declare_globals(ctx, signatures)
+    with stats.phase('callgraph'):
+        live = live_decls(ctx, signatures, CallGraph(calls))
+    live = {decl.name for decl in live if isinstance(decl, ProcDec)}
+
+    globals_tac = []
+    for decl in signatures:
+        if not isinstance(decl, ProcDec):
+            globals_tac.extend(global_vars(ctx, decl))
+    gvars = optimize_tac(globals_tac, stats)[0]
+    global_var = {v.name for v in gvars}
+    write_x64(gvars, [], out, stats)
+    del signatures, globals_tac
+
+    dumped = {stage: JsonList(f) for stage, f in (dumps or {}).items()}
+    if 'opt' in dumped:
+        for v in gvars:
+            dumped['opt'].append(v)
+
+    count = 0
+    size = len(symbols.names)
+    decls = parser.iter_decls()
+    while True:
+        with stats.phase('parse'):
+            decl = next(decls, None)
+        if decl is None:
+            break
+        if stats.enabled:
+            stats.size('AST nodes', count_nodes(decl))
+
+        if not isinstance(decl, ProcDec):
+            for var in decl:
+                var.symbol = symbols.glob(var.name)
+                if 'tac' in dumped:
+                    dumped['tac'].extend(global_vars(ctx, [var]))
+            continue
+
+        decl.symbol = symbols.glob(decl.name)
+        with stats.phase('typecheck'):
+            decl.type_check(ctx)
+        if decl.name not in live:
+            symbols.forget(size)
+            continue
+        with stats.phase('lower'):
+            tac = proc_header(ctx, decl)
+            proc_to_tac(ctx, decl, tac)
+        symbols.forget(size)
+        stats.size('TAC instructions', len(tac.body))
+        if 'tac' in dumped:
+            dumped['tac'].append(tac)
+
+        proc = optimize_tac([tac], stats)[1][0]
+        if 'opt' in dumped:
+            dumped['opt'].append(proc)
+        with stats.phase('emit'):
+            count += write_proc_x64(global_var, proc, out)
+
+    stats.size('assembly lines', count)
+    for d in dumped.values():
+        d.close()
+
+
+# Writes the JSON form of a list of TAC declarations to f one at a time, in the layout
+# of json.dumps()
+class JsonList:
+    def __init__(self, f):
+        self.f = f
+        self.sep = '['
+
+    def append(self, item):
+        self.f.write(self.sep)
+        self.f.write(json.dumps(item.to_tac()))
+        self.sep = ', '
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def close(self):
+        self.f.write('[]' if self.sep == '[' else ']')
@@ -0,0 +1,86 @@
+"""
+.
+The CallGraph class is the graph of the calls between the procedures of a program,
+built from the calls the type checker records in ctx.calls (see ExpressionCall.check)
+and kept in ctx.call_graph.
+
+Calls: for each procedure, in declaration order, the procedures its body calls
+       (the runtime functions such as __bx_print_int are left out)
+Reachable: the procedures main can end up calling, the others are not lowered
+SCCs: the strongly connected components (Tarjan), callees before callers, so a
+      procedure is recursive if its component has several procedures or it calls itself
+
+Both are computed with explicit stacks, a chain of calls may be longer than the
+recursion limit of Python.
+"""
+
+
+class CallGraph:
+    # calls maps the name of every procedure to the names it calls
+    def __init__(self, calls):
+        self.calls = {name: [callee for callee in callees if callee in calls] for name, callees in calls.items()}
+
+    def callees(self, name):
+        return self.calls[name]
+
+    # Names of the procedures called from root, directly or not, root included
+    def reachable(self, root='main'):
+        seen = {root}
+        stack = [root]
+        while stack:
+            for callee in self.calls[stack.pop()]:
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.append(callee)
+        return seen
+
+    # The strongly connected components as lists of names, callees before callers
+    def sccs(self):
+        index = {}
+        low = {}
+        on_stack = set()
+        stack = []
+        components = []
+
+        for root in self.calls:
+            if root in index:
+                continue
+            index[root] = low[root] = len(index)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(self.calls[root]))]
+            while work:
+                name, callees = work[-1]
+                for callee in callees:
+                    if callee not in index:
+                        index[callee] = low[callee] = len(index)
+                        stack.append(callee)
+                        on_stack.add(callee)
+                        work.append((callee, iter(self.calls[callee])))
+                        break
+                    if callee in on_stack:
+                        low[name] = min(low[name], index[callee])
+                else:
+                    work.pop()
+                    if work:
+                        caller = work[-1][0]
+                        low[caller] = min(low[caller], low[name])
+                    if low[name] == index[name]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == name:
+                                break
+                        components.append(component)
+        return components
+
+    # Names of the procedures that can call themselves, directly or not
+    def recursive(self):
+        names = set()
+        for component in self.sccs():
+            if len(component) > 1 or component[0] in self.calls[component[0]]:
+                names.update(component)
+        return names
+
@@ -0,0 +1,71 @@
+"""
+.
+The CompilationContext class owns all the state of one compilation:
+
+Source: the file name, used when reporting errors
+Symbols: the SymbolTable resolving the names of the program (see symbols.py),
+         return_type: the return type of the procedure being type checked
+Calls: the procedures each procedure calls, in the order of their first call, recorded
+       by the type checker in calls (callees is the entry of the procedure being
+       checked), and the CallGraph built from them (see callgraph.py)
+Counters: the next free temporary and label numbers
+Loops: the number of loops around the statement being type checked, and the break and
+       continue label stacks of the enclosing loops when lowering
+Stats: the PassStats collecting the --time-passes report (NO_STATS if not asked for)
+
+Errors in the compiled program are raised as CompileError instead of exiting,
+so a fresh context per file lets many compilations run in the same process.
+"""
+
+from timing import NO_STATS
+from symbols import SymbolTable
+from tac import temp, label
+
+
+class CompileError(Exception):
+    def __init__(self, message, filename=None, lineno=None, info=None):
+        super().__init__(message)
+        self.message = message
+        self.filename = filename
+        self.lineno = lineno
+        self.info = info
+
+    # Same layout as the messages the scripts used to print
+    def __str__(self):
+        out = []
+        if self.filename is not None:
+            if self.lineno is not None:
+                out.append(f'File "{self.filename}", line {self.lineno}')
+            else:
+                out.append(f'File "{self.filename}"')
+        out.append(f'Error: {self.message}')
+        if self.info is not None:
+            out.append(self.info)
+        return '\n'.join(out)
+
+
+class CompilationContext:
+    def __init__(self, filename="", code="", stats=NO_STATS):
+        self.filename = filename
+        self.stats = stats
+        self.symbols = SymbolTable()
+        self.return_type = None
+        self.loop_depth = 0
+        self.calls = {}
+        self.callees = None
+        self.call_graph = None
+        self.next_temporary = 0
+        self.next_label = 0
+        self.break_stack = []
+        self.continue_stack = []
+
+    def error(self, lineno, message, info=None):
+        raise CompileError(message, self.filename, lineno, info)
+
+    def new_temporary(self):
+        self.next_temporary += 1
+        return temp(self.next_temporary - 1)
+
+    def new_label(self):
+        self.next_label += 1
+        return label(self.next_label - 1)
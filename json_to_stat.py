@@ -1,9 +1,17 @@
-scopes = [dict()]
-filename = ''
-lines = []
+from trampoline import trampoline
 
+"""
+.
+The classes of the AST built by the parsers, with the type checker of each node (check()).
+
+The nodes have __slots__ instead of a __dict__, as the AST is the largest structure the
+compiler keeps in memory: the attributes filled by the type checker (type, symbol) have
+a slot as well, and the type of the constants is a class attribute.
+"""
 
 class ProcDec:
+    __slots__ = ('name', 'args', 'type', 'body', 'lineno', 'col', 'symbol')
+
     def __init__(self, name, args, type, body, lineno, col):
         self.name = name
         self.args = args
@@ -12,60 +20,63 @@ class ProcDec:
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        scopes.append(self.type)
-        scopes.append(dict())
+    def type_check(self, ctx):
+        return trampoline(self.check(ctx))
+
+    def check(self, ctx):
+        ctx.return_type = self.type
+        ctx.loop_depth = 0
+        ctx.callees = ctx.calls[self.name] = {}
+        ctx.symbols.push()
         for arg in self.args:
-            if arg.name in scopes[-1]:
-                print(f'File "{filename}", line {arg.lineno}')
-                print(f'Error: Argument "{arg.name}" already given within the procdure {self.name}')
-                sys.exit(1)
+            if ctx.symbols.local(arg.name) is not None:
+                ctx.error(arg.lineno, f'Argument "{arg.name}" already given within the procdure {self.name}')
             else:
-                scopes[-1][arg.name] = (arg.type, arg.lineno)
+                arg.symbol = ctx.symbols.declare(arg.name, arg.type, arg.lineno)
 
-        has_return = self.body.type_check()
-        scopes.pop()
-        scopes.pop()
+        has_return = yield self.body.check(ctx)
+        ctx.symbols.pop()
 
         if self.type != 'void' and not has_return:
-            print(f'File "{filename}", line {self.lineno}')
-            print(f'Error: Function {self.name} does not return value on every possible code path')
-            sys.exit(1)
-
-    def to_tac(self):
-        result = {"proc": self.name, "args": list(self.args), "body": []}
-        for i in self.body:
-            result["body"].append(i.to_tac())
-        return result
+            ctx.error(self.lineno, f'Function {self.name} does not return value on every possible code path')
 
 
 class Statment:
-    pass
+    __slots__ = ()
+
+    # Type checks the statement, returns whether it returns on every path.
+    # check() yields the checks of the children instead of calling them, see trampoline.py
+    def type_check(self, ctx):
+        return trampoline(self.check(ctx))
 
 
 class StatementBlock(Statment):
+    __slots__ = ('body', 'lineno', 'col')
+
     def __init__(self, body, lineno, col):
         self.body = body
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        scopes.append(dict())
+    def check(self, ctx):
+        ctx.symbols.push()
         has_return = False
 
         for stmt in self.body:
             if not isinstance(stmt, Statment):
                 for s in stmt:
-                    has_return = max(s.type_check(), has_return)
+                    has_return = max((yield s.check(ctx)), has_return)
             else:
-                has_return = max(stmt.type_check(), has_return)
+                has_return = max((yield stmt.check(ctx)), has_return)
 
-        scopes.pop()
+        ctx.symbols.pop()
 
         return has_return
 
 
 class StatementVarDecl(Statment):
+    __slots__ = ('name', 'initial', 'type', 'lineno', 'col', 'symbol')
+
     def __init__(self, name, initial, type, lineno, col):
         self.name = name
         self.initial = initial
@@ -73,81 +84,72 @@ class StatementVarDecl(Statment):
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        if self.name in scopes[-1]:
-            print(f'File "{filename}", line {self.lineno}')
-            print(f'Error: Redecalred variable "{self.name}" within the scope')
-            sys.exit(1)
+    def check(self, ctx):
+        if ctx.symbols.local(self.name) is not None:
+            ctx.error(self.lineno, f'Redecalred variable "{self.name}" within the scope')
 
-        self.initial.type_check()
+        yield self.initial.check(ctx)
 
         if self.type == 'void':
-            print(f'File "{filename}", line {self.lineno}')
-            print(f'Error: Variable "{self.name}" cannot be declared as VOID')
-            sys.exit(1)
+            ctx.error(self.lineno, f'Variable "{self.name}" cannot be declared as VOID')
 
         elif self.initial.type == 'void':
-            print(f'File "{filename}", line {self.initial.lineno}')
-            print(f'Error: Variable "{self.name}" cannot be initialized with expression of type VOID')
-            sys.exit(1)
+            ctx.error(self.initial.lineno, f'Variable "{self.name}" cannot be initialized with expression of type VOID')
 
         if self.initial.type != self.type:
-            print(f'File "{filename}", line {self.initial.lineno}')
-            print(f'Error: Variable "{self.name}" of type "{self.type}" initialized with expression of different type "{self.initial.type}"')
-            sys.exit(1)
+            ctx.error(self.initial.lineno, f'Variable "{self.name}" of type "{self.type}" initialized with expression of different type "{self.initial.type}"')
 
-        scopes[-1][self.name] = (self.initial.type, self.lineno)
+        self.symbol = ctx.symbols.declare(self.name, self.initial.type, self.lineno)
 
         return False
 
-    def to_tac(self):
-        return {"var": self.name, "init": self.initial}
-
 
 class StatementAssign(Statment):
+    __slots__ = ('target', 'expr', 'lineno', 'col', 'type')
+
     def __init__(self, target, expr, lineno, col):
         self.target = target
         self.expr = expr
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        self.target.type_check()
-        self.expr.type_check()
+    def check(self, ctx):
+        self.target.check(ctx)
+        yield self.expr.check(ctx)
         self.type = self.target.type
 
         if self.expr.type == 'void':
-            print(f'File "{filename}", line {self.expr.lineno}')
-            print(f'Error: Variable "{self.target.name}" cannot be assigned with expression of type VOID')
-            sys.exit(1)
+            ctx.error(self.expr.lineno, f'Variable "{self.target.name}" cannot be assigned with expression of type VOID')
 
         if self.type != self.expr.type:
-            print(f'File "{filename}", line {self.expr.lineno}')
-            print(f'Error: Variable "{self.target.name}" of type "{self.type}" assigned with expression of different type "{self.expr.type}"')
-            sys.exit(1)
+            ctx.error(self.expr.lineno, f'Variable "{self.target.name}" of type "{self.type}" assigned with expression of different type "{self.expr.type}"')
 
         return False
 
 
 class StatementWhile(Statment):
+    __slots__ = ('condition', 'instructions', 'lineno', 'col')
+
     def __init__(self, condition, instructions, lineno, col):
         self.condition = condition
         self.instructions = instructions
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        self.condition.type_check()
+    def check(self, ctx):
+        yield self.condition.check(ctx)
         if self.condition.type != 'bool':
-            print(f'File "{filename}", line {self.condition.lineno}')
-            print(f'Error: Condition in WHILE has to be of "bool" type, "{self.condition.type}" given')
-            sys.exit(1)
+            ctx.error(self.condition.lineno, f'Condition in WHILE has to be of "bool" type, "{self.condition.type}" given')
 
-        self.instructions.type_check()
+        ctx.loop_depth += 1
+        yield self.instructions.check(ctx)
+        ctx.loop_depth -= 1
         return False
 
 
 class StatementIf(Statment):
+    __slots__ = ('condition', 'instructions', 'else_case', 'lineno', 'col')
+
     def __init__(self, condition, instructions, else_case, lineno, col):
         self.condition = condition
         self.instructions = instructions
@@ -155,150 +157,158 @@ class StatementIf(Statment):
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        self.condition.type_check()
+    def check(self, ctx):
+        yield self.condition.check(ctx)
         if self.condition.type != 'bool':
-            print(f'File "{filename}", line {self.condition.lineno}')
-            print(f'Error: Condition in IF has to be of "bool" type, "{self.condition.type}" given')
-            sys.exit(1)
+            ctx.error(self.condition.lineno, f'Condition in IF has to be of "bool" type, "{self.condition.type}" given')
 
-        has_return_if = self.instructions.type_check()
+        has_return_if = yield self.instructions.check(ctx)
         has_return_else = False
         if self.else_case is not None:
-            has_return_else = self.else_case.type_check()
+            has_return_else = yield self.else_case.check(ctx)
 
         return has_return_if and has_return_else
 
 
 class StatementEval(Statment):
+    __slots__ = ('expr', 'lineno', 'col', 'type')
+
     def __init__(self, expr, lineno, col):
         self.expr = expr
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        self.expr.type_check()
+    def check(self, ctx):
+        yield self.expr.check(ctx)
         self.type = self.expr.type
         return False
 
 
 class StructuredJump(Statment):
+    __slots__ = ('jump_type', 'lineno', 'col')
+
     def __init__(self, jump_type, lineno, col):
         self.jump_type = jump_type
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
+    # Checked here rather than when lowering, as an unreachable jump may be folded away
+    def check(self, ctx):
+        if ctx.loop_depth == 0:
+            ctx.error(self.lineno, f'{self.jump_type.capitalize()} instruction out of loop')
         return False
 
 
 class StatementReturn(Statment):
+    __slots__ = ('expr', 'lineno', 'col', 'type')
+
     def __init__(self, expr, lineno, col):
         self.expr = expr
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
+    def check(self, ctx):
         if self.expr is not None:
-            self.expr.type_check()
+            yield self.expr.check(ctx)
             self.type = self.expr.type
 
-            if self.expr.type != scopes[1]:
-                print(f'File "{filename}", line {self.expr.lineno}')
-                print(f'Error: Cannot return expression of type "{self.expr.type}"')
-                sys.exit(1)
+            if self.expr.type != ctx.return_type:
+                ctx.error(self.expr.lineno, f'Cannot return expression of type "{self.expr.type}"')
         else:
             self.type = "void"
-            if scopes[1] != 'void':
-                print(f'File "{filename}", line {self.expr.lineno}')
-                print(f'Error: Cannot return expression void type when function requires "{scopes[1]}"')
-                sys.exit(1)
+            if ctx.return_type != 'void':
+                ctx.error(self.lineno, f'Cannot return expression void type when function requires "{ctx.return_type}"')
 
         return True
 
 
 class Expression:
-    pass
+    __slots__ = ()
+
+    def type_check(self, ctx):
+        return trampoline(self.check(ctx))
 
 
 class ExpressionVar(Expression):
+    __slots__ = ('name', 'lineno', 'col', 'type', 'symbol')
+
     def __init__(self, name, lineno, col, type=None):
         self.name = name
         self.lineno = lineno
         self.type = type
         self.col = col
 
-    def type_check(self):
-        for scope in reversed(scopes):
-            if self.name in scope:
-                if self.type is None:
-                    self.type = scope[self.name][0]
+    # Resolves the variable to the ID of its declaration, stored in self.symbol
+    def check(self, ctx):
+        symbol = ctx.symbols.lookup(self.name)
+        if symbol is None:
+            ctx.error(self.lineno, f'Undeclared variable "{self.name}"')
 
-                elif self.type != scopes[self.name][0]:
-                    print(f'File "{filename}", line {self.lineno}')
-                    print(f'Error: Variable "{self.name}" of type {self.type} has been declared with type "{scopes[self.name][0]}"')
-                    sys.exit(1)
+        type = ctx.symbols.types[symbol]
+        if self.type is None:
+            self.type = type
 
-                return
-        else:
-            print(f'File "{filename}", line {self.lineno}')
-            print(f'Error: Undeclared variable "{self.name}"')
-            sys.exit(1)
+        elif self.type != type:
+            ctx.error(self.lineno, f'Variable "{self.name}" of type {self.type} has been declared with type "{type}"')
+
+        self.symbol = symbol
 
 
 class ExpressionInt(Expression):
+    __slots__ = ('value', 'lineno', 'col')
+    type = 'int'
+
     def __init__(self, value, lineno, col):
         self.value = value
         self.lineno = lineno
-        self.type = 'int'
         self.col = col
 
-    def type_check(self):
+    def check(self, ctx):
         return
 
 
 class ExpressionBool(Expression):
+    __slots__ = ('value', 'lineno', 'col')
+    type = 'bool'
+
     def __init__(self, value, lineno, col):
         self.value = value
         self.lineno = lineno
-        self.type = 'bool'
         self.col = col
 
-    def type_check(self):
+    def check(self, ctx):
         return
 
 
 class ExpressionUniOp(Expression):
+    __slots__ = ('op', 'arg', 'lineno', 'col', 'type')
+
     def __init__(self, op, arg, lineno, col):
         self.op = op
         self.arg = arg
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        self.arg.type_check()
+    def check(self, ctx):
+        yield self.arg.check(ctx)
         if self.op in ['not', 'sub', 'neg']:
             if self.arg.type == 'int':
                 self.type = 'int'
             else:
-                print(f'File "{filename}", line {self.arg.lineno}')
-                print(f"Error: Operation and argumet's type '{self.arg.type}' not compatible")
-                sys.exit(1)
+                ctx.error(self.arg.lineno, f"Operation and argumet's type '{self.arg.type}' not compatible")
 
         elif self.op == 'NOT':
             if self.arg.type == 'bool':
                 self.type = 'bool'
             else:
-                print(f'File "{filename}", line {self.arg.lineno}')
-                print(f'Error: Operation and argumet type "{self.arg.type}" not compatible')
-                sys.exit(1)
+                ctx.error(self.arg.lineno, f'Operation and argumet type "{self.arg.type}" not compatible')
         else:
-            print(f'File "{filename}", line {self.lineno}')
-            print(f'Error: Unknown operation "{self.op}"')
-            sys.exit(1)
+            ctx.error(self.lineno, f'Unknown operation "{self.op}"')
 
 
 class ExpressionBinOp(Expression):
+    __slots__ = ('arg_left', 'arg_right', 'op', 'lineno', 'col', 'type')
+
     def __init__(self, arg_left, op, arg_right, lineno, col):
         self.arg_left = arg_left
         self.arg_right = arg_right
@@ -306,89 +316,74 @@ class ExpressionBinOp(Expression):
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
-        self.arg_left.type_check()
-        self.arg_right.type_check()
+    def check(self, ctx):
+        yield self.arg_left.check(ctx)
+        yield self.arg_right.check(ctx)
         if self.op in ['add', 'sub', 'mul', 'div', 'mod', 'shr',
                        'shl', 'xor', 'or', 'and']:
             if self.arg_left.type == 'int' and self.arg_right.type == 'int':
                 self.type = 'int'
             else:
-                print(f'File "{filename}", line {self.arg_right.lineno}')
-                print(f"Error: Operation and argument types not compatible")
-                sys.exit(1)
+                ctx.error(self.arg_right.lineno, f"Operation and argument types not compatible")
 
         elif self.op in ['AND', 'OR']:
             if self.arg_left.type == 'bool' and self.arg_right.type == 'bool':
                 self.type = 'bool'
             else:
-                print(f'File "{filename}", line {self.arg_right.lineno}')
-                print(f"Error: Operation and argument types not compatible")
-                sys.exit(1)
+                ctx.error(self.arg_right.lineno, f"Operation and argument types not compatible")
         
         elif self.op in ['jz', 'jnz']:
             if (self.arg_left.type == 'int' and self.arg_right.type == 'int') or (self.arg_left.type == 'bool' and self.arg_right.type == 'bool'):
                 self.type = 'bool'
             else:
-                print(f'File "{filename}", line {self.arg_right.lineno}')
-                print(f"Error: Operation and argument types not compatible")
-                sys.exit(1)
+                ctx.error(self.arg_right.lineno, f"Operation and argument types not compatible")
 
         elif self.op in ['jl', 'jnle', 'jle', 'jnl']:
             if self.arg_left.type == 'int' and self.arg_right.type == 'int':
                 self.type = 'bool'
             else:
-                print(f'File "{filename}", line {self.arg_right.lineno}')
-                print(f"Error: Operation and argument types not compatible")
-                sys.exit(1)
+                ctx.error(self.arg_right.lineno, f"Operation and argument types not compatible")
         else:
-            print(f'File "{filename}", line {self.lineno}')
-            print(f"Error: Unknown operation '{self.op}'")
-            sys.exit(1)
+            ctx.error(self.lineno, f"Unknown operation '{self.op}'")
 
 
 class ExpressionCall(Expression):
+    __slots__ = ('function', 'args', 'lineno', 'col', 'type')
+
     def __init__(self, function, args, lineno, col):
         self.function = function
         self.args = args
         self.lineno = lineno
         self.col = col
 
-    def type_check(self):
+    def check(self, ctx):
+        symbol = ctx.symbols.glob(self.function)
         if self.function == 'print':
             self.type = "void"
             if len(self.args) != 1:
-                print(f'File "{filename}", line {self.lineno}')
-                print(f'Error: Function "print" can only have one argument, {len(self.args)} given')
-                sys.exit(1)
+                ctx.error(self.lineno, f'Function "print" can only have one argument, {len(self.args)} given')
 
-            self.args[0].type_check()
+            yield self.args[0].check(ctx)
             if self.args[0].type == "int":
                 self.function = '__bx_print_int'
             elif self.args[0].type == "bool":
                 self.function = '__bx_print_bool'
             else:
-                print(f'File "{filename}", line {self.args[0].lineno}')
-                print(f'Error: Cannot print() expression of type "{self.args[0].type}"')
-                sys.exit(1)
+                ctx.error(self.args[0].lineno, f'Cannot print() expression of type "{self.args[0].type}"')
 
-        elif self.function in scopes[0]:
-            self.type, lineno, args_types = scopes[0][self.function]
+        elif symbol is not None and ctx.symbols.params[symbol] is not None:
+            ctx.callees[self.function] = None
+            self.type = ctx.symbols.types[symbol]
+            args_types = ctx.symbols.params[symbol]
 
             if len(self.args) != len(args_types):
-                print(f'File "{filename}", line {self.lineno}')
-                print(f'Error: Function "{self.function}" has requires {len(args_types)} arguments, {len(self.args)} given')
-                sys.exit(1)
+                ctx.error(self.lineno, f'Function "{self.function}" has requires {len(args_types)} arguments, {len(self.args)} given')
 
             for i in range(len(self.args)):
-                self.args[i].type_check()
+                yield self.args[i].check(ctx)
                 if self.args[i].type != args_types[i]:
-                    print(f'File "{filename}", line {self.args[i].lineno}')
-                    print(f'Error: Argument of number {i + 1} is of wrong type "{self.args[i].type}"')
-                    sys.exit(1)
+                    ctx.error(self.args[i].lineno, f'Argument of number {i + 1} is of wrong type "{self.args[i].type}"')
         else:
-            print(f'File "{filename}", line {self.lineno}')
-            print(f'Error: Undeclared procedure "{self.function}"')
-            sys.exit(1)
+            ctx.error(self.lineno, f'Undeclared procedure "{self.function}"')
 
         return
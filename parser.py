@@ -1,7 +1,10 @@
 import getopt
+import os
 import sys
 from py.ply import yacc as yacc
-from scanner import Lexer
+from scanner import make_lexer
+from rdparser import RDParser
+from context import CompileError
 import json_to_stat as jts
 
 """
@@ -19,14 +22,23 @@ Variables: Declaration, initialisation, and assignment
 Expressions: Operators with proper precedence
 Structured jumps: break and continue statements
 
+make_parser() picks between this parser and the recursive descent one of rdparser.py,
+which builds the same AST: 'rd' unless $BX_PARSER says otherwise.
 """
 
+PARSERS = ('rd', 'yacc')
+
+# The LALR tables are built once and cached here, keyed by a hash of the grammar
+TABCACHE = os.environ.get('BX_TABCACHE') or \
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__')
+
 
 class Parser(object):
-    def __init__(self, code, filename=""):
-        self.lex = Lexer(filename=filename)
+    # scanner picks the scanner backend, see make_lexer()
+    def __init__(self, code, filename="", scanner=None):
+        self.lex = make_lexer(filename, scanner)
         self.tokens = self.lex.tokens
-        self.parser = yacc.yacc(module=self, start='program')
+        self.parser = yacc.yacc(module=self, start='program', tabcache=TABCACHE)
         self.filename = filename
         self.code = code
 
@@ -49,14 +61,12 @@ class Parser(object):
         ('right', 'neg', 'NOT'),
         ('right', 'not'))
 
-    # Handles parsing errors, reporting the filename, line number, and the unexpected token, then exits the program
+    # Handles parsing errors, raising a CompileError with the filename, line number, and the unexpected token
     def p_error(self, p):
         if not p:
-            print(f'Error: Invalid program')
+            raise CompileError('Invalid program')
         else:
-            print(f'File "{self.filename}", line {p.lineno}')
-            print(f'Error: Unexpected sign "{p.value}"')
-        sys.exit(1)
+            raise CompileError(f'Unexpected sign "{p.value}"', self.filename, p.lineno)
 
     # All the set of rules
     
@@ -114,21 +124,22 @@ class Parser(object):
         '''expr : LPAREN expr RPAREN'''
         p[0] = p[2]
 
+    # The list rules are left-recursive and append to the list of their first symbol,
+    # so a list of N items is built in O(N) with a bounded LR stack
+
     def p_expr_seq(self, p):
-        '''expr_seq : expr COMMA expr_seq
+        '''expr_seq : expr_seq COMMA expr
                     | expr'''
-        p[0] = [p[1]] + (p[3] if len(p) > 2 else [])
+        if len(p) > 2:
+            p[0] = p[1]
+            p[0].append(p[3])
+        else:
+            p[0] = [p[1]]
 
     def p_exprs(self, p):
-        '''exprs : expr COMMA expr_seq
-                | expr
+        '''exprs : expr_seq
                 |'''
-        if len(p) == 1:
-            p[0] = []
-        elif len(p) == 2:
-            p[0] = [p[1]]
-        else:
-            p[0] = [p[1]] + p[3]
+        p[0] = p[1] if len(p) > 1 else []
 
     def p_expr_proc_call(self, p):
         '''expr : IDENT LPAREN exprs RPAREN'''
@@ -137,12 +148,16 @@ class Parser(object):
     def p_type(self, p):
         '''type : INT
                 | BOOL'''
-        p[0] = p[1].lower()
+        p[0] = sys.intern(p[1].lower())
 
     def p_varinits(self, p):
-        '''varinits : IDENT ASSIGN expr COMMA varinits
+        '''varinits : varinits COMMA IDENT ASSIGN expr
                     | IDENT ASSIGN expr'''
-        p[0] = [(p[1], p[3], p.lineno(1), self.lex.find_tok_column(p, 1))] + (p[5] if len(p) > 4 else [])
+        if len(p) > 4:
+            p[0] = p[1]
+            p[0].append((p[3], p[5], p.lineno(3), self.lex.find_tok_column(p, 3)))
+        else:
+            p[0] = [(p[1], p[3], p.lineno(1), self.lex.find_tok_column(p, 1))]
 
     def p_vardecl(self, p):
         '''vardecl : VAR varinits COLON type SEMICOLON'''
@@ -184,45 +199,51 @@ class Parser(object):
         p[0] = jts.StatementWhile(p[3], p[5], lineno=p.lineno(1), col=self.lex.find_tok_column(p, 1))
 
     def p_stmt(self, p):
-        '''stmts : vardecl stmts
-                | block stmts
-                | assign stmts
-                | eval stmts
-                | while stmts
-                | ifelse stmts
-                | jump stmts
-                | return stmts
+        '''stmts : stmts vardecl
+                | stmts block
+                | stmts assign
+                | stmts eval
+                | stmts while
+                | stmts ifelse
+                | stmts jump
+                | stmts return
                 |'''
-        p[0] = [p[1]] + p[2] if len(p) > 1 else []
+        if len(p) > 1:
+            p[0] = p[1]
+            p[0].append(p[2])
+        else:
+            p[0] = []
 
     def p_block(self, p):
         '''block : LBRACE stmts RBRACE'''
         p[0] = jts.StatementBlock(p[2], p.lineno(1), self.lex.find_tok_column(p, 1))
 
     def p_idents(self, p):
-        '''idents : IDENT COMMA idents
+        '''idents : idents COMMA IDENT
                 | IDENT'''
-        p[0] = [(p[1], p.lineno(1), self.lex.find_tok_column(p, 1))] + (p[3] if len(p) > 2 else [])
+        if len(p) > 2:
+            p[0] = p[1]
+            p[0].append((p[3], p.lineno(3), self.lex.find_tok_column(p, 3)))
+        else:
+            p[0] = [(p[1], p.lineno(1), self.lex.find_tok_column(p, 1))]
 
     def p_param(self, p):
         '''param : idents COLON type'''
         p[0] = [jts.ExpressionVar(var[0], var[1], var[2], p[3]) for var in p[1]]
 
     def p_params_arr(self, p):
-        '''params_arr : param COMMA params_arr
+        '''params_arr : params_arr COMMA param
                     | param'''
-        p[0] = p[1] + (p[3] if len(p) > 2 else [])
-
-    def p_params(self, p):
-        '''params : param COMMA params_arr
-                | param
-                |'''
         if len(p) > 2:
-            p[0] = p[1] + p[3]
-        elif len(p) == 2:
             p[0] = p[1]
+            p[0].extend(p[3])
         else:
-            p[0] = []
+            p[0] = p[1]
+
+    def p_params(self, p):
+        '''params : params_arr
+                |'''
+        p[0] = p[1] if len(p) > 1 else []
 
     def p_proctype(self, p):
         '''proctype : COLON type
@@ -239,10 +260,23 @@ class Parser(object):
         p[0] = p[1]
 
     def p_decls(self, p):
-        '''decls : decl decls
+        '''decls : decls decl
                 |'''
-        p[0] = [p[1]] + p[2] if len(p) > 1 else []
+        if len(p) > 1:
+            p[0] = p[1]
+            p[0].append(p[2])
+        else:
+            p[0] = []
 
     def p_program(self, p):
         '''program : decls'''
         p[0] = p[1]
+
+
+def make_parser(code, filename="", backend=None, scanner=None):
+    backend = backend or os.environ.get('BX_PARSER') or 'rd'
+    if backend == 'rd':
+        return RDParser(code, filename, scanner)
+    if backend == 'yacc':
+        return Parser(code, filename, scanner)
+    raise ValueError(f'Unknown parser {backend!r}, expected one of {", ".join(PARSERS)}')
@@ -0,0 +1,322 @@
+from sys import intern
+from scanner import make_lexer
+from context import CompileError
+import json_to_stat as jts
+
+"""
+The RDParser class is a hand-written recursive descent parser for the grammar of parser.py.
+
+Declarations and statements: one method per rule, the next token picks the alternative
+Expressions: precedence climbing (Pratt), each binary operator has the level of its line
+             in the precedence table of parser.py, the unary operators bind tighter than all of them
+Lists: built with loops, so the call depth only grows with the nesting of the program,
+       programs nested deeper than the Python stack allows fall back to the yacc parser
+
+For the streaming mode (bxstream.py), signatures() reads the declarations without the
+bodies of the procedures, and iter_decls() generates the declarations one at a time.
+
+It builds exactly the same AST as the yacc parser, with the same line numbers and
+columns, and raises the same CompileError on the same token: 'Unexpected sign' for
+the first token that cannot continue the program, 'Invalid program' at the end of
+the input. Like yacc, it gives no position to rules starting with an expression
+(assignments and evaluations get line 0, column 1).
+"""
+
+# Level and associativity of the binary operators, from the precedence table of parser.py
+BINARY = {'OR': 1, 'AND': 2, 'or': 3, 'xor': 4, 'and': 5,
+          'jz': 6, 'jnz': 6, 'jl': 7, 'jnle': 7, 'jle': 7, 'jnl': 7,
+          'shl': 8, 'shr': 8, 'add': 9, 'sub': 9, 'mul': 10, 'div': 10, 'mod': 10}
+NONASSOC = {6, 7}
+UNARY_LEVEL = 11
+
+# Name of each operator in the AST
+BINARY_NAME = {'+': 'add', '-': 'sub', '*': 'mul',
+               '/': 'div', '%': 'mod', '>>': 'shr', '<<': 'shl',
+               '^': 'xor', '|': 'or', '&': 'and', '||': 'OR',
+               '&&': 'AND', '==': 'jz', '!=': 'jnz', '<': 'jl',
+               '>': 'jnle', '<=': 'jle', '>=': 'jnl'}
+UNARY_NAME = {'-': 'neg', '~': 'not', '!': 'NOT'}
+UNARY = {'sub', 'not', 'neg', 'NOT'}
+
+
+class RDParser(object):
+    def __init__(self, code, filename="", scanner=None):
+        self.lex = make_lexer(filename, scanner)
+        self.tokens = self.lex.tokens
+        self.filename = filename
+        self.code = code
+
+    # Parse the input code and returns the AST. Programs nested too deeply for the
+    # Python stack are parsed again by the yacc parser, whose stack is a list
+    def parse(self):
+        self.start()
+        try:
+            return list(self.decls())
+        except RecursionError:
+            from parser import Parser
+            parser = Parser(self.code, self.filename)
+            parser.lex = self.lex
+            return parser.parse()
+
+    # Generates the top-level declarations one at a time, for the streaming mode (see bxstream.py),
+    # only those of code[begin:end] if given (see bxincr.py). Raises RecursionError if a declaration
+    # is nested too deeply
+    def iter_decls(self, begin=0, end=None):
+        self.start(begin, end)
+        return self.decls()
+
+    # First pass of the streaming mode: the global variables and the procedures with their
+    # signature only (body None), the bodies are skipped by matching the braces.
+    # Only those of code[begin:end] if given (see bxparallel.py). If calls is given,
+    # calls[name] is set to the names called by the body of each procedure (see callgraph.py)
+    def signatures(self, begin=0, end=None, calls=None):
+        self.start(begin, end)
+        decls = []
+        while self.tok is not None:
+            if self.tok.type == 'VAR':
+                decls.append(self.vardecl())
+            elif self.tok.type == 'DEF':
+                decls.append(self.procdecl(skip_body=True, calls=calls))
+            else:
+                self.error()
+        return decls
+
+    def start(self, begin=0, end=None):
+        self.lex.input(self.code, begin, end)
+        self.next_token = self.lex.token
+        self.tok = self.next_token()
+
+    # Raises the error for the current token
+    def error(self):
+        if self.tok is None:
+            raise CompileError('Invalid program')
+        raise CompileError(f'Unexpected sign "{self.tok.value}"', self.filename, self.tok.lineno)
+
+    # Consumes the current token, which must be of type kind, and returns it
+    def expect(self, kind):
+        tok = self.tok
+        if tok is None or tok.type != kind:
+            self.error()
+        self.tok = self.next_token()
+        return tok
+
+    def column(self, tok):
+        return self.lex.line_col(tok.lexpos)[1]
+
+    # Declarations
+
+    def decls(self):
+        while self.tok is not None:
+            if self.tok.type == 'VAR':
+                yield self.vardecl()
+            elif self.tok.type == 'DEF':
+                yield self.procdecl()
+            else:
+                self.error()
+
+    def vardecl(self):
+        self.expect('VAR')
+        varinits = [self.varinit()]
+        while self.tok is not None and self.tok.type == 'COMMA':
+            self.tok = self.next_token()
+            varinits.append(self.varinit())
+        self.expect('COLON')
+        type = self.type()
+        self.expect('SEMICOLON')
+        return [jts.StatementVarDecl(name, expr, type, lineno, col) for name, expr, lineno, col in varinits]
+
+    def varinit(self):
+        name = self.expect('IDENT')
+        self.expect('ASSIGN')
+        return (name.value, self.expr(), name.lineno, self.column(name))
+
+    def type(self):
+        if self.tok is None or self.tok.type not in ('INT', 'BOOL'):
+            self.error()
+        return intern(self.expect(self.tok.type).value.lower())
+
+    def procdecl(self, skip_body=False, calls=None):
+        tok = self.expect('DEF')
+        name = self.expect('IDENT').value
+        self.expect('LPAREN')
+        params = self.params()
+        self.expect('RPAREN')
+        if self.tok is not None and self.tok.type == 'COLON':
+            self.tok = self.next_token()
+            type = self.type()
+        else:
+            type = "void"
+        if skip_body:
+            body = None
+            callees = self.skip_block()
+            if calls is not None:
+                calls[name] = callees
+        else:
+            body = self.block()
+        return jts.ProcDec(name, params, type, body, tok.lineno, self.column(tok))
+
+    def params(self):
+        if self.tok is not None and self.tok.type == 'RPAREN':
+            return []
+        params = self.param()
+        while self.tok is not None and self.tok.type == 'COMMA':
+            self.tok = self.next_token()
+            params.extend(self.param())
+        return params
+
+    def param(self):
+        idents = [self.expect('IDENT')]
+        while self.tok is not None and self.tok.type == 'COMMA':
+            self.tok = self.next_token()
+            idents.append(self.expect('IDENT'))
+        self.expect('COLON')
+        type = self.type()
+        return [jts.ExpressionVar(tok.value, tok.lineno, self.column(tok), type) for tok in idents]
+
+    # Statements
+
+    def block(self):
+        tok = self.expect('LBRACE')
+        stmts = []
+        while self.tok is not None and self.tok.type != 'RBRACE':
+            stmts.append(self.stmt())
+        self.expect('RBRACE')
+        return jts.StatementBlock(stmts, tok.lineno, self.column(tok))
+
+    # Skips a block and returns the names it calls, an identifier followed by "(" being a call
+    def skip_block(self):
+        last = self.expect('LBRACE')
+        depth = 1
+        names = {}
+        while depth:
+            tok = self.tok
+            if tok is None:
+                self.error()
+            if tok.type == 'LBRACE':
+                depth += 1
+            elif tok.type == 'RBRACE':
+                depth -= 1
+            elif tok.type == 'LPAREN' and last.type == 'IDENT':
+                names[last.value] = None
+            last = tok
+            self.tok = self.next_token()
+        return list(names)
+
+    def stmt(self):
+        kind = self.tok.type
+        if kind == 'IDENT':
+            name = self.tok
+            self.tok = self.next_token()
+            if self.tok is not None and self.tok.type == 'ASSIGN':
+                self.tok = self.next_token()
+                target = jts.ExpressionVar(name.value, name.lineno, self.column(name))
+                expr = self.expr()
+                self.expect('SEMICOLON')
+                return jts.StatementAssign(target, expr, 0, 1)
+            expr = self.expr_from(self.ident(name), 0)
+            self.expect('SEMICOLON')
+            return jts.StatementEval(expr, 0, 1)
+        if kind == 'VAR':
+            return self.vardecl()
+        if kind == 'LBRACE':
+            return self.block()
+        if kind == 'IF':
+            return self.ifelse()
+        if kind == 'WHILE':
+            tok = self.expect('WHILE')
+            self.expect('LPAREN')
+            condition = self.expr()
+            self.expect('RPAREN')
+            return jts.StatementWhile(condition, self.block(), lineno=tok.lineno, col=self.column(tok))
+        if kind == 'CONTINUE' or kind == 'BREAK':
+            tok = self.expect(kind)
+            self.expect('SEMICOLON')
+            return jts.StructuredJump(jump_type=tok.value, lineno=tok.lineno, col=self.column(tok))
+        if kind == 'RETURN':
+            tok = self.expect('RETURN')
+            expr = None
+            if self.tok is None or self.tok.type != 'SEMICOLON':
+                expr = self.expr()
+            self.expect('SEMICOLON')
+            return jts.StatementReturn(expr=expr, lineno=tok.lineno, col=self.column(tok))
+
+        expr = self.expr()
+        self.expect('SEMICOLON')
+        return jts.StatementEval(expr, 0, 1)
+
+    def ifelse(self):
+        tok = self.expect('IF')
+        self.expect('LPAREN')
+        condition = self.expr()
+        self.expect('RPAREN')
+        block = self.block()
+        else_case = None
+        if self.tok is not None and self.tok.type == 'ELSE':
+            self.tok = self.next_token()
+            if self.tok is not None and self.tok.type == 'IF':
+                else_case = self.ifelse()
+            else:
+                else_case = self.block()
+        return jts.StatementIf(condition, block, else_case, lineno=tok.lineno, col=self.column(tok))
+
+    # Expressions
+
+    # Parses an expression whose binary operators are all of level min_level or more
+    def expr(self, min_level=0):
+        return self.expr_from(self.prefix(), min_level)
+
+    # Continues the expression whose first operand is left
+    def expr_from(self, left, min_level):
+        last_level = None
+        while True:
+            tok = self.tok
+            if tok is None:
+                return left
+            level = BINARY.get(tok.type)
+            if level is None or level < min_level:
+                return left
+            if level == last_level and level in NONASSOC:
+                self.error()
+            self.tok = self.next_token()
+            right = self.expr(level + 1)
+            left = jts.ExpressionBinOp(left, BINARY_NAME[tok.value], right, tok.lineno, self.column(tok))
+            last_level = level
+
+    # An operand: a variable, a call, a constant, a parenthesised or a unary expression
+    def prefix(self):
+        tok = self.tok
+        if tok is None:
+            self.error()
+        kind = tok.type
+        if kind == 'IDENT':
+            self.tok = self.next_token()
+            return self.ident(tok)
+        if kind == 'NUMBER':
+            self.tok = self.next_token()
+            return jts.ExpressionInt(tok.value, tok.lineno, self.column(tok))
+        if kind == 'TRUE' or kind == 'FALSE':
+            self.tok = self.next_token()
+            return jts.ExpressionBool(tok.value, tok.lineno, self.column(tok))
+        if kind == 'LPAREN':
+            self.tok = self.next_token()
+            expr = self.expr()
+            self.expect('RPAREN')
+            return expr
+        if kind in UNARY:
+            self.tok = self.next_token()
+            return jts.ExpressionUniOp(UNARY_NAME[tok.value], self.expr(UNARY_LEVEL), tok.lineno, self.column(tok))
+        self.error()
+
+    # A variable or a call, once its identifier tok is consumed
+    def ident(self, tok):
+        if self.tok is None or self.tok.type != 'LPAREN':
+            return jts.ExpressionVar(tok.value, tok.lineno, self.column(tok))
+        self.tok = self.next_token()
+        args = []
+        if self.tok is None or self.tok.type != 'RPAREN':
+            args.append(self.expr())
+            while self.tok is not None and self.tok.type == 'COMMA':
+                self.tok = self.next_token()
+                args.append(self.expr())
+        self.expect('RPAREN')
+        return jts.ExpressionCall(tok.value, args, tok.lineno, self.column(tok))
@@ -1,6 +1,12 @@
 import getopt
+import os
+import re
 import sys
+from sys import intern
+from array import array
+from bisect import bisect_right
 from py.ply import lex as lex
+from context import CompileError
 
 """
 The Lexer class defines the rules for tokenising source code.
@@ -8,19 +14,58 @@ The Lexer class defines the rules for tokenising source code.
 It has,
 Input handling: Methods to feed text to the lexer and retrieve tokens
 Token definitions: Regular expressions that define the language's lexical elements
-Error handling: Logic for handling illegal characters
+Error handling: Illegal characters and out of range numbers raise CompileError
+Positions: the offsets of the line starts are found once per input, columns are looked up by bisection
+Ranges: input(text, start, end) scans only text[start:end], with the line numbers of the whole
+        text, so a declaration can be scanned again on its own (see bxincr.py)
+Identifiers: interned, so the names of the symbol table are compared by identity
 Also has a test functionality 
+
+The FastLexer class is a second backend producing the same tokens and errors without
+PLY: a generator walks the matches of one regular expression over the whole input and
+the token type is found from the index of the matching group, with no call per token.
+make_lexer() picks the backend, 'fast' unless $BX_SCANNER says otherwise, and
+`python scanner.py --compare FILES` checks that both backends give the same tokens.
 """
 
+SCANNERS = ('fast', 'ply')
+
+
+# Offsets of the first character of every line of text[start:end], as an array of 8-byte ints
+def line_starts(text, start=0, end=None):
+    if end is None:
+        end = len(text)
+    starts = array('q', [text.rfind('\n', 0, start) + 1])
+    pos = text.find('\n', start, end)
+    while pos >= 0:
+        starts.append(pos + 1)
+        pos = text.find('\n', pos + 1, end)
+    return starts
+
 
 class Lexer(object):
+    # Lexer built by the first instance, later instances clone it instead of
+    # recompiling the master regular expression
+    _master = None
+
     def __init__(self, filename="", **kwargs):
         self.filename = filename
-        self.lexer = lex.lex(object=self, **kwargs)
+        if kwargs:
+            self.lexer = lex.lex(object=self, **kwargs)
+        else:
+            if Lexer._master is None:
+                Lexer._master = lex.lex(object=self)
+            self.lexer = Lexer._master.clone(self)
 
-    def input(self, text):
+    def input(self, text, start=0, end=None):
         self.code = text
         self.lexer.input(text)
+        self.line_starts = line_starts(text, start, end)
+        self.first_line = text.count('\n', 0, start) + 1
+        self.lexer.lineno = self.first_line
+        self.lexer.lexpos = start
+        if end is not None:
+            self.lexer.lexlen = end
 
     def reset_lineno(self):
         self.lexer.lineno = 1
@@ -29,13 +74,17 @@ class Lexer(object):
         self.last_token = self.lexer.token()
         return self.last_token
 
+    # Line and column (both from 1) of the character at lexpos, found by bisection
+    # in the table of line starts instead of searching back for the last newline
+    def line_col(self, lexpos):
+        line = bisect_right(self.line_starts, lexpos)
+        return self.first_line + line - 1, lexpos - self.line_starts[line - 1] + 1
+
     def find_tok_column(self, token, n=None):
         if n is None:
-            last_cr = self.lexer.lexdata.rfind('\n', 0, token.lexpos)
-            return token.lexpos - last_cr
+            return self.line_col(token.lexpos)[1]
         else:
-            last_cr = self.lexer.lexdata.rfind('\n', 0, token.lexpos(n))
-            return token.lexpos(n) - last_cr
+            return self.line_col(token.lexpos(n))[1]
 
     def test(self, data):
         self.input(data)
@@ -97,6 +146,7 @@ class Lexer(object):
     def t_IDENT(self, t):
         r'[A-Za-z_][A-Za-z0-9_]*'
         t.type = self.keywords.get(t.value, 'IDENT')
+        t.value = intern(t.value)
         return t
 
     def t_NUMBER(self, t):
@@ -104,9 +154,7 @@ class Lexer(object):
         t.value = int(t.value)
 
         if t.value < -(1 << 63) or t.value >= (1 << 63):
-            print(f'File "{self.filename}", line {t.lexer.lineno}')
-            print(f':Error: Wrong integer "{t.value}" - out of accpeted range')
-            sys.exit(1)
+            raise CompileError(f'Wrong integer "{t.value}" - out of accpeted range', self.filename, t.lexer.lineno)
 
         return t
 
@@ -119,6 +167,136 @@ class Lexer(object):
         t.lexer.lineno += 1
 
     def t_error(self, t):
-        print(f'File "{self.filename}", line {t.lexer.lineno}')
-        print(f"Error: Illegal character '{t.value[0]}'")
-        sys.exit(1)
+        raise CompileError(f"Illegal character '{t.value[0]}'", self.filename, t.lexer.lineno)
+
+
+# The operators, longest first as in the master regular expression of PLY
+OPERATORS = {'&&': 'AND', '||': 'OR', '<=': 'jle', '>=': 'jnl', '!=': 'jnz', '==': 'jz',
+             '<<': 'shl', '>>': 'shr', '=': 'ASSIGN', ',': 'COMMA', '{': 'LBRACE', '(': 'LPAREN',
+             '!': 'NOT', '}': 'RBRACE', ')': 'RPAREN', '+': 'add', '&': 'and', '/': 'div',
+             '<': 'jl', '>': 'jnle', '%': 'mod', '*': 'mul', '~': 'not', '|': 'or', '^': 'xor',
+             ':': 'COLON', ';': 'SEMICOLON', '-': 'sub'}
+
+# One alternative per kind of lexeme, in the order of the PLY rules (the ignored
+# characters first, then the rules defined by functions, then the operators).
+# Any other character is matched by the last group and is illegal
+FAST_TOKEN = re.compile(r'([ \t\f\v\r]+)|([A-Za-z_][A-Za-z0-9_]*)|(0|-?[1-9][0-9]*)|(//[^\n]*\n?)|(\n)|(' +
+                        '|'.join(re.escape(op) for op in OPERATORS) + r')|(.)', re.DOTALL)
+BLANK, IDENT, NUMBER, COMMENT, NEWLINE, OPERATOR, ILLEGAL = range(1, 8)
+
+
+class FastLexer(object):
+    keywords = Lexer.keywords
+    tokens = Lexer.tokens
+
+    def __init__(self, filename=""):
+        self.filename = filename
+        self.input('')
+
+    def input(self, text, start=0, end=None):
+        self.code = text
+        self.line_starts = line_starts(text, start, end)
+        self.first_line = self.lineno = text.count('\n', 0, start) + 1
+        self.scanned = self.scan(text, start, len(text) if end is None else end)
+
+    def reset_lineno(self):
+        self.lineno = 1
+
+    line_col = Lexer.line_col
+    find_tok_column = Lexer.find_tok_column
+    test = Lexer.test
+
+    def token(self):
+        return next(self.scanned, None)
+
+    # Generates the tokens of text, errors are raised when the scan reaches them
+    def scan(self, text, start=0, end=None):
+        keywords = self.keywords
+        LexToken = lex.LexToken
+        lineno = self.lineno
+        for m in FAST_TOKEN.finditer(text, start, len(text) if end is None else end):
+            kind = m.lastindex
+            if kind == BLANK:
+                continue
+            if kind == NEWLINE or kind == COMMENT:
+                # A comment counts as one line, even without a newline at the end of the file
+                lineno += 1
+                self.lineno = lineno
+                continue
+
+            tok = LexToken()
+            tok.lineno = lineno
+            tok.lexpos = m.start()
+            value = m.group()
+            if kind == IDENT:
+                tok.type = keywords.get(value, 'IDENT')
+                tok.value = intern(value)
+            elif kind == OPERATOR:
+                tok.type = OPERATORS[value]
+                tok.value = value
+            elif kind == NUMBER:
+                tok.type = 'NUMBER'
+                tok.value = int(value)
+                if tok.value < -(1 << 63) or tok.value >= (1 << 63):
+                    raise CompileError(f'Wrong integer "{tok.value}" - out of accpeted range', self.filename, lineno)
+            else:
+                raise CompileError(f"Illegal character '{value}'", self.filename, lineno)
+            yield tok
+
+
+def make_lexer(filename="", backend=None):
+    backend = backend or os.environ.get('BX_SCANNER') or 'fast'
+    if backend == 'fast':
+        return FastLexer(filename)
+    if backend == 'ply':
+        return Lexer(filename)
+    raise ValueError(f'Unknown scanner {backend!r}, expected one of {", ".join(SCANNERS)}')
+
+
+# The tokens of code as (type, value, lineno, lexpos), ending with the error message if any
+def token_stream(lexer, code):
+    out = []
+    lexer.input(code)
+    try:
+        while True:
+            tok = lexer.token()
+            if not tok:
+                break
+            out.append((tok.type, tok.value, tok.lineno, tok.lexpos))
+    except CompileError as e:
+        out.append(str(e))
+    return out
+
+
+# Checks that both backends give the same tokens on the files, returns the number of differences
+def compare(files):
+    different = 0
+    for file in files:
+        with open(file, 'r') as f:
+            code = f.read()
+        ply_tokens = token_stream(Lexer(file), code)
+        fast_tokens = token_stream(FastLexer(file), code)
+        if ply_tokens == fast_tokens:
+            print(f'same       {file} ({len(ply_tokens)} tokens)')
+            continue
+
+        different += 1
+        i = next((i for i, (a, b) in enumerate(zip(ply_tokens, fast_tokens)) if a != b),
+                 min(len(ply_tokens), len(fast_tokens)))
+        print(f'DIFFERENT  {file} at token {i}')
+        print(f'  ply:  {ply_tokens[i] if i < len(ply_tokens) else "end"}')
+        print(f'  fast: {fast_tokens[i] if i < len(fast_tokens) else "end"}')
+    return different
+
+
+if __name__ == '__main__':
+    opts, args = getopt.getopt(sys.argv[1:], '', ['compare', 'scanner='])
+    opts = dict(opts)
+
+    if '--compare' in opts:
+        sys.exit(1 if compare(args) else 0)
+
+    for file in args:
+        with open(file, 'r') as f:
+            for tok in token_stream(make_lexer(file, opts.get('--scanner')), f.read()):
+                print(tok)
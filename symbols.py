@@ -0,0 +1,79 @@
+"""
+.
+The SymbolTable class resolves the names of a program to dense integer symbol IDs.
+
+Declarations: every global variable, procedure, argument and local variable gets the
+              next free ID, its name, type and line number are kept in lists indexed by it
+Scopes: one dict (name -> ID) per open scope, for the redeclaration checks
+Bindings: for each name, the stack of the IDs it refers to in the open scopes, so a
+          lookup is one dict access whatever the depth of the scopes
+Homes: where the lowering keeps each symbol (@global, %argument or a temporary),
+       filled by bx2tac and read with homes[symbol]
+
+The type checker resolves each ExpressionVar once and stores its ID in node.symbol,
+the TAC lowering then never looks a name up again.
+"""
+
+
+class SymbolTable:
+    def __init__(self):
+        self.names = []
+        self.types = []
+        self.linenos = []
+        self.params = []
+        self.homes = []
+        self.scopes = [dict()]
+        self.bindings = {}
+
+    # Declares name in the innermost scope and returns its ID.
+    # params is the list of the argument types for a procedure, None for a variable
+    def declare(self, name, type, lineno, params=None):
+        symbol = len(self.names)
+        self.names.append(name)
+        self.types.append(type)
+        self.linenos.append(lineno)
+        self.params.append(params)
+        self.homes.append(None)
+
+        self.scopes[-1][name] = symbol
+        stack = self.bindings.get(name)
+        if stack is None:
+            self.bindings[name] = [symbol]
+        else:
+            stack.append(symbol)
+        return symbol
+
+    # ID of the declaration of name visible from the innermost scope, None if undeclared
+    def lookup(self, name):
+        stack = self.bindings.get(name)
+        if stack:
+            return stack[-1]
+        return None
+
+    # ID of name if it is declared in the innermost scope
+    def local(self, name):
+        return self.scopes[-1].get(name)
+
+    # ID of name if it is declared in the global scope
+    def glob(self, name):
+        return self.scopes[0].get(name)
+
+    # Drops the symbols after the first size ones, such as the locals of a procedure
+    # once it is compiled in the streaming mode. Their scopes must be closed
+    def forget(self, size):
+        del self.names[size:]
+        del self.types[size:]
+        del self.linenos[size:]
+        del self.params[size:]
+        del self.homes[size:]
+
+    def push(self):
+        self.scopes.append(dict())
+
+    def pop(self):
+        bindings = self.bindings
+        for name in self.scopes.pop():
+            bindings[name].pop()
+
+    def __repr__(self):
+        return repr([{name: (self.types[s], self.linenos[s]) for name, s in scope.items()} for scope in self.scopes])
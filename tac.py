@@ -0,0 +1,179 @@
+import sys
+
+"""
+.
+The TAC intermediate representation shared by the lowering (bx2tac), the CFG optimiser
+(tac_cfopt), the assembly generator (tac2x64) and the interpreter (tacrun).
+
+Instr: one instruction, with __slots__ (opcode, arg1, arg2, arg3, dest) instead of a dict
+       and an argument list. The opcodes are string constants of the code, or interned when read
+       from JSON
+Operands: the temporaries (%N) and labels (%.LN) made by the lowering come from shared
+          tables (temp(), label()), as the procedures all number them from 0: an operand
+          is a reference to one string per number, not a string per use. The ints are
+          immediate values: those of const, the param positions and call argument
+          counts, and the operands of the operations, comparisons and params
+Proc, Gvar: a procedure (name, argument temporaries, body) and a global variable
+
+The JSON form ({"opcode", "args", "result"}, {"proc", "args", "body"}, {"var", "init"})
+is only used at the edges: the --dump-* files, the .tac.json inputs of the scripts.
+"""
+
+_intern = sys.intern
+
+
+class Instr:
+    __slots__ = ('opcode', 'arg1', 'arg2', 'arg3', 'dest')
+
+    # arg3 is only used by the conditional jumps comparing two operands: jl a, b, L
+    def __init__(self, opcode, arg1=None, arg2=None, dest=None, arg3=None):
+        self.opcode = opcode
+        self.arg1 = arg1
+        self.arg2 = arg2
+        self.arg3 = arg3
+        self.dest = dest
+
+    # Pickled as its fields, for the worker processes (see bxparallel.py)
+    def __reduce__(self):
+        return Instr, (self.opcode, self.arg1, self.arg2, self.dest, self.arg3)
+
+    @property
+    def args(self):
+        if self.arg1 is None:
+            return ()
+        if self.arg2 is None:
+            return (self.arg1,)
+        if self.arg3 is None:
+            return (self.arg1, self.arg2)
+        return (self.arg1, self.arg2, self.arg3)
+
+    # The label of a conditional jump, its last argument: jz a, L or jz a, b, L
+    @property
+    def target(self):
+        return self.arg2 if self.arg3 is None else self.arg3
+
+    @target.setter
+    def target(self, label):
+        if self.arg3 is None:
+            self.arg2 = label
+        else:
+            self.arg3 = label
+
+    @property
+    def result(self):
+        return self.dest
+
+    def to_tac(self):
+        return {"opcode": self.opcode, "args": list(self.args), "result": self.dest}
+
+    @staticmethod
+    def from_tac(js_obj):
+        args = js_obj.get('args', ())
+        return Instr(_intern(js_obj['opcode']), *args[:2], dest=js_obj.get('result'), arg3=args[2] if len(args) > 2 else None)
+
+    def __repr__(self):
+        return f'Instr.from_tac({self.to_tac()})'
+
+    # The text form of tacrun: "  %2 = add %0, %1;" or "%.L0:"
+    def __str__(self):
+        if self.opcode == 'label':
+            return f'{self.arg1}:'
+        out = '  '
+        if self.dest is not None:
+            out += f'{self.dest} = '
+        out += self.opcode
+        if self.arg1 is not None:
+            out += f' {self.arg1}'
+            if self.arg2 is not None:
+                out += f', {self.arg2}'
+                if self.arg3 is not None:
+                    out += f', {self.arg3}'
+        return out + ';'
+
+
+class Proc:
+    __slots__ = ('name', 'args', 'body')
+
+    def __init__(self, name, args, body=None):
+        self.name = name
+        self.args = args
+        self.body = [] if body is None else body
+
+    def to_tac(self):
+        return {"proc": self.name, "args": list(self.args), "body": [i.to_tac() for i in self.body]}
+
+    @staticmethod
+    def from_tac(js_obj):
+        return Proc(js_obj['proc'], list(js_obj.get('args', ())), [Instr.from_tac(i) for i in js_obj.get('body', ())])
+
+    def __repr__(self):
+        return f'Proc.from_tac({self.to_tac()})'
+
+    def __str__(self):
+        lines = [f'proc {self.name}({", ".join(self.args)}):']
+        lines.extend(str(instr) for instr in self.body)
+        return '\n'.join(lines) + '\n'
+
+
+class Gvar:
+    __slots__ = ('name', 'init')
+
+    def __init__(self, name, init):
+        self.name = name
+        self.init = init
+
+    def to_tac(self):
+        return {"var": self.name, "init": self.init}
+
+    @staticmethod
+    def from_tac(js_obj):
+        return Gvar(js_obj['var'], js_obj.get('init', 0))
+
+    def __repr__(self):
+        return f'Gvar.from_tac({self.to_tac()})'
+
+    def __str__(self):
+        return f'var {self.name} = {self.init};\n'
+
+
+_temps = []
+_labels = []
+
+
+# The temporary %n, the same string for every procedure
+def temp(n):
+    while len(_temps) <= n:
+        _temps.append(_intern('%' + str(len(_temps))))
+    return _temps[n]
+
+
+# The label %.Ln, the same string for every procedure
+def label(n):
+    while len(_labels) <= n:
+        _labels.append(_intern('%.L' + str(len(_labels))))
+    return _labels[n]
+
+
+# The Gvar or Proc of a top-level JSON object, None if it is neither
+def from_tac(js_obj):
+    if 'proc' in js_obj:
+        return Proc.from_tac(js_obj)
+    if 'var' in js_obj:
+        return Gvar.from_tac(js_obj)
+    return None
+
+
+# The global variables and the procedures of a JSON TAC program
+def load_tac(js_obj):
+    gvars, procs = [], []
+    for obj in js_obj:
+        decl = from_tac(obj)
+        if isinstance(decl, Proc):
+            procs.append(decl)
+        elif decl is not None:
+            gvars.append(decl)
+    return gvars, procs
+
+
+def dump_tac(decls):
+    return [decl.to_tac() for decl in decls]
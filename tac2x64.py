@@ -1,7 +1,8 @@
 import sys
 import getopt
 import json
-from json_to_stat import ProcDec, StatementVarDecl
+from tac import load_tac
+from timing import NO_STATS
 
 """
 .
@@ -10,22 +11,6 @@ This completes the compilation pipeline: BX source → AST → TAC → x64 Assem
 """
 
 
-class Instr:
-    def __init__(self, opcode, arg1, arg2, dest):
-        self.opcode = opcode
-        self.arg1 = arg1
-        self.arg2 = arg2
-        self.dest = dest
-
-    def __str__(self):
-        return (f"opcode : {self.opcode}, arg1 : {self.arg1}, arg2 : {self.arg2}, dest : {self.dest}")
-
-    def to_tac(self):
-        if self.arg2 == None:
-            return {"opcode": self.opcode, "args": [self.arg1], "result": self.dest}
-        return {"opcode": self.opcode, "args": [self.arg1, self.arg2], "result": self.dest}
-
-
 class Create_x64:
     def __init__(self, global_var, name, args):
         self.stack = {}
@@ -42,6 +27,7 @@ class Create_x64:
         self.div = {'div': '%rax', 'mod': '%rdx'}
         self.condition = ['je', 'jz', 'jne', 'jnz', 'jl',
                           'jnge', 'jle', 'jng', 'jg', 'jnle', 'jge', 'jnl']
+        self.setcc = {'setz', 'setnz', 'setl', 'setle', 'setnl', 'setnle'}
 
         for i in range(min(len(self.args), 6)):
             self.strs.append('\tmovq {}, {}'.format(self.tmp_var_regester[i + 1], self.get_pos(args[i])))
@@ -60,6 +46,23 @@ class Create_x64:
             self.stack[var] = self.stack_pos
             return "{}(%rbp)".format(-8 * self.stack_pos)
 
+    # The assembly operand of a TAC operand: an immediate if it fits in the 32 bits an
+    # instruction sign extends, else it goes through %r11. A temporary is at get_pos()
+    def operand(self, arg):
+        if isinstance(arg, int):
+            if -(1 << 31) <= arg < (1 << 31):
+                return "${}".format(arg)
+            self.strs.append("\tmovabsq ${}, %r11".format(arg))
+            return "%r11"
+        return self.get_pos(arg)
+
+    # Loads a TAC operand in the register reg
+    def load(self, arg, reg):
+        if isinstance(arg, int) and not -(1 << 31) <= arg < (1 << 31):
+            self.strs.append("\tmovabsq ${}, {}".format(arg, reg))
+        else:
+            self.strs.append("\tmovq {}, {}".format(self.operand(arg), reg))
+
     # Converts each TAC instruction to assembly instructions
     def to_str(self, tac_expr):
         op = tac_expr.opcode
@@ -72,7 +75,7 @@ class Create_x64:
             self.strs.append("\tmovq %r10, {}".format(self.get_pos(dest)))
 
         elif (op == 'copy'):
-            self.strs.append("\tmovq {}, %r10".format(self.get_pos(arg1)))
+            self.load(arg1, '%r10')
             self.strs.append("\tmovq %r10, {}".format(self.get_pos(dest)))
 
         elif op == 'label':
@@ -82,37 +85,56 @@ class Create_x64:
             self.strs.append("\tjmp .main{}".format(arg1[1:]))
 
         elif op in self.binop.keys():
-            self.strs.append("\tmovq {}, %r10".format(self.get_pos(arg1)))
-            self.strs.append("\t{} {}, %r10".format(self.binop[op], self.get_pos(arg2)))
+            self.load(arg1, '%r10')
+            self.strs.append("\t{} {}, %r10".format(self.binop[op], self.operand(arg2)))
             self.strs.append("\tmovq %r10, {}".format(self.get_pos(dest)))
 
         elif op in self.unop.keys():
-            self.strs.append("\tmovq {}, %r10".format(self.get_pos(arg1)))
+            self.load(arg1, '%r10')
             self.strs.append("\t{} %r10".format(self.unop[op]))
             self.strs.append("\tmovq %r10, {}".format(self.get_pos(dest)))
 
         elif op in self.shiftop.keys():
-            self.strs.append("\tmovq {}, %r10".format(self.get_pos(arg1)))
-            self.strs.append("\tmovq {}, %rcx".format(self.get_pos(arg2)))
-            self.strs.append("\t{} %cl, %r10".format(self.shiftop[op]))
+            self.load(arg1, '%r10')
+            if isinstance(arg2, int):
+                # The count is taken modulo 64, as the one in %cl
+                self.strs.append("\t{} ${}, %r10".format(self.shiftop[op], arg2 & 63))
+            else:
+                self.strs.append("\tmovq {}, %rcx".format(self.get_pos(arg2)))
+                self.strs.append("\t{} %cl, %r10".format(self.shiftop[op]))
             self.strs.append("\tmovq %r10, {}".format(self.get_pos(dest)))
 
         elif op in self.div.keys():
-            self.strs.append("\tmovq {}, %rax".format(self.get_pos(arg1)))
+            self.load(arg1, '%rax')
             self.strs.append("\tcqto")
-            self.strs.append("\tidivq {}".format(self.get_pos(arg2)))
+            if isinstance(arg2, int):
+                # idivq has no immediate form
+                self.load(arg2, '%r11')
+                self.strs.append("\tidivq %r11")
+            else:
+                self.strs.append("\tidivq {}".format(self.get_pos(arg2)))
             self.strs.append("\tmovq {}, {}".format(self.div[op], self.get_pos(dest)))
 
         elif op in self.condition:
-            self.strs.append("\tmovq {}, %r10".format(self.get_pos(arg1)))
-            self.strs.append("\tcmpq $0, %r10")
-            self.strs.append("\t{} {}".format(op, arg2[1:]))
+            self.load(arg1, '%r10')
+            if tac_expr.arg3 is None:
+                self.strs.append("\tcmpq $0, %r10")
+            else:
+                self.strs.append("\tcmpq {}, %r10".format(self.operand(arg2)))
+            self.strs.append("\t{} .main{}".format(op, tac_expr.target[1:]))
+
+        elif op in self.setcc:
+            self.load(arg1, '%r10')
+            self.strs.append("\tcmpq {}, %r10".format(self.operand(arg2)))
+            self.strs.append("\t{} %r10b".format(op))
+            self.strs.append("\tmovzbq %r10b, %r10")
+            self.strs.append("\tmovq %r10, {}".format(self.get_pos(dest)))
 
         elif op == 'param':
             if arg1 <= 6:
-                self.strs.append("\tmovq {}, {}".format(self.get_pos(arg2), self.tmp_var_regester[arg1]))
+                self.load(arg2, self.tmp_var_regester[arg1])
             else:
-                self.strs.append("\tpushq {}".format(self.get_pos(arg2)))
+                self.strs.append("\tpushq {}".format(self.operand(arg2)))
         
         elif op == 'call':
             self.strs.append("\tcallq {}".format(arg1[1:]))
@@ -124,12 +146,11 @@ class Create_x64:
                 self.strs.append("\txorq %rax, %rax")
                 self.strs.append("\tjmp .Lend_{}".format(self.name[1:]))
             else:
-                self.strs.append("\tmovq {}, %rax".format(self.get_pos(arg1)))
+                self.load(arg1, '%rax')
                 self.strs.append("\tjmp .Lend_{}".format(self.name[1:]))
         
         else:
-            print("Unknown Opcode")
-            sys.exit(1)
+            raise RuntimeError(f'Unknown opcode {op}')
 
     def main(self, tac_file):
         for line in tac_file:
@@ -141,54 +162,78 @@ class Create_x64:
             tail = [f'.Lend_{self.name[1:]}:', '\tmovq %rbp, %rsp ', '\tpopq %rbp ', '\tretq', '']
         return head + self.strs + tail
 
-# Parses the JSON TAC representation
-def load_tac(js_obj):    
-    var = []
-    proc = []
-    for obj in js_obj:
-        if "proc" in obj.keys():
-            tac = []
-            for line in obj["body"]:
-                arg1, arg2 = None, None
-                args = line["args"]
-                if len(args) == 1:
-                    arg1 = args[0]
-                    if (isinstance(arg1, str)) and (arg1[:3] == '%.L'):
-                        arg1 = arg1 + "_" + obj["proc"][1:]
-                elif len(args) == 2:
-                    arg1 = args[0]
-                    arg2 = args[1]
-                    if (isinstance(arg1, str)) and (arg1[:3] == '%.L'):
-                        arg1 = arg1 + "_" + obj["proc"][1:]
-                    if (isinstance(arg2, str)) and (arg2[:3] == '%.L'):
-                        arg2 = arg2 + "_" + obj["proc"][1:]
-                tac.append(Instr(line["opcode"], arg1, arg2, line["result"]))
-            proc.append(ProcDec(obj["proc"], obj["args"], None, tac, None, None))
-        elif "var" in obj:
-            var.append(StatementVarDecl(obj["var"], obj["init"], None, None, None))
-    return var, proc
+# Suffixes the local labels of a procedure with its name so they are unique in the assembly file
+def localize_labels(proc):
+    for instr in proc.body:
+        if (isinstance(instr.arg1, str)) and (instr.arg1[:3] == '%.L'):
+            instr.arg1 = instr.arg1 + "_" + proc.name[1:]
+        if (isinstance(instr.arg2, str)) and (instr.arg2[:3] == '%.L'):
+            instr.arg2 = instr.arg2 + "_" + proc.name[1:]
+        if (isinstance(instr.arg3, str)) and (instr.arg3[:3] == '%.L'):
+            instr.arg3 = instr.arg3 + "_" + proc.name[1:]
 
 """
-The tac2x64 function:
-Loads TAC from JSON
+The emit_x64 function:
+Takes the global variables and procedures (Gvar and Proc objects, see tac.py) directly
 Outputs global variable definitions
 Generates assembly for each procedure
 Returns the complete assembly as a list of strings
+
+gen_x64 yields the same lines one at a time, only one procedure is held in memory
+at once, and write_x64 streams them to an open file as each procedure is generated
+
+The tac2x64 function does the same starting from a TAC JSON file
 """
 def tac2x64(file_name):
     with open(file_name, 'r') as fp:
         js_obj = json.load(fp)
         var, proc = load_tac(js_obj)
 
-    out = []
-    global_var = []
+    return emit_x64(var, proc)
+
+
+def emit_x64(var, proc, stats=NO_STATS):
+    with stats.phase('emit'):
+        out = list(gen_x64(var, proc))
+    stats.size('assembly lines', len(out))
+    return out
+
+
+# Writes the assembly to f, returns the number of lines written
+def write_x64(var, proc, f, stats=NO_STATS):
+    count = 0
+    with stats.phase('emit'):
+        for v in var:
+            f.write(f'\t.globl {v.name[1:]}\n\t.data\n{v.name[1:]}:  .quad {v.init}\n\n')
+            count += 4
+        global_var = {v.name for v in var}
+        for p in proc:
+            count += write_proc_x64(global_var, p, f)
+    stats.size('assembly lines', count)
+    return count
+
+
+# Writes the assembly of one procedure to f, returns the number of lines written
+def write_proc_x64(global_var, p, f):
+    lines = proc_x64(global_var, p)
+    f.write('\n'.join(lines))
+    f.write('\n')
+    return len(lines)
+
+
+def gen_x64(var, proc):
     for v in var:
-        global_var.append(v.name)
-        out = out + [f'\t.globl {v.name[1:]}', '\t.data', f'{v.name[1:]}:  .quad {v.initial}', '']
+        yield f'\t.globl {v.name[1:]}'
+        yield '\t.data'
+        yield f'{v.name[1:]}:  .quad {v.init}'
+        yield ''
 
+    global_var = {v.name for v in var}
     for p in proc:
-        now = Create_x64(global_var, p.name, p.args)
-        now_x86 = now.main(p.body)
-        out += now_x86
+        yield from proc_x64(global_var, p)
 
-    return out
+
+# Assembly lines of one procedure
+def proc_x64(global_var, p):
+    localize_labels(p)
+    return Create_x64(global_var, p.name, p.args).main(p.body)
@@ -1,334 +1,301 @@
 import sys
 import getopt
 import json
-from json_to_stat import ProcDec, StatementVarDecl
-from tac2x64 import Instr
-
-
-class Instructions:
-    def __init__(self, instruction):
-        self.instruction = instruction
-        self.id = id(instruction)
-        self.child = []
-
-    def check(self, tmp):
-        return (tmp != None) and (isinstance(tmp, str)) and (tmp[0] == '%')
-
-    def __str__(self):
-        return f'opcode : {self.instruction.opcode}, arg : {[self.instruction.arg1, self.instruction.arg2]}, dest : {self.instruction.dest}'
+from tac import Instr, Proc, Gvar, load_tac, dump_tac
+from timing import NO_STATS
+from trampoline import trampoline
+
+"""
+.
+The ControlFlowGraph class optimises the TAC of one procedure on its graph of basic blocks.
+
+Blocks: a list indexed by dense block ids, in the order of the instructions, with index
+        mapping each label to the id of its block. The entry block is blocks[0], a removed
+        block is left as None so the ids do not move
+Edges: succ is the list of the ids a block jumps to, one per jump in the order of its
+       instructions, pred counts the jumps to a block per id of the block they are in.
+       add_edge, remove_edge, retarget and merge keep both sides up to date, so a pass
+       edits the graph where it changes instead of building it again
+Passes: jump threading, then dead code elimination (the code is laid out again without
+        the labels no jump refers to, and the blocks that cannot be reached from the
+        entry are removed), then merging the blocks into their single predecessor.
+        Each pass visits every block and instruction a bounded number of times, the
+        whole optimisation is linear in the size of the procedure
+
+The blocks are laid out by a depth first walk from the entry that follows the final
+jmp of a block first, so that it can be dropped.
+"""
+
+CJMP = frozenset(('jz', 'jnz', 'jl', 'jle', 'jnl', 'jnle'))
 
 
 class BasicBlock:
-    def __init__(self, instructions):
-        self.label = instructions[0].instruction.arg1
-        self.instructions = instructions
-        self.child = []
-        self.father = []
-
-    def add_father(self, father):
-        self.father.append(father)
+    __slots__ = ('id', 'label', 'instructions', 'succ', 'pred')
 
-    def add_child(self, child):
-        self.child.append(child)
+    def __init__(self, id, instructions):
+        self.id = id
+        self.label = instructions[0].arg1
+        self.instructions = instructions
+        self.succ = []
+        self.pred = {}
 
-    def union(self, tmp):
-        self.instructions += tmp.instructions
-        for child_lbl in tmp.child:
-            self.child.append(child_lbl)
+    # True if the only jump to the block is one jump of father
+    def only_father(self, father):
+        return len(self.pred) == 1 and self.pred.get(father.id) == 1
 
 
 class ControlFlowGraph:
     def __init__(self, tac_file, proc_name):
-        self.visited_str = []
-        self.cjmp = {'jz', 'jnz', 'jl', 'jle', 'jnl', 'jnle'}
         self.name = proc_name[1:]
         self.build(tac_file)
-        
 
+    # The blocks of the instructions tac_file (left unchanged): a label starts a block, and
+    # a jmp or a ret ends one, so a jmp is put before a label reached by falling through
+    # (marked 'tmp' after a ret, it is only there to keep the blocks in order) and a
+    # label after a jmp followed by unreachable code
     def build(self, tac_file):
-        self.block = {}
-        self.instrcutions = {}
-        self.tac_id = []
-
-        if (tac_file[0].opcode != 'label'):
-            tmp = ".Lentry_" + self.name
-            tac_file.insert(0, Instr('label', tmp, None, None))
-            self.entry_label = tmp
-        else:
-            self.entry_label = tac_file[0].arg1
-
-        i, count = 0, 0
-        while (i < len(tac_file)):
-            if (tac_file[i].opcode == 'jmp') and (i < len(tac_file) - 1) and (tac_file[i + 1].opcode != 'label'):
-                tmp = Instr('label', f'.Ljmp_{self.name}_{count}', None, None)
-                count += 1
-                tac_file.insert(i + 1, tmp)
-
-            elif (i >= 1) and (tac_file[i].opcode == 'label') and (tac_file[i - 1].opcode != 'jmp'):
-                if (tac_file[i - 1].opcode == 'ret'):
-                    tac_file.insert(i, Instr('jmp', tac_file[i].arg1, None, 'tmp'))
-                else:
-                    tac_file.insert(i, Instr('jmp', tac_file[i].arg1, None, None))
-
-            tmp = Instructions(tac_file[i])
-            self.instrcutions[tmp.id] = tmp
-            self.tac_id.append(tmp.id)
-            i += 1
-
-        self.block[tac_file[0].arg1] = BasicBlock([self.instrcutions[self.tac_id[0]]])
-        prev = tac_file[0].arg1
-
-        edge = []
-
-        for i in range(1, len(tac_file)):
-            now = tac_file[i]
-            if now.opcode == 'label':
-                self.block[now.arg1] = BasicBlock([self.instrcutions[self.tac_id[i]]])
-                prev = now.arg1
+        tac = []
+        if tac_file[0].opcode != 'label':
+            tac.append(Instr('label', '.Lentry_' + self.name))
+        count = 0
+        for instr in tac_file:
+            if tac:
+                last = tac[-1].opcode
+                if instr.opcode == 'label':
+                    if last != 'jmp':
+                        tac.append(Instr('jmp', instr.arg1, None, 'tmp' if last == 'ret' else None))
+                elif last == 'jmp':
+                    tac.append(Instr('label', f'.Ljmp_{self.name}_{count}'))
+                    count += 1
+            tac.append(instr)
+
+        self.blocks = []
+        self.index = {}
+        for instr in tac:
+            if instr.opcode == 'label':
+                block = BasicBlock(len(self.blocks), [instr])
+                self.blocks.append(block)
+                self.index[instr.arg1] = block.id
             else:
-                self.block[prev].instructions.append(self.instrcutions[self.tac_id[i]])
-
-            if now.opcode in self.cjmp:
-                edge.append((prev, now.arg2))
-            if now.opcode == 'jmp':
-                edge.append((prev, now.arg1))
-
-        for i in range(1, len(tac_file)):
-            if tac_file[i].opcode == 'label':
-                continue
-
-            if tac_file[i].opcode in self.cjmp:
-                if len(self.block[tac_file[i].arg2].instructions) > 1:
-                    self.instrcutions[self.tac_id[i]].child.append(self.block[tac_file[i].arg2].instructions[1].id)
-            if tac_file[i].opcode == 'jmp':
-                if len(self.block[tac_file[i].arg1].instructions) > 1:
-                    self.instrcutions[self.tac_id[i]].child.append(self.block[tac_file[i].arg1].instructions[1].id)
-                continue
-
-            if (i < len(tac_file) - 1):
-                if (self.instrcutions[self.tac_id[i + 1]].instruction.opcode != 'label'):
-                    self.instrcutions[self.tac_id[i]].child.append(self.tac_id[i + 1])
-
-        for (father, child) in edge:
-            self.block[father].add_child(child)
-            self.block[child].add_father(father)
-
-    def rec_linear2(self, now, visted):
-        if (len(now.child) == 1):
-            child_lbl = list(now.child)[0]
-            block = self.block[child_lbl]
-            if (len(block.father) == 1):
-                visted += [child_lbl]
-                return self.rec_linear2(block, visted)
-        return visted
-    
+                block.instructions.append(instr)
+        self.entry = self.blocks[0]
+
+        for block in self.blocks:
+            for instr in block.instructions:
+                if instr.opcode in CJMP:
+                    self.add_edge(block, self.block(instr.target))
+                elif instr.opcode == 'jmp':
+                    self.add_edge(block, self.block(instr.arg1))
+
+    # The block starting with label
+    def block(self, label):
+        return self.blocks[self.index[label]]
+
+    def add_edge(self, father, child):
+        father.succ.append(child.id)
+        child.pred[father.id] = child.pred.get(father.id, 0) + 1
+
+    def remove_edge(self, father, child):
+        father.succ.remove(child.id)
+        count = child.pred[father.id] - 1
+        if count:
+            child.pred[father.id] = count
+        else:
+            del child.pred[father.id]
+
+    # Makes the jmp instr of block go to label instead
+    def retarget(self, block, instr, label):
+        self.remove_edge(block, self.block(instr.arg1))
+        instr.arg1 = label
+        self.add_edge(block, self.block(label))
+
+    # What a conditional jump tests: its opcode and the operands it compares
+    @staticmethod
+    def condition(instr):
+        if instr.arg3 is None:
+            return (instr.opcode, instr.arg1)
+        return (instr.opcode, instr.arg1, instr.arg2)
+
+    # A conditional jump to a block with a single predecessor that tests the same condition
+    # again, on operands the block does not change, always jumps: it is dropped and the jmp
+    # after it goes to its label instead
     def jump_thread(self):
-        noNeedBlock = set()
-
-        for label, block in self.block.items():
-            linl = self.rec_linear2(block, [label])[:-1]
-
-            if len(linl) > 1:
-                f = True
-
-                for i in range(1, len(linl) - 1):
-                    if len(linl[i]) > 2:
-                        f = False
-                        break
-                if f:
-                    head = self.block[linl[0]]
-                    head.instructions[-1].instruction.arg1 = linl[-1]
-                    for i in linl[1:-1]:
-                        head.union(self.block[i])
-                        noNeedBlock.add(i)
-
-            for child_lbl in block.child:
-                con_variable, con_jmp_used = None, None  
-                for instr in block.instructions:
-                    if (instr.instruction.arg2 == child_lbl) and (instr.instruction.opcode in self.cjmp):
-                        con_variable = instr.instruction.arg1
-                        con_jmp_used = instr.instruction.opcode
-
-                if not con_variable:
+        for block in self.blocks:
+            conditions = {}
+            for instr in block.instructions:
+                if instr.opcode in CJMP:
+                    conditions[instr.target] = self.condition(instr)
+
+            for child_id in block.succ:
+                child = self.blocks[child_id]
+                condition = conditions.get(child.label)
+                if not condition or (child is block) or not child.only_father(block):
                     continue
 
-                f = False
-                child = self.block[child_lbl]
-                for instr in child.instructions:
-                    if instr.instruction.dest == con_variable:
-                        f = True
-                        break
-                if f:
+                # The operands must keep their value in the child, a call may assign a global
+                operands = condition[1:]
+                has_global = any(isinstance(v, str) and v[0] == '@' for v in operands)
+                if any((instr.dest in operands) or (has_global and instr.opcode == 'call')
+                       for instr in child.instructions):
                     continue
 
-                f = False
                 for i in range(len(child.instructions) - 1):
-                    now = child.instructions[i].instruction
-                    if len(child.father) != 1:
-                        break
-                    if (now.opcode == con_jmp_used) and (now.arg1 == con_variable):
-                        next_label = now.arg2
-                        child.instructions[i].instruction.opcode = 'nop'
-                        if child.instructions[i + 1].instruction.opcode == 'jmp':
-                            child.instructions[i + 1].instruction.arg1 = next_label
-                        f = True
-
-        for i in noNeedBlock:
-            self.block.pop(i, None)
-            self.remove(i)
-
-
-    def rec_linear1(self, now, visited_lbl):
-        if (now.instructions[-1].instruction.opcode == 'jmp'):
-            if (now.instructions[-1].instruction.arg1 not in visited_lbl):
-                child = self.block[now.instructions[-1].instruction.arg1]
-                visited_lbl.add(now.instructions[-1].instruction.arg1)
-
-                if (child.instructions[-1].instruction.opcode != 'jmp') and (child.instructions[-1].instruction.opcode != 'ret'):
-                    child.instructions += [Instructions(Instr('ret', None, None, None))]
-                self.visited_str.extend(child.instructions)
-                self.rec_linear1(child, visited_lbl)
-
-        for child_lbl in now.child:
-            if child_lbl in visited_lbl:
-                continue
-            child = self.block[child_lbl]
-            visited_lbl.add(child_lbl)
-
-            if (child.instructions[-1].instruction.opcode != 'jmp') and (child.instructions[-1].instruction.opcode != 'ret'):
-                child.instructions += [Instructions(Instr('ret', None, None, None))]
-            self.visited_str.extend(child.instructions)
-            self.rec_linear1(child, visited_lbl)
-
-
-    
+                    now = child.instructions[i]
+                    if (now.opcode in CJMP) and (self.condition(now) == condition):
+                        now.opcode = 'nop'
+                        self.remove_edge(child, self.block(now.target))
+                        if child.instructions[i + 1].opcode == 'jmp':
+                            self.retarget(child, child.instructions[i + 1], now.target)
+
+    # Depth first walk laying out the blocks reachable from now, a generator run by
+    # trampoline() so that deeply nested control flow does not hit the recursion limit
+    def rec_linear1(self, now, visited, layout):
+        last = now.instructions[-1]
+        if last.opcode == 'jmp':
+            child = self.block(last.arg1)
+            if not visited[child.id]:
+                yield self.visit(child, visited, layout)
+
+        for child_id in now.succ:
+            if not visited[child_id]:
+                yield self.visit(self.blocks[child_id], visited, layout)
+
+    # Lays out block, with a ret added if the code falls off its end
+    def visit(self, block, visited, layout):
+        visited[block.id] = True
+        if block.instructions[-1].opcode not in ('jmp', 'ret'):
+            block.instructions.append(Instr('ret'))
+        layout.extend(block.instructions)
+        return self.rec_linear1(block, visited, layout)
+
+    # The instructions of the blocks reachable from the entry, without the jmps marked
+    # 'tmp' and the labels no jump refers to. If flag, also without the jmps to the next
+    # instruction and the ret after a ret
     def cleaned(self, flag=True):
-        entry = self.block[self.entry_label]
-        self.visited_str = list(entry.instructions)
-        self.rec_linear1(entry, set([self.entry_label]))
-
-        for str in self.visited_str:
-            f = True
-            if (str.instruction.opcode == 'jmp') and (str.instruction.dest == 'tmp'):
-                str.instruction.opcode = 'nop'
-                continue
-            if str.instruction.opcode != 'label':
-                continue
-            for i in self.visited_str:
-                if ((i.instruction.opcode in self.cjmp) and (str.instruction.arg1 == i.instruction.arg2)) or \
-                    ((i.instruction.opcode == 'jmp') and (str.instruction.arg1 == i.instruction.arg1)):
-                    f = False
-                    break
-            if f:
-                str.instruction.opcode = 'nop'
+        visited = [False] * len(self.blocks)
+        visited[self.entry.id] = True
+        layout = list(self.entry.instructions)
+        trampoline(self.rec_linear1(self.entry, visited, layout))
+
+        used = set()
+        for instr in layout:
+            if instr.opcode in CJMP:
+                used.add(instr.target)
+            elif (instr.opcode == 'jmp') and (instr.dest != 'tmp'):
+                used.add(instr.arg1)
+
+        for instr in layout:
+            if (instr.opcode == 'jmp') and (instr.dest == 'tmp'):
+                instr.opcode = 'nop'
+            elif (instr.opcode == 'label') and (instr.arg1 not in used):
+                instr.opcode = 'nop'
 
         if flag:
+            last = len(layout) - 1
             tac = []
-            count = 0
-            for i in self.visited_str:
-                tac.append(i.instruction)
-            
-            for i in range(len(tac) - 1):
-                j = i - count
-                if (tac[j].opcode == 'jmp') and (tac[j + 1].opcode == 'label') and (tac[j + 1].arg1 == tac[j].arg1):
-                    tac.pop(j)
-                    count += 1
-            
-            count = 0
-            for i in range(len(tac) - 1):
-                j = i - count
-                now = tac[j]
-                if now.opcode == 'ret':
-                    if now.arg1 == None:
-                        if (tac[j + 1].opcode == 'ret'):
-                            tac.pop(j)
-                            count += 1
-                    else:
-                        if (tac[j + 1].opcode == 'ret'):
-                            tac.pop(j + 1)
-                            count += 1
+            for i, instr in enumerate(layout):
+                if (instr.opcode == 'jmp') and (i < last) and (layout[i + 1].opcode == 'label') and \
+                        (layout[i + 1].arg1 == instr.arg1):
+                    continue
+                if (instr.opcode == 'ret') and tac and (tac[-1].opcode == 'ret'):
+                    if tac[-1].arg1 is None:
+                        tac[-1] = instr
+                    continue
+                tac.append(instr)
         else:
-            tac = [i.instruction for i in self.visited_str]
+            tac = layout
 
-        return list(filter(lambda instr: instr.opcode != 'nop', tac))
+        return [instr for instr in tac if instr.opcode != 'nop']
 
+    # The blocks of the code laid out, without the labels no jump refers to (a block
+    # only reached by falling through is joined to the previous one), and the blocks
+    # that cannot be reached
     def clean_dead_code(self):
-        ns = self.cleaned(False)
-        self.build(ns)
-
-    def remove(self, block_label):
-        for block in self.block.values():
-            if block_label in block.child:
-                block.child.remove(block_label)
-            if block_label in block.father:
-                block.father.remove(block_label)
-
-    def coaleasce_blocks(self):
-        for block in self.block.values():
-            if len(block.child) == 1:
-                childlbl = list(block.child)[0]
-                child = self.block[childlbl]
-                if (len(child.father) != 1) or (childlbl == self.entry_label):
-                    continue
-                if block.instructions[-1].instruction.opcode == 'jmp':
-                    block.instructions[-1].instruction.opcode = 'nop'
-                    block.union(child)
-                    self.block.pop(childlbl)
-                    self.remove(childlbl)
-                    return (block.label, childlbl)
-        return False
-
+        self.build(self.cleaned(False))
+        self.remove_unreachable()
+
+    # Removes the blocks that cannot be reached from the entry, and their jumps
+    def remove_unreachable(self):
+        reached = [False] * len(self.blocks)
+        reached[self.entry.id] = True
+        stack = [self.entry]
+        while stack:
+            for child_id in stack.pop().succ:
+                if not reached[child_id]:
+                    reached[child_id] = True
+                    stack.append(self.blocks[child_id])
+        for block in self.blocks:
+            if block is not None and not reached[block.id]:
+                for child_id in block.succ:
+                    if reached[child_id]:
+                        self.blocks[child_id].pred.pop(block.id, None)
+                self.blocks[block.id] = None
+                del self.index[block.label]
+
+    # Moves the instructions and the jumps of child, the single successor of block reached
+    # by its final jmp, to the end of block
+    def merge(self, block, child):
+        self.remove_edge(block, child)
+        block.instructions.pop()
+        block.instructions += child.instructions[1:]
+        for grandchild_id in set(child.succ):
+            grandchild = self.blocks[grandchild_id]
+            count = grandchild.pred.pop(child.id)
+            grandchild.pred[block.id] = grandchild.pred.get(block.id, 0) + count
+        block.succ = child.succ
+        self.blocks[child.id] = None
+        del self.index[child.label]
+
+    # Merges each block into its predecessor when it is reached by a single jump, the final
+    # jmp of a predecessor with no other successor. The blocks are in layout order, so
+    # a chain is merged into its first block and each instruction is moved at most once
     def coaleasce(self):
-        cset = set()
-        while True:
-            cblocks = self.coaleasce_blocks()
-            self.clean_dead_code()
-            if cblocks and (cblocks not in cset):
-                cset.add(cblocks)
-            else:
-                break
+        for block in self.blocks:
+            while block is not None and len(block.succ) == 1 and block.instructions[-1].opcode == 'jmp':
+                child = self.blocks[block.succ[0]]
+                if (child is self.entry) or (child is block) or not child.only_father(block):
+                    break
+                self.merge(block, child)
 
-    def optimize(self):
-        self.jump_thread()
-        self.clean_dead_code()
-        self.coaleasce()
+    def optimize(self, stats=NO_STATS):
+        with stats.phase('cfg.jump_thread'):
+            self.jump_thread()
+        with stats.phase('cfg.clean_dead_code'):
+            self.clean_dead_code()
+        with stats.phase('cfg.coaleasce'):
+            self.coaleasce()
 
-def tac_cfopt(filename):
+# Optimises the procedures of the TAC program decls (Gvar and Proc objects, see tac.py),
+# returns the global variables and the optimised procedures
+def optimize_tac(decls, stats=NO_STATS):
     gvars, procs = [], []
-    name = filename[:-8]
-    with open(filename, 'r') as fp:
-        js_obj = json.load(fp)
-    
-    tac = []
-    for obj in js_obj:
-        if "proc" in obj.keys():
-            taco = []
-            for line in obj["body"]:
-                arg1, arg2 = None, None
-                args = line["args"]
-                if len(args) == 1 or len(args) == 2:
-                    arg1 = args[0]
-                    if len(args) == 2:
-                        arg2 = args[1]
-                taco.append(Instr(line["opcode"], arg1, arg2, line["result"]))
-            tac.append(ProcDec(obj["proc"], obj["args"], None, taco, None, None))
-        elif "var" in obj:
-            tac.append(StatementVarDecl(obj["var"], obj["init"], None, None, None))
-
-    for decl in tac:
-        if isinstance(decl, ProcDec):
+
+    for decl in decls:
+        if isinstance(decl, Proc):
             if decl.body == []:
-                procs.append(ProcDec(decl.name, decl.args, None, [], None, None))
+                procs.append(Proc(decl.name, decl.args, []))
                 continue
-            
-            cfg = ControlFlowGraph(decl.body, decl.name)
-            cfg.optimize()
-            proc_instrs = cfg.cleaned()
-            procs.append(ProcDec(decl.name, decl.args, None, proc_instrs, None, None))
 
-        elif isinstance(decl, StatementVarDecl):
+            with stats.phase('cfg.build'):
+                cfg = ControlFlowGraph(decl.body, decl.name)
+            stats.size('basic blocks', len(cfg.blocks))
+            cfg.optimize(stats)
+            with stats.phase('cfg.linearize'):
+                proc_instrs = cfg.cleaned()
+            stats.size('optimised TAC instructions', len(proc_instrs))
+            procs.append(Proc(decl.name, decl.args, proc_instrs))
+
+        elif isinstance(decl, Gvar):
             gvars.append(decl)
 
+    return gvars, procs
+
+
+def tac_cfopt(filename):
+    name = filename[:-8]
+    with open(filename, 'r') as fp:
+        gvars, procs = load_tac(json.load(fp))
+    gvars, procs = optimize_tac(gvars + procs)
+
     with open(f'{name}tac_opt.json', 'w') as tac_file:
-        tac = [i.to_tac() for i in gvars + procs]
-        tac_file.write(json.dumps(tac))
+        tac_file.write(json.dumps(dump_tac(gvars + procs)))
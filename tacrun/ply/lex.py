@@ -144,6 +144,7 @@ class Lexer:
             for key, ef in self.lexstateerrorf.items():
                 c.lexstateerrorf[key] = getattr(object, ef.__name__)
             c.lexmodule = object
+            c.begin(c.lexstate)
         return c
 
     # ------------------------------------------------------------
@@ -64,7 +64,13 @@
 import re
 import types
 import sys
+import os
 import inspect
+import hashlib
+import pickle
+import tempfile
+
+__tabversion__ = '4.0-cache1'
 
 #-----------------------------------------------------------------------------
 #                     === User configurable parameters ===
@@ -580,6 +586,93 @@ class LRParser:
             # If we'r here, something really bad happened
             raise RuntimeError('yacc: internal parser error!!!\n')
 
+# -----------------------------------------------------------------------------
+#                           === LR Table Cache ===
+#
+# Generating the LALR tables is by far the most expensive step of yacc(), and
+# the tables only depend on the grammar itself.  Tables are therefore keyed by
+# a hash of the grammar signature, remembered for the life of the process and,
+# if a tabcache directory is given to yacc(), pickled there for later runs.
+# -----------------------------------------------------------------------------
+
+_lrtables = {}
+
+# Stripped down version of Production holding only what the parser needs
+class MiniProduction(object):
+    def __init__(self, str, name, len, func, file, line):
+        self.name     = name
+        self.len      = len
+        self.func     = func
+        self.callable = None
+        self.file     = file
+        self.line     = line
+        self.str      = str
+
+    def __str__(self):
+        return self.str
+
+    def __repr__(self):
+        return 'MiniProduction(%s)' % self.str
+
+    # Bind the production function name to a callable
+    def bind(self, pdict):
+        if self.func:
+            self.callable = pdict[self.func]
+
+# LR tables rebuilt from the cache.  Provides the attributes LRParser reads.
+class CachedLRTable(object):
+    def __init__(self, action, goto, productions):
+        self.lr_action      = action
+        self.lr_goto        = goto
+        self.lr_productions = [MiniProduction(*p) for p in productions]
+
+    def bind_callables(self, pdict):
+        for p in self.lr_productions:
+            p.bind(pdict)
+
+def table_key(signature):
+    data = (__tabversion__ + signature).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()[:24]
+
+def table_file(tabcache, key):
+    return os.path.join(tabcache, 'parsetab-%s.pickle' % key)
+
+# Return the cached (action, goto, productions) for key, or None
+def read_table(tabcache, key):
+    if key in _lrtables:
+        return _lrtables[key]
+    if tabcache is None:
+        return None
+    try:
+        with open(table_file(tabcache, key), 'rb') as f:
+            data = pickle.load(f)
+    except Exception:
+        return None
+    if not isinstance(data, tuple) or len(data) != 5 or data[:2] != (__tabversion__, key):
+        return None
+    _lrtables[key] = data[2:]
+    return _lrtables[key]
+
+# Remember the tables of lr under key.  The file is written to a temporary
+# name first and renamed, so concurrent builds never see a partial table.
+def write_table(tabcache, key, lr, errorlog):
+    prods = [(p.str, p.name, p.len, p.func, p.file, p.line) for p in lr.lr_productions]
+    _lrtables[key] = (lr.lr_action, lr.lr_goto, prods)
+    if tabcache is None:
+        return
+    try:
+        os.makedirs(tabcache, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(dir=tabcache, prefix='.parsetab-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((__tabversion__, key) + _lrtables[key], f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, table_file(tabcache, key))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+    except OSError as e:
+        errorlog.warning("Couldn't write parse table cache to %r. %s", tabcache, e)
+
 # -----------------------------------------------------------------------------
 #                          === Grammar Representation ===
 #
@@ -2270,7 +2363,7 @@ class ParserReflect(object):
 
 def yacc(*, debug=yaccdebug, module=None, start=None,
          check_recursion=True, optimize=False, debugfile=debug_file,
-         debuglog=None, errorlog=None):
+         debuglog=None, errorlog=None, tabcache=None):
 
     # Reference to the parsing method of the last built parser
     global parse
@@ -2303,6 +2396,18 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
     if pinfo.error:
         raise YaccError('Unable to build parser')
 
+    # Reuse previously generated tables if the grammar has not changed.  The
+    # rule function names are part of the key since the tables refer to them.
+    key = table_key(pinfo.signature() + ' '.join(f[2] for f in pinfo.pfuncs))
+    if not debug:
+        tables = read_table(tabcache, key)
+        if tables is not None:
+            lr = CachedLRTable(*tables)
+            lr.bind_callables(pinfo.pdict)
+            parser = LRParser(lr, pinfo.error_func)
+            parse = parser.parse
+            return parser
+
     if debuglog is None:
         if debug:
             try:
@@ -2474,6 +2579,8 @@ def yacc(*, debug=yaccdebug, module=None, start=None,
                 errorlog.warning('Rule (%s) is never reduced', rejected)
                 warned_never.append(rejected)
 
+    write_table(tabcache, key, lr, errorlog)
+
     # Build the parser
     lr.bind_callables(pinfo.pdict)
     parser = LRParser(lr, pinfo.error_func)
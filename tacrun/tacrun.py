@@ -4,136 +4,14 @@
 Three Address Code (TAC) intermediate representation
 """
 
-from ply import lex, yacc
-from io import StringIO
+import os
+import sys
 
-# ------------------------------------------------------------------------------
+from ply import lex, yacc
 
-class Instr:
-  __slots__ = ('iid', 'result', 'opcode', 'args', 'arg1', 'arg2')
-  def __init__(self, result, opcode, args):
-    self.result = result
-    self.opcode = opcode
-    self.args = tuple(args)
-    self.arg1 = None if len(self.args) < 1 else self.args[0]
-    self.arg2 = None if len(self.args) < 2 else self.args[1]
-
-  def __hash__(self):
-    return hash(id(self))
-
-  def __eq__(self, other):
-    return self is other
-
-  @staticmethod
-  def _isvar(thing):
-    return ( isinstance(thing, str) and \
-             len(thing) > 0 and \
-             (thing[0] == '%' or thing[0] == '@') )
-
-  @staticmethod
-  def _isint(thing):
-    return isinstance(thing, int)
-
-  @staticmethod
-  def _islabel(thing):
-    return ( isinstance(thing, str) and \
-             thing.startswith('%.L') )
-
-  @staticmethod
-  def _isglobal(thing):
-    return ( isinstance(thing, str) and \
-             not thing.startswith('%') )
-
-  @staticmethod
-  def load(js_obj):
-    opcode = js_obj.get('opcode', None)
-    assert opcode is not None
-    args = js_obj.get('args', ())
-    result = js_obj.get('result', None)
-    return Instr(result, opcode, args)
-
-  @property
-  def js_obj(self):
-    """A basic Python object ready to JSONify with json.dump()"""
-    return {'opcode': self.opcode,
-            'args': self.args,
-            'result': self.result}
-
-  def __repr__(self):
-    return f'Instr.load({self.js_obj})'
-
-  def __str__(self):
-    result = StringIO()
-    if self.opcode == 'label':
-      result.write(f'{self.arg1}:')
-    else:
-      result.write('  ')
-      if self.result != None:
-        result.write(f'{self.result} = ')
-      result.write(f'{self.opcode}')
-      if self.arg1 != None:
-        result.write(f' {self.arg1}')
-        if self.arg2 != None:
-          result.write(f', {self.arg2}')
-      result.write(';')
-    return result.getvalue()
-
-class Proc:
-  def __init__(self, name, args, body):
-    self.name = name
-    self.body = body or []
-    self.args = tuple(args)
-
-  @staticmethod
-  def load(js_obj):
-    name = js_obj.get('proc', None)
-    if not name: return
-    assert isinstance(name, str)
-    assert name.startswith('@')
-    args = js_obj.get('args', ())
-    body = [Instr.load(i) for i in js_obj.get('body', [])]
-    return Proc(name, args, body)
-
-  @property
-  def js_obj(self):
-    return {'proc': self.name,
-            'args': self.args,
-            'body': [i.js_obj for i in self.body]}
-
-  def __repr__(self):
-    return f'Proc.load({self.js_obj})'
-
-  def __str__(self):
-    result = StringIO()
-    result.write(f'proc {self.name}({", ".join(self.args)}):\n')
-    for instr in self.body:
-      print(instr, file=result)
-    return result.getvalue()
-
-class Gvar:
-  def __init__(self, name, init):
-    self.name = name
-    self.init = init
-
-  @staticmethod
-  def load(js_obj):
-    name = js_obj.get('var', None)
-    if not name: return
-    assert isinstance(name, str)
-    assert name.startswith('@')
-    init = js_obj.get('init', ())
-    return Gvar(name, init)
-
-  @property
-  def js_obj(self):
-    return {'var': self.name,
-            'init': self.init}
-
-  def __repr__(self):
-    return f'Gvar.load({self.js_obj})'
-
-  def __str__(self):
-    return f'var {self.name} = {self.init};\n'
+# The Instr, Proc and Gvar classes are the ones of the compiler (tac.py)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tac import Instr, Proc, Gvar, from_tac
 
 # ------------------------------------------------------------------------------
 
@@ -175,7 +53,7 @@ class Lexer:
   def t_NUM64(self,t):
     r'0|-?[1-9][0-9]*'
     t.value = int(t.value)
-    if t.value & 0xffffffffffffffff != t.value:
+    if not -(1 << 63) <= t.value < (1 << 63):
       print(f'{self.provenance}:{t.lineno}:'
             f'Error: numerical literal {t.value} not in [{-1<<63}, {1<<63})')
       raise SyntaxError('immint')
@@ -186,16 +64,24 @@ class Lexer:
           f'Warning: skipping illegal character: {t.value[0]}')
     t.lexer.skip(1)
 
+  # built once, then cloned for every new Lexer
+  _master = None
+
   def __init__(self, text, provenance="<unknown>"):
     self.text = text
     self.provenance = provenance
-    self.lexer = ply.lex.lex(module=self)
+    if Lexer._master is None:
+      Lexer._master = ply.lex.lex(module=self)
+    self.lexer = Lexer._master.clone(self)
     self.lexer.input(self.text)
 
 # ------------------------------------------------------------------------------
 
 import ply.yacc
 
+# LALR tables are cached here between runs (see ply.yacc.read_table)
+tabcache = os.path.join(os.path.dirname(os.path.abspath(__file__)), '__pycache__')
+
 class Parser:
   tokens = Lexer.tokens
 
@@ -248,11 +134,11 @@ class Parser:
   def p_instr(self, p):
     '''instr : lhs OPCODE args SEMICOLON'''
     lhs, opcode, args = p[1], p[2], p[3]
-    p[0] = Instr(lhs, opcode, args)
+    p[0] = Instr(opcode, *args[:2], dest=lhs, arg3=args[2] if len(args) > 2 else None)
 
   def p_label(self, p):
     '''instr : LABEL COLON'''
-    p[0] = Instr(None, 'label', [p[1]])
+    p[0] = Instr('label', p[1])
 
   def p_lhs(self, p):
     '''lhs : TEMP EQ
@@ -261,12 +147,14 @@ class Parser:
     p[0] = None if len(p) == 1 else p[1]
 
   def p_args(self, p):
-    '''args : arg COMMA arg
+    '''args : arg COMMA arg COMMA arg
+            | arg COMMA arg
             | arg
             | '''
     if len(p) == 1: p[0] = ()
     elif len(p) == 2: p[0] = (p[1],)
-    else: p[0] = (p[1], p[3])
+    elif len(p) == 4: p[0] = (p[1], p[3])
+    else: p[0] = (p[1], p[3], p[5])
 
   def p_arg(self, p):
     '''arg : TEMP
@@ -282,7 +170,8 @@ class Parser:
 
   def __init__(self, lexer):
     self.lexer = lexer
-    self.parser = ply.yacc.yacc(module=self, start='program')
+    self.parser = ply.yacc.yacc(module=self, start='program',
+                                tabcache=tabcache)
 
   def parse(self):
     return self.parser.parse(lexer=self.lexer.lexer, tracking=True)
@@ -318,17 +207,21 @@ unops = {
   'neg' : (lambda u: twoc(-untwoc(u))),
   'not' : (lambda u: twoc(~untwoc(u))),
 }
+# jz u, L compares u to 0, jz u, v, L compares u to v
 jumps = {
-  'jz':   (lambda k: k == 0),
-  'jnz':  (lambda k: k != 0),
-  'jl':   (lambda k: untwoc(k) < 0),
-  'jle':  (lambda k: untwoc(k) <= 0),
-  'jnl':  (lambda k: untwoc(k) >= 0),
-  'jnle': (lambda k: untwoc(k) > 0),
+  'jz':   (lambda u, v: u == v),
+  'jnz':  (lambda u, v: u != v),
+  'jl':   (lambda u, v: untwoc(u) < untwoc(v)),
+  'jle':  (lambda u, v: untwoc(u) <= untwoc(v)),
+  'jnl':  (lambda u, v: untwoc(u) >= untwoc(v)),
+  'jnle': (lambda u, v: untwoc(u) > untwoc(v)),
 }
 
+# setl u, v is 1 if jl u, v, L would jump, else 0
+sets = {'set' + op[1:]: test for op, test in jumps.items()}
+
 class TempMap(dict):
-  """Mapping temporaries to values"""
+  """Mapping temporaries to values, the immediates are their own value"""
 
   def __init__(self, gvars):
     super().__init__()
@@ -343,6 +236,9 @@ class TempMap(dict):
       0 <= val <= 0xffffffffffffffff
 
   def __getitem__(self, tmp):
+    if isinstance(tmp, int):
+      # an immediate operand
+      return twoc(tmp)
     if tmp.startswith('@'):
       return self.gvars[tmp].init
     return super().__getitem__(tmp)
@@ -395,10 +291,11 @@ def execute(gvars, procs, proc_name, args, **kwargs):
         raise RuntimeError(f'Unknown jump destination {instr.arg1}')
       pc = labels[instr.arg1]
     elif instr.opcode in jumps:
-      k = values[instr.arg1]
-      if instr.arg2 not in labels:
-        raise RuntimeError(f'Unknown jump destination {instr.arg2}')
-      pc = labels[instr.arg2] if jumps[instr.opcode](k) else pc + 1
+      u = values[instr.arg1]
+      v = 0 if instr.arg3 is None else values[instr.arg2]
+      if instr.target not in labels:
+        raise RuntimeError(f'Unknown jump destination {instr.target}')
+      pc = labels[instr.target] if jumps[instr.opcode](u, v) else pc + 1
     elif instr.opcode == 'const':
       if not isinstance(instr.arg1, int):
         print(f'Missing or bad argument: {instr.arg1}')
@@ -445,6 +342,11 @@ def execute(gvars, procs, proc_name, args, **kwargs):
       if show_proc:
         print(f'// {indent}{proc_desc} --> {retval}')
       return retval
+    elif instr.opcode in sets:
+      u = values[instr.arg1]
+      v = values[instr.arg2]
+      values[instr.result] = 1 if sets[instr.opcode](u, v) else 0
+      pc += 1
     elif instr.opcode in binops:
       u = values[instr.arg1]
       v = values[instr.arg2]
@@ -475,8 +377,7 @@ def load_tac(tac_file):
       parser = Parser(lexer)
       return parser.parse()
     elif tac_file.endswith('.tac.json'):
-      return [Gvar.load(obj) or Proc.load(obj) \
-              for obj in json.load(fp)]
+      return [from_tac(obj) for obj in json.load(fp)]
     else:
       raise ValueError(f'TAC file must be a .tac or a .tac.json')
 
@@ -515,7 +416,7 @@ if __name__ == '__main__':
     prog = load_tac(srcfile)
     if args.dump_json and srcfile.endswith('.tac'):
       with open(srcfile + '.json', 'w') as fp:
-        json.dump([tlv.js_obj for tlv in prog], fp, indent=2)
+        json.dump([tlv.to_tac() for tlv in prog], fp, indent=2)
     for tlv in prog:
       if tlv.name in seen:
         raise RuntimeError(f'Repeated definition of {tlv.name}')
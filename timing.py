@@ -0,0 +1,182 @@
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+"""
+.
+The PassStats class collects the per-phase report of --time-passes and --mem-report.
+
+Phases: timed with `with stats.phase(name):`, the time spent in nested phases (such
+        as the scanner called by the parser, see time_lexer) is not counted twice
+Memory: with mem=True, the peak of the memory allocated during each phase (tracemalloc),
+        the peaks of the phases nested in it included
+Sizes: the size of the IR at each stage boundary (AST nodes, TAC instructions, blocks)
+
+Phases repeated for every procedure (the CFG passes) add up. NullStats is used when
+no report is asked for and does nothing.
+"""
+
+
+class NullStats:
+    enabled = False
+
+    def phase(self, name):
+        return nullcontext()
+
+    def time_lexer(self, name, lexer):
+        pass
+
+    def size(self, name, value):
+        pass
+
+
+class PassStats(NullStats):
+    enabled = True
+
+    def __init__(self, mem=False):
+        self.mem = mem
+        self.times = {}
+        self.calls = {}
+        self.peaks = {}
+        self.sizes = {}
+        self.nested = [0.0]
+        # [base, peak] of the phases being traced, the peaks as absolute traced sizes
+        self.traced = []
+
+    def add_time(self, name, elapsed):
+        self.times[name] = self.times.get(name, 0.0) + elapsed
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    @contextmanager
+    def phase(self, name):
+        if self.mem:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            # reset_peak() would lose the peak of the enclosing phase so far, it is kept
+            if self.traced:
+                self.traced[-1][1] = max(self.traced[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.traced.append([current, current])
+
+        self.nested.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = self.nested.pop()
+            self.nested[-1] += elapsed
+            self.add_time(name, elapsed - inner)
+
+            if self.mem:
+                base, peak = self.traced.pop()
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                self.peaks[name] = max(self.peaks.get(name, 0), peak - base)
+                if self.traced:
+                    self.traced[-1][1] = max(self.traced[-1][1], peak)
+
+    # Makes the token() method of lexer scan the tokens by batches of size, each one in a
+    # phase name: timing every token would cost more than scanning it. An error of the
+    # scanner is raised when the parser reaches it, input() drops the tokens left
+    def time_lexer(self, name, lexer, size=4096):
+        token, start = lexer.token, lexer.input
+        tokens = []
+        pos = 0
+        error = None
+
+        def next_token():
+            nonlocal tokens, pos, error
+            if pos == len(tokens):
+                if error is None:
+                    tokens, pos = [], 0
+                    with self.phase(name):
+                        try:
+                            while len(tokens) < size:
+                                tok = token()
+                                tokens.append(tok)
+                                if tok is None:
+                                    break
+                        except Exception as e:
+                            error = e
+                if pos == len(tokens):
+                    e, error = error, None
+                    raise e
+            tok = tokens[pos]
+            pos += 1
+            return tok
+
+        def input(*args, **kwargs):
+            nonlocal tokens, pos, error
+            tokens, pos, error = [], 0, None
+            start(*args, **kwargs)
+
+        lexer.token = next_token
+        lexer.input = input
+
+    def size(self, name, value):
+        self.sizes[name] = self.sizes.get(name, 0) + value
+
+    # Adds the report of another compilation, as returned by to_json()
+    def merge(self, js_obj):
+        for name, p in js_obj['phases'].items():
+            self.times[name] = self.times.get(name, 0.0) + p['seconds']
+            self.calls[name] = self.calls.get(name, 0) + p['calls']
+            if 'peak_bytes' in p:
+                self.peaks[name] = max(self.peaks.get(name, 0), p['peak_bytes'])
+        for name, value in js_obj['sizes'].items():
+            self.size(name, value)
+
+    def to_json(self):
+        phases = {}
+        for name, seconds in self.times.items():
+            phases[name] = {'seconds': seconds, 'calls': self.calls[name]}
+            if name in self.peaks:
+                phases[name]['peak_bytes'] = self.peaks[name]
+        return {'phases': phases, 'sizes': dict(self.sizes)}
+
+    def table(self):
+        total = sum(self.times.values()) or 1.0
+        header = f'{"phase":<28}{"time (ms)":>12}{"%":>8}{"calls":>8}'
+        if self.mem:
+            header += f'{"peak (KiB)":>14}'
+        out = [header, '-' * len(header)]
+        for name, seconds in self.times.items():
+            line = f'{name:<28}{seconds * 1000:>12.3f}{100 * seconds / total:>8.1f}{self.calls[name]:>8}'
+            if self.mem:
+                line += f'{self.peaks.get(name, 0) / 1024:>14.1f}'
+            out.append(line)
+        out.append('-' * len(header))
+        out.append(f'{"total":<28}{total * 1000:>12.3f}')
+        if self.sizes:
+            out.append('')
+            out.append(f'{"IR size":<28}{"count":>12}')
+            for name, value in self.sizes.items():
+                out.append(f'{name:<28}{value:>12}')
+        return '\n'.join(out)
+
+    def dump(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_json(), f, indent=2)
+
+
+NO_STATS = NullStats()
+
+
+# Number of AST nodes (declarations, statements and expressions) reachable from node,
+# walked with an explicit stack as the tree can be deeper than the recursion limit
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, (list, tuple)):
+            stack.extend(node)
+        elif hasattr(node, 'lineno'):
+            count += 1
+            for name in node.__slots__:
+                v = getattr(node, name, None)
+                if isinstance(v, (list, tuple)) or hasattr(v, 'lineno'):
+                    stack.append(v)
+    return count
@@ -0,0 +1,34 @@
+from types import GeneratorType
+
+"""
+.
+The trampoline function runs a recursive algorithm written as generators on an explicit
+stack, so deeply nested programs do not hit the recursion limit of Python.
+
+Instead of calling itself, a step yields the work it needs done first and receives
+its result: `value = yield child.check(ctx)`. If what is yielded is a generator, it
+is pushed on the stack and run until it returns, otherwise it is already the result
+(the leaves of the tree are plain functions) and is sent straight back.
+"""
+
+
+def trampoline(gen):
+    if type(gen) is not GeneratorType:
+        return gen
+
+    stack = [gen]
+    value = None
+    while stack:
+        try:
+            work = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+            continue
+
+        if type(work) is GeneratorType:
+            stack.append(work)
+            value = None
+        else:
+            value = work
+    return value